@@ -0,0 +1,742 @@
+"""
+Benchmarks for the managers, the import commands and the ID allocators
+
+Seeds a database with users, groups and memberships for every scale and measures each operation. The results are
+written as JSON, so runs can be compared with --baseline:
+
+    python benchmarks/run.py --scale 10000 --scale 100000 -o results.json
+    python benchmarks/run.py --scale 10000 --baseline results.json
+
+The database is the one of the tests (pam_mysql_manager-test.conf and the PAMMYSQL_TEST_MYSQL_* variables) or, with
+--throwaway, a MariaDB/MySQL server started on a temporary data directory. The tables are dropped and created again,
+never point this at a production database.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import configparser
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+import click  # noqa: E402
+import pymysql  # noqa: E402
+from click.testing import CliRunner  # noqa: E402
+
+from pammysqltools.helpers import IdAllocator, find_new_uid, find_new_gid  # noqa: E402
+from pammysqltools.manager import (UserManager, GroupManager, GroupListManager, AccountManager,  # noqa: E402
+                                   SchemaManager)
+from pammysqltools.scripts import importusers, importgroups  # noqa: E402
+from pammysqltools.settings import Settings  # noqa: E402
+
+clock = getattr(time, 'perf_counter', time.time)
+
+#: First UID and GID of the seeded users and groups
+UID_BASE = 100000
+GID_BASE = 100000
+
+#: Number of memberships of every seeded user
+MEMBERSHIPS = 3
+
+#: Maximum number of members of the group renumbered by the large group benchmark
+LARGE_GROUP = 50000
+
+#: login.defs for the allocator benchmarks, the range covers the seeded IDs
+DEFS = Settings({'UID_MIN': UID_BASE, 'UID_MAX': UID_BASE + 4000000, 'GID_MIN': GID_BASE,
+                 'GID_MAX': GID_BASE + 4000000})
+
+#: The registered benchmarks as (name, function, needs a database)
+BENCHMARKS = list()
+
+
+def benchmark(name, db=True):
+    """
+    Registers a benchmark. The function gets a :class:`Context` and returns a list of latencies in seconds or a tuple
+    of (latencies, operations per latency) for benchmarks that time whole batches.
+    """
+
+    def decorator(func):
+        BENCHMARKS.append((name, func, db))
+        return func
+
+    return decorator
+
+
+def summarize(latencies, per_sample=1):
+    """
+    Returns the throughput and the latency percentiles of the measured samples
+
+    :param latencies: The duration of every sample in seconds
+    :type latencies: list
+    :param per_sample: Operations per sample
+    :type per_sample: int
+    :rtype: dict
+    """
+    latencies = sorted(latencies)
+    total = sum(latencies)
+
+    def percentile(q):
+        return latencies[int(round(q * (len(latencies) - 1)))] * 1000.0 if latencies else None
+
+    return dict(samples=len(latencies), ops=len(latencies) * per_sample, seconds=total,
+                ops_per_sec=len(latencies) * per_sample / total if total else None,
+                p50_ms=percentile(0.5), p95_ms=percentile(0.95), p99_ms=percentile(0.99),
+                max_ms=latencies[-1] * 1000.0 if latencies else None)
+
+
+def timed(func, arguments):
+    """
+    Calls func for every tuple of arguments and returns the latencies
+    """
+    latencies = list()
+    for args in arguments:
+        start = clock()
+        func(*args)
+        latencies.append(clock() - start)
+    return latencies
+
+
+class Context(object):
+    """
+    The state shared by the benchmarks of one scale
+
+    :param config: The config with the [database] section
+    :type config: ConfigParser
+    :param dbs: The connection, None for --no-db
+    :type dbs: pymysql.Connection
+    :param scale: Number of seeded users
+    :type scale: int
+    :param ops: Number of operations per benchmark
+    :type ops: int
+    """
+
+    def __init__(self, config, dbs, scale, ops, seed=0):
+        self.config = config
+        self.dbs = dbs
+        self.scale = scale
+        self.ops = ops
+        self.random = random.Random(seed)
+        self.groups = max(10, scale // 10)
+        self.serial = 0
+
+    def users(self):
+        """
+        Returns random (username, uid) pairs of seeded users
+        """
+        indexes = [self.random.randrange(self.scale) for _ in range(self.ops)]
+        return [(username(i), UID_BASE + i) for i in indexes]
+
+    def gids(self):
+        """
+        Returns random GIDs of seeded groups
+        """
+        return [GID_BASE + self.random.randrange(self.groups) for _ in range(self.ops)]
+
+    def new_users(self, count=None):
+        """
+        Returns rows of users that don't exist yet
+        """
+        rows = list()
+        for _ in range(count or self.ops):
+            self.serial += 1
+            rows.append(user_row(self.scale * 2 + self.serial, self.groups))
+        return rows
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Rolls back the writes of a benchmark so every benchmark sees the seeded tables
+        """
+        try:
+            yield
+        finally:
+            self.dbs.rollback()
+
+
+def username(index):
+    return 'bench%07d' % index
+
+
+def user_row(index, groups):
+    return dict(username=username(index), uid=UID_BASE + index, gid=GID_BASE + index % groups,
+                gecos='Benchmark user %d' % index, homedir='/home/%s' % username(index), shell='/bin/sh',
+                password='!', lstchg=17000, mini=0, maxi=99999, warn=7, inact=-1, expire=-1, flag=-1)
+
+
+def seed(ctx, batch_size=5000):
+    """
+    Creates the tables and fills them with ctx.scale users, ctx.groups groups and :data:`MEMBERSHIPS` memberships per
+    user
+
+    :return: The seconds it took
+    :rtype: float
+    """
+    start = clock()
+    schema = SchemaManager(ctx.config, ctx.dbs)
+    with ctx.dbs.cursor() as cur:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for table in schema.columns:
+                cur.execute("DROP TABLE IF EXISTS `%s`" % schema._table(table))
+    schema.createtables()
+
+    UserManager(ctx.config, ctx.dbs).addusers((user_row(i, ctx.groups) for i in range(ctx.scale)),
+                                              batch_size=batch_size, commit=True)
+    GroupManager(ctx.config, ctx.dbs).addgroups((dict(name='benchgroup%07d' % i, gid=GID_BASE + i, password='!')
+                                                 for i in range(ctx.groups)), batch_size=batch_size, commit=True)
+    GroupListManager(ctx.config, ctx.dbs).addgroupusers(
+        (dict(username=username(i), gid=GID_BASE + (i + n * (ctx.groups // MEMBERSHIPS)) % ctx.groups)
+         for i in range(ctx.scale) for n in range(min(MEMBERSHIPS, ctx.groups))), batch_size=batch_size, commit=True)
+    ctx.dbs.commit()
+    return clock() - start
+
+
+@benchmark('UserManager.getuserbyuid')
+def bench_getuserbyuid(ctx):
+    return timed(UserManager(ctx.config, ctx.dbs).getuserbyuid, ((uid,) for name, uid in ctx.users()))
+
+
+@benchmark('UserManager.getuserbyusername')
+def bench_getuserbyusername(ctx):
+    return timed(UserManager(ctx.config, ctx.dbs).getuserbyusername, ((name,) for name, uid in ctx.users()))
+
+
+@benchmark('UserManager.getuserbyusername (cached)')
+def bench_getuserbyusername_cached(ctx):
+    from pammysqltools.cache import LookupCache
+    um = UserManager(ctx.config, ctx.dbs, cache=LookupCache(maxsize=ctx.ops))
+    users = ctx.users()[:max(1, ctx.ops // 10)] * 10
+    return timed(um.getuserbyusername, ((name,) for name, uid in users))
+
+
+@benchmark('UserManager.getalluids')
+def bench_getalluids(ctx):
+    um = UserManager(ctx.config, ctx.dbs)
+    return timed(um.getalluids, [()] * max(1, ctx.ops // 100))
+
+
+@benchmark('UserManager.getconflicts')
+def bench_user_getconflicts(ctx):
+    um = UserManager(ctx.config, ctx.dbs)
+    return timed(um.getconflicts, ((name + 'x', uid) for name, uid in ctx.users()))
+
+
+@benchmark('UserManager.adduser')
+def bench_adduser(ctx):
+    um = UserManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(lambda row: um.adduser(**row), ((row,) for row in ctx.new_users()))
+
+
+@benchmark('UserManager.addusers')
+def bench_addusers(ctx):
+    um = UserManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(um.addusers, [(ctx.new_users(1000),) for _ in range(max(1, ctx.ops // 1000))]), 1000
+
+
+@benchmark('UserManager.moduser')
+def bench_moduser(ctx):
+    um = UserManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(lambda name: um.moduser(username_old=name, shell='/bin/bash'),
+                     ((name,) for name, uid in ctx.users()))
+
+
+@benchmark('UserManager.modallgid')
+def bench_modallgid(ctx):
+    um = UserManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(um.modallgid, ((gid, gid) for gid in ctx.gids()[:max(1, ctx.ops // 10)]))
+
+
+@benchmark('UserManager.deluser')
+def bench_deluser(ctx):
+    um = UserManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(um.deluser, ((name,) for name, uid in set(ctx.users())))
+
+
+@benchmark('GroupManager.getgroupbyname')
+def bench_getgroupbyname(ctx):
+    return timed(GroupManager(ctx.config, ctx.dbs).getgroupbyname,
+                 (('benchgroup%07d' % (gid - GID_BASE),) for gid in ctx.gids()))
+
+
+@benchmark('GroupManager.getgroupbygid')
+def bench_getgroupbygid(ctx):
+    return timed(GroupManager(ctx.config, ctx.dbs).getgroupbygid, ((gid,) for gid in ctx.gids()))
+
+
+@benchmark('GroupManager.getallgids')
+def bench_getallgids(ctx):
+    return timed(GroupManager(ctx.config, ctx.dbs).getallgids, [()] * max(1, ctx.ops // 100))
+
+
+@benchmark('GroupManager.getconflicts')
+def bench_group_getconflicts(ctx):
+    gm = GroupManager(ctx.config, ctx.dbs)
+    return timed(gm.getconflicts, (('benchgroupx', gid) for gid in ctx.gids()))
+
+
+@benchmark('GroupManager.addgroup')
+def bench_addgroup(ctx):
+    gm = GroupManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(gm.addgroup, (('newgroup%07d' % i, GID_BASE + ctx.scale * 2 + i) for i in range(ctx.ops)))
+
+
+@benchmark('GroupManager.addgroups')
+def bench_addgroups(ctx):
+    gm = GroupManager(ctx.config, ctx.dbs)
+    batches = [([dict(name='newgroup%07d' % (b * 1000 + i), gid=GID_BASE + ctx.scale * 2 + b * 1000 + i)
+                 for i in range(1000)],) for b in range(max(1, ctx.ops // 1000))]
+    with ctx.transaction():
+        return timed(gm.addgroups, batches), 1000
+
+
+@benchmark('GroupManager.modgroup')
+def bench_modgroup(ctx):
+    gm = GroupManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(lambda gid: gm.modgroup('benchgroup%07d' % (gid - GID_BASE), None, None, '*'),
+                     ((gid,) for gid in ctx.gids()))
+
+
+@benchmark('GroupManager.delgroup')
+def bench_delgroup(ctx):
+    gm = GroupManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(gm.delgroup, ((gid,) for gid in set(ctx.gids())))
+
+
+@benchmark('GroupListManager.getgroupsforusername')
+def bench_getgroupsforusername(ctx):
+    glm = GroupListManager(ctx.config, ctx.dbs)
+    return timed(glm.getgroupsforusername, ((name,) for name, uid in ctx.users()))
+
+
+@benchmark('GroupListManager.addgroupuser')
+def bench_addgroupuser(ctx):
+    glm = GroupListManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(glm.addgroupuser, ((row['username'], row['gid']) for row in ctx.new_users()))
+
+
+@benchmark('GroupListManager.addgroupusers')
+def bench_addgroupusers(ctx):
+    glm = GroupListManager(ctx.config, ctx.dbs)
+    batches = [([dict(username=row['username'], gid=row['gid']) for row in ctx.new_users(1000)],)
+               for _ in range(max(1, ctx.ops // 1000))]
+    with ctx.transaction():
+        return timed(glm.addgroupusers, batches), 1000
+
+
+@benchmark('GroupListManager.delgroupuser')
+def bench_delgroupuser(ctx):
+    glm = GroupListManager(ctx.config, ctx.dbs)
+    with ctx.dbs.cursor() as cur:
+        cur.execute("SELECT `{username}`, `{gid}` FROM `{table}` ORDER BY RAND() LIMIT {ops}".format(
+            table=glm.table, ops=int(ctx.ops), **glm.mapping))
+        memberships = cur.fetchall()
+    with ctx.transaction():
+        return timed(glm.delgroupuser, memberships)
+
+
+@benchmark('GroupListManager.delallgroupuser')
+def bench_delallgroupuser(ctx):
+    glm = GroupListManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(glm.delallgroupuser, ((name,) for name, uid in set(ctx.users())))
+
+
+@benchmark('GroupListManager.modallgroupuser')
+def bench_modallgroupuser(ctx):
+    glm = GroupListManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(glm.modallgroupuser, ((name, name + 'x') for name, uid in set(ctx.users())))
+
+
+@benchmark('GroupListManager.modallgroupgid')
+def bench_modallgroupgid(ctx):
+    glm = GroupListManager(ctx.config, ctx.dbs)
+    gids = sorted(set(ctx.gids()[:max(1, ctx.ops // 10)]))
+    with ctx.transaction():
+        return timed(glm.modallgroupgid, ((gid, gid + ctx.scale * 2) for gid in gids))
+
+
+@benchmark('AccountManager.createaccount')
+def bench_createaccount(ctx):
+    am = AccountManager(ctx.config, ctx.dbs)
+    gids = ctx.gids()
+
+    def create(row, gid):
+        row = dict(row)
+        am.createaccount(groups=(gid,), usergroup=True, **row)
+
+    with ctx.transaction():
+        return timed(create, ((dict(row, gid=GID_BASE + ctx.scale * 2 + row['uid'] - UID_BASE), gid)
+                              for row, gid in zip(ctx.new_users(), gids)))
+
+
+@benchmark('AccountManager.moduser (rename)')
+def bench_account_moduser(ctx):
+    am = AccountManager(ctx.config, ctx.dbs)
+    with ctx.transaction():
+        return timed(lambda name: am.moduser(username_old=name, username=name + 'x'),
+                     ((name,) for name, uid in set(ctx.users())))
+
+
+@benchmark('AccountManager.modgroup (renumber)')
+def bench_account_modgroup(ctx):
+    am = AccountManager(ctx.config, ctx.dbs)
+    gids = sorted(set(ctx.gids()[:max(1, ctx.ops // 10)]))
+    with ctx.transaction():
+        return timed(lambda gid: am.modgroup('benchgroup%07d' % (gid - GID_BASE), gid=gid + ctx.scale * 2,
+                                             gid_old=gid), ((gid,) for gid in gids))
+
+
+@benchmark('groupmod renumber (separate statements)')
+def bench_separate_renumber(ctx):
+    # The three UPDATEs AccountManager.modgroup replaces, for comparison
+    um = UserManager(ctx.config, ctx.dbs)
+    gm = GroupManager(ctx.config, ctx.dbs)
+    glm = GroupListManager(ctx.config, ctx.dbs)
+    gids = sorted(set(ctx.gids()[:max(1, ctx.ops // 10)]))
+
+    def renumber(gid):
+        glm.modallgroupgid(gid, gid + ctx.scale * 2)
+        um.modallgid(gid, gid + ctx.scale * 2)
+        gm.modgroup('benchgroup%07d' % (gid - GID_BASE), None, gid + ctx.scale * 2, None)
+
+    with ctx.transaction():
+        return timed(renumber, ((gid,) for gid in gids))
+
+
+@benchmark('AccountManager.modgroup (large group)')
+def bench_account_modgroup_large(ctx):
+    # One group with up to LARGE_GROUP members and as many users with it as primary group, renumbered again and again
+    am = AccountManager(ctx.config, ctx.dbs)
+    members = min(ctx.scale, LARGE_GROUP)
+    gid = GID_BASE + ctx.scale * 3
+    with ctx.transaction():
+        am.gm.addgroup('benchlarge', gid)
+        am.glm.addgroupusers((dict(username=username(i), gid=gid) for i in range(members)), batch_size=5000)
+        with ctx.dbs.cursor() as cur:
+            cur.execute("UPDATE `{table}` SET `{gid}` = %s WHERE `id` <= %s".format(
+                table=am.um.table, gid=am.um.mapping['gid']), (gid, members))
+        gids = [gid + n for n in range(max(2, ctx.ops // 100) + 1)]
+        return timed(lambda old, new: am.modgroup('benchlarge', gid=new, gid_old=old), zip(gids, gids[1:]))
+
+
+@benchmark('IdAllocator.build', db=False)
+def bench_allocator_build(ctx):
+    ids = list(range(UID_BASE, UID_BASE + ctx.scale))
+    ctx.random.shuffle(ids)
+    return timed(IdAllocator, [(ids,)] * max(1, ctx.ops // 100))
+
+
+@benchmark('IdAllocator.find_free', db=False)
+def bench_allocator_find_free(ctx):
+    # Every freed ID leaves a hole the allocator has to find
+    ids = set(range(UID_BASE, UID_BASE + ctx.scale))
+    for _ in range(min(ctx.ops, ctx.scale // 2)):
+        ids.discard(UID_BASE + ctx.random.randrange(ctx.scale))
+    allocator = IdAllocator(ids)
+
+    def allocate():
+        allocator.add(allocator.find_free(UID_BASE, UID_BASE + ctx.scale * 2))
+
+    return timed(allocate, [()] * ctx.ops)
+
+
+@benchmark('find_new_uid')
+def bench_find_new_uid(ctx):
+    um = UserManager(ctx.config, ctx.dbs)
+
+    def allocate():
+        find_new_uid(False, allocator=IdAllocator(um.getalluids()), defs=DEFS)
+
+    return timed(allocate, [()] * max(1, ctx.ops // 100))
+
+
+@benchmark('find_new_gid')
+def bench_find_new_gid(ctx):
+    gm = GroupManager(ctx.config, ctx.dbs)
+
+    def allocate():
+        find_new_gid(False, allocator=IdAllocator(gm.getallgids()), defs=DEFS)
+
+    return timed(allocate, [()] * max(1, ctx.ops // 100))
+
+
+def import_config(ctx, directory):
+    """
+    Writes a config for the import commands whose tables are separate from the seeded ones
+    """
+    config = configparser.ConfigParser()
+    config.read_dict(ctx.config)
+    config.read_dict({'tables': {'user': 'bench_import_user', 'group': 'bench_import_group',
+                                 'grouplist': 'bench_import_grouplist'}, 'cache': {'size': '0'}})
+    schema = SchemaManager(config, ctx.dbs)
+    schema.createtables()
+    with ctx.dbs.cursor() as cur:
+        for table in schema.columns:
+            cur.execute("TRUNCATE TABLE `%s`" % schema._table(table))
+    ctx.dbs.commit()
+
+    path = os.path.join(directory, 'pam_mysql_manager.conf')
+    with open(path, 'w') as f:
+        config.write(f)
+    return path
+
+
+def invoke(command, args):
+    result = CliRunner().invoke(command, args, catch_exceptions=False)
+    if result.exit_code != 0:
+        raise RuntimeError('%s failed: %s' % (command.name, result.output))
+
+
+@benchmark('importusers')
+def bench_importusers(ctx):
+    directory = tempfile.mkdtemp()
+    try:
+        passwd = os.path.join(directory, 'passwd')
+        shadow = os.path.join(directory, 'shadow')
+        with open(passwd, 'w') as p, open(shadow, 'w') as s:
+            for i in range(ctx.scale):
+                row = user_row(i, ctx.groups)
+                p.write('{username}:x:{uid}:{gid}:{gecos}:{homedir}:{shell}\n'.format(**row))
+                s.write('{username}:!:{lstchg}:0:99999:7:::\n'.format(**row))
+
+        config = import_config(ctx, directory)
+        return timed(invoke, [(importusers, ['--passwd', passwd, '--shadow', shadow, '--config', config,
+                                             str(UID_BASE), str(UID_BASE + ctx.scale)])]), ctx.scale
+    finally:
+        shutil.rmtree(directory)
+
+
+@benchmark('importgroups')
+def bench_importgroups(ctx):
+    directory = tempfile.mkdtemp()
+    try:
+        group = os.path.join(directory, 'group')
+        gshadow = os.path.join(directory, 'gshadow')
+        members = dict()
+        for i in range(ctx.scale):
+            members.setdefault(i % ctx.groups, []).append(username(i))
+        with open(group, 'w') as g, open(gshadow, 'w') as gs:
+            for i in range(ctx.groups):
+                name = 'benchgroup%07d' % i
+                g.write('%s:x:%d:%s\n' % (name, GID_BASE + i, ','.join(members.get(i, []))))
+                gs.write('%s:!::\n' % name)
+
+        config = import_config(ctx, directory)
+        return timed(invoke, [(importgroups, ['--group', group, '--gshadow', gshadow, '--config', config,
+                                              str(GID_BASE), str(GID_BASE + ctx.groups)])]), ctx.groups
+    finally:
+        shutil.rmtree(directory)
+
+
+class ThrowawayServer(object):
+    """
+    A MariaDB or MySQL server on a temporary data directory that is removed on :meth:`stop`
+
+    :param prefix: Directory with the server binaries, by default they are searched in PATH
+    :type prefix: unicode
+    """
+
+    def __init__(self, prefix=None):
+        self.prefix = prefix
+        self.directory = None
+        self.process = None
+        self.port = None
+
+    def binary(self, *names):
+        for name in names:
+            path = os.path.join(self.prefix, name) if self.prefix else _which(name)
+            if path and os.path.exists(path):
+                return path
+        raise click.ClickException('None of %s found' % ', '.join(names))
+
+    def start(self, database='auth_bench'):
+        self.directory = tempfile.mkdtemp(prefix='pammysqltools-bench-')
+        datadir = os.path.join(self.directory, 'data')
+        server = self.binary('mariadbd', 'mysqld')
+        devnull = open(os.devnull, 'w')
+
+        try:
+            install = self.binary('mariadb-install-db', 'mysql_install_db')
+            subprocess.check_call([install, '--no-defaults', '--datadir=' + datadir, '--auth-root-authentication-method'
+                                   '=normal'], stdout=devnull, stderr=subprocess.STDOUT)
+        except click.ClickException:
+            # MySQL 5.7 and later initialize the data directory themselves
+            subprocess.check_call([server, '--no-defaults', '--initialize-insecure', '--datadir=' + datadir],
+                                  stdout=devnull, stderr=subprocess.STDOUT)
+
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+
+        self.process = subprocess.Popen([server, '--no-defaults', '--datadir=' + datadir, '--bind-address=127.0.0.1',
+                                         '--port=%d' % self.port, '--socket=' + os.path.join(self.directory, 'sock'),
+                                         '--skip-grant-tables', '--innodb-flush-log-at-trx-commit=2'],
+                                        stdout=devnull, stderr=subprocess.STDOUT)
+
+        deadline = time.time() + 60
+        while True:
+            try:
+                dbs = pymysql.connect(host='127.0.0.1', port=self.port, user='root', password='')
+                break
+            except pymysql.err.OperationalError:
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.stop()
+                    raise click.ClickException('The throwaway server did not start')
+                time.sleep(0.2)
+        with dbs.cursor() as cur:
+            cur.execute("CREATE DATABASE IF NOT EXISTS `%s`" % database)
+        dbs.close()
+
+        return dict(host='127.0.0.1', port=str(self.port), user='root', password='', database=database)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _which(name):
+    for directory in os.getenv('PATH', '').split(os.pathsep) + ['/usr/sbin', '/usr/libexec']:
+        path = os.path.join(directory, name)
+        if os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def test_database(path=None):
+    """
+    Returns the [database] section the tests use
+    """
+    config = configparser.ConfigParser()
+    config.read([path] if path else [os.path.join(ROOT, 'pam_mysql_manager-test.conf'),
+                                     r'/etc/pam_mysql_manager-test.conf',
+                                     os.path.expanduser('~/.pam_mysql_manager-test.conf')])
+    return dict(user=os.getenv("PAMMYSQL_TEST_MYSQL_USER", config.get('database', 'user', fallback='root')),
+                password=os.getenv("PAMMYSQL_TEST_MYSQL_PASS", config.get('database', 'password', fallback='')),
+                host=os.getenv("PAMMYSQL_TEST_MYSQL_HOST", config.get('database', 'host', fallback='localhost')),
+                port=os.getenv("PAMMYSQL_TEST_MYSQL_PORT", config.get('database', 'port', fallback='3306')),
+                database=os.getenv("PAMMYSQL_TEST_MYSQL_DB", config.get('database', 'database', fallback='auth_test')))
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the results whose throughput dropped by more than threshold compared to the baseline
+
+    :return: A list of (result, baseline result) tuples
+    :rtype: list
+    """
+    previous = dict(((r['name'], r['scale']), r) for r in baseline.get('results', ()))
+    regressions = list()
+    for result in results:
+        before = previous.get((result['name'], result['scale']))
+        if before and before.get('ops_per_sec') and result.get('ops_per_sec') is not None and \
+                result['ops_per_sec'] < before['ops_per_sec'] * (1 - threshold):
+            regressions.append((result, before))
+    return regressions
+
+
+@click.command()
+@click.option('-s', '--scale', type=int, multiple=True, help='number of seeded users, can be repeated '
+                                                           '(default 10000, 100000 and 1000000)')
+@click.option('-n', '--ops', type=int, default=1000, help='operations per benchmark')
+@click.option('-k', '--filter', 'patterns', multiple=True, help='only run benchmarks whose name contains this')
+@click.option('-o', '--output', type=click.File('w'), default='-', help='file for the JSON results')
+@click.option('--config', help='config file with the [database] section, defaults to the one of the tests')
+@click.option('--throwaway', is_flag=True, help='start a temporary MariaDB/MySQL server')
+@click.option('--server-prefix', help='directory with the binaries for --throwaway')
+@click.option('--no-db', is_flag=True, help='only run the benchmarks that need no database')
+@click.option('--baseline', type=click.File('r'), help='JSON results of an earlier run to compare with')
+@click.option('--threshold', type=float, default=0.2, help='relative throughput loss reported as regression')
+def main(scale, ops, patterns, output, config, throwaway, server_prefix, no_db, baseline, threshold):
+    scales = scale or (10000, 100000, 1000000)
+    selected = [b for b in BENCHMARKS if (not patterns or any(p in b[0] for p in patterns)) and not (no_db and b[2])]
+
+    server = None
+    conf = configparser.ConfigParser()
+    meta = dict(date=datetime.datetime.utcnow().isoformat(), python=platform.python_version(),
+                platform=platform.platform(), pymysql=pymysql.__version__, ops=ops)
+    results = list()
+    dbs = None
+    try:
+        if not no_db:
+            if throwaway:
+                server = ThrowawayServer(server_prefix)
+                conf.read_dict({'database': server.start()})
+            else:
+                conf.read_dict({'database': test_database(config)})
+            section = conf['database']
+            dbs = pymysql.connect(host=section['host'], port=int(section['port']), user=section['user'],
+                                  password=section['password'], db=section['database'])
+            with dbs.cursor() as cur:
+                cur.execute("SELECT VERSION()")
+                meta['server'] = cur.fetchone()[0]
+
+        for size in scales:
+            ctx = Context(conf, dbs, size, ops)
+            if dbs is not None:
+                seconds = seed(ctx)
+                results.append(dict(summarize([seconds], size), name='seed', scale=size))
+                click.echo('%8d  %-45s %.1fs' % (size, 'seed', seconds), err=True)
+
+            for name, func, needs_db in selected:
+                latencies = func(ctx)
+                per_sample = 1
+                if isinstance(latencies, tuple):
+                    latencies, per_sample = latencies
+                result = dict(summarize(latencies, per_sample), name=name, scale=size)
+                results.append(result)
+                click.echo('%8d  %-45s %12.1f ops/s  p95 %.3fms' % (size, name, result['ops_per_sec'] or 0,
+                                                                     result['p95_ms'] or 0), err=True)
+    finally:
+        if dbs is not None:
+            dbs.close()
+        if server is not None:
+            server.stop()
+
+    json.dump(dict(meta=meta, results=results), output, indent=2, sort_keys=True)
+    output.write('\n')
+
+    if baseline:
+        regressions = compare(results, json.load(baseline), threshold)
+        for result, before in regressions:
+            click.echo('Regression: %s at %d: %.1f ops/s, was %.1f ops/s' % (
+                result['name'], result['scale'], result['ops_per_sec'], before['ops_per_sec']), err=True)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import int
+from builtins import str
+import sys
+
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import csv
+import datetime
+import itertools
+import json
+import os.path
+import shlex
+
+import pymysql
+
+from pammysqltools import instrument
+from pammysqltools.cache import LookupCache
+from pammysqltools.helpers import IdAllocator, read_local_ids, find_new_uid, find_new_gid, get_useradd_conf
+from pammysqltools.manager import UserManager, GroupManager, GroupListManager, AccountManager
+
+# The reference date for the timestamps
+REFDATE = datetime.date(1970, 1, 1)
+
+#: The fields every operation accepts and the ones it requires
+OPERATIONS = {
+    'useradd': (UserManager.fields, ('username', 'gid')),
+    'usermod': (UserManager.fields + ('new_username',), ('username',)),
+    'userdel': (('username',), ('username',)),
+    'groupadd': (GroupManager.fields, ('name',)),
+    'groupmod': (GroupManager.fields + ('new_name',), ('name',)),
+    'groupdel': (('name', 'gid'), ()),
+    'memberadd': (GroupListManager.fields, ('username', 'gid')),
+    'memberdel': (GroupListManager.fields, ('username', 'gid')),
+}
+
+#: Fields that are converted to integers
+INTEGER_FIELDS = ('gid', 'uid', 'lstchg', 'mini', 'maxi', 'warn', 'inact', 'expire', 'flag')
+
+#: Operations whose rows are written with one multi-row INSERT while they follow each other
+GROUPED = ('useradd', 'groupadd', 'memberadd')
+
+
+class Operation(object):
+    """
+    One line of a batch file
+
+    :param line: The line number in the input
+    :type line: int
+    :param op: The name of the operation, see :data:`OPERATIONS`
+    :type op: unicode
+    :param fields: The fields of the operation
+    :type fields: dict
+    """
+
+    def __init__(self, line, op, fields):
+        self.line = line
+        self.op = op
+        self.fields = fields
+        self.error = None
+
+    def validate(self):
+        """
+        Checks the operation and converts the numeric fields
+
+        :raises ValueError: If the operation is invalid
+        """
+        if self.op not in OPERATIONS:
+            raise ValueError('Unknown operation "%s"' % self.op)
+        allowed, required = OPERATIONS[self.op]
+
+        unknown = set(self.fields) - set(allowed)
+        if unknown:
+            raise ValueError('Unknown fields for {op}: {fields}'.format(op=self.op, fields=", ".join(sorted(unknown))))
+        for field in required:
+            if self.fields.get(field) is None:
+                raise ValueError('Missing field "{field}" for {op}'.format(field=field, op=self.op))
+        if self.op == 'groupdel' and self.fields.get('name') is None and self.fields.get('gid') is None:
+            raise ValueError('Missing field "name" or "gid" for groupdel')
+
+        for field in INTEGER_FIELDS:
+            if self.fields.get(field) is not None:
+                try:
+                    self.fields[field] = int(self.fields[field])
+                except ValueError:
+                    raise ValueError('"{value}" is not a valid {field}'.format(value=self.fields[field], field=field))
+
+
+def _clean(fields):
+    return dict((k, v if v != '' else None) for k, v in fields.items())
+
+
+def parse_json(stream):
+    """
+    Reads one JSON object per line, the operation is in the key "op"
+    """
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            fields = json.loads(text)
+            if not isinstance(fields, dict):
+                raise ValueError('expected an object')
+        except ValueError as e:
+            operation = Operation(line, None, {})
+            operation.error = 'Invalid JSON: %s' % e
+            yield operation
+            continue
+        op = fields.pop('op', None)
+        yield Operation(line, op, _clean(fields))
+
+
+def parse_csv(stream):
+    """
+    Reads CSV with a header line, the operation is in the column "op"
+    """
+    reader = csv.DictReader(stream)
+    for row in reader:
+        fields = _clean(dict((k, v) for k, v in row.items() if k is not None))
+        op = fields.pop('op', None)
+        yield Operation(reader.line_num, op, dict((k, v) for k, v in fields.items() if v is not None))
+
+
+def parse_lines(stream):
+    """
+    Reads lines of the form ``op key=value key=value``. Values can be quoted, lines starting with # are ignored.
+    """
+    for line, text in enumerate(stream, 1):
+        text = text.strip()
+        if not text or text[0] == '#':
+            continue
+        try:
+            tokens = shlex.split(text)
+        except ValueError as e:
+            operation = Operation(line, None, {})
+            operation.error = str(e)
+            yield operation
+            continue
+        fields = dict()
+        operation = Operation(line, tokens[0], fields)
+        for token in tokens[1:]:
+            k, sep, v = token.partition('=')
+            if not sep:
+                operation.error = '"%s" is not a valid key/value pair' % token
+                break
+            fields[k.strip()] = v.strip() or None
+        yield operation
+
+
+PARSERS = {
+    'json': parse_json,
+    'csv': parse_csv,
+    'line': parse_lines,
+}
+
+
+def read_operations(stream, fmt='line'):
+    """
+    Reads the operations of a batch file
+
+    :param stream: The opened file
+    :param fmt: One of json, csv or line
+    :type fmt: unicode
+    :return: A generator of :class:`Operation`
+    """
+    return PARSERS[fmt](stream)
+
+
+class BatchRunner(object):
+    """
+    Applies operations through the managers on one connection.
+
+    Consecutive operations of the kinds in :data:`GROUPED` are collected and written with multi-row INSERTs. If one of
+    them fails, the group is rolled back to a savepoint and applied row by row so every line gets its own result.
+
+    :param config: The config for the managers
+    :type config: ConfigParser
+    :param dbs: The :class:`pymysql.Connection` instance to use
+    :type dbs: pymysql.Connection
+    :param commit_interval: Commit after this many operations, 0 commits only at the end
+    :type commit_interval: int
+    :param batch_size: Maximum number of rows per grouped INSERT
+    :type batch_size: int
+    """
+
+    def __init__(self, config, dbs, commit_interval=0, batch_size=1000):
+        self.config = config
+        self.dbs = dbs
+        self.commit_interval = commit_interval
+        self.batch_size = batch_size
+        self.cache = LookupCache()
+        self.um = UserManager(config, dbs, cache=self.cache)
+        self.gm = GroupManager(config, dbs, cache=self.cache)
+        self.glm = GroupListManager(config, dbs, cache=self.cache)
+        self.am = AccountManager(config, dbs, cache=self.cache)
+        self.uids = None
+        self.gids = None
+        self.pending = list()
+        self.uncommitted = 0
+
+    def run(self, operations):
+        """
+        Applies the operations
+
+        :param operations: The operations, e.g. from :func:`read_operations`
+        :type operations: iterable
+        :return: A generator of the applied :class:`Operation` objects, error is set for failed ones
+        """
+        for operation in operations:
+            if operation.error is None:
+                try:
+                    operation.validate()
+                    self.prepare(operation)
+                except (ValueError, KeyError) as e:
+                    operation.error = e.args[0] if e.args else str(e)
+            if operation.error is not None:
+                for done in self.flush():
+                    yield done
+                yield operation
+                continue
+
+            if self.pending and (operation.op != self.pending[0].op or len(self.pending) >= self.batch_size):
+                for done in self.flush():
+                    yield done
+
+            if operation.op in GROUPED:
+                self.pending.append(operation)
+            else:
+                self.apply(operation)
+                self.count(1)
+                yield operation
+
+        for done in self.flush():
+            yield done
+        self.dbs.commit()
+
+    def count(self, n):
+        self.uncommitted += n
+        if self.commit_interval and self.uncommitted >= self.commit_interval:
+            self.dbs.commit()
+            self.uncommitted = 0
+
+    def prepare(self, operation):
+        """
+        Fills in the fields the CLI would fill in for a new user or group
+        """
+        fields = operation.fields
+        if operation.op == 'useradd':
+            if fields.get('uid') is None:
+                if self.uids is None:
+                    self.uids = IdAllocator(itertools.chain(self.um.getalluids(), read_local_ids('/etc/passwd')))
+                fields['uid'] = find_new_uid(False, allocator=self.uids)
+                if fields['uid'] is None:
+                    raise ValueError('No more available UID')
+            elif self.uids is not None:
+                self.uids.add(fields['uid'])
+            if fields.get('homedir') is None:
+                fields['homedir'] = os.path.join(get_useradd_conf().get('HOME', '/home'), fields['username'])
+            if fields.get('shell') is None:
+                fields['shell'] = get_useradd_conf().get('SHELL', '')
+            if fields.get('lstchg') is None:
+                fields['lstchg'] = (datetime.date.today() - REFDATE).days
+        elif operation.op == 'groupadd':
+            if fields.get('gid') is None:
+                if self.gids is None:
+                    self.gids = IdAllocator(itertools.chain(self.gm.getallgids(), read_local_ids('/etc/group')))
+                fields['gid'] = find_new_gid(False, allocator=self.gids)
+                if fields['gid'] is None:
+                    raise ValueError('No more available GID')
+            elif self.gids is not None:
+                self.gids.add(fields['gid'])
+
+    def apply(self, operation):
+        """
+        Applies a single operation and records its error
+        """
+        fields = dict(operation.fields)
+        try:
+            if operation.op == 'useradd':
+                self.um.adduser(**fields)
+            elif operation.op == 'usermod':
+                username = fields.pop('username')
+                fields['username'] = fields.pop('new_username', None)
+                self.am.moduser(username_old=username, **fields)
+            elif operation.op == 'userdel':
+                self.um.deluser(fields['username'])
+                self.glm.delallgroupuser(fields['username'])
+            elif operation.op == 'groupadd':
+                self.gm.addgroup(**fields)
+            elif operation.op == 'groupmod':
+                self.gm.modgroup(name_old=fields['name'], name=fields.get('new_name'), gid=fields.get('gid'),
+                                 password=fields.get('password'))
+            elif operation.op == 'groupdel':
+                gid = fields.get('gid')
+                if gid is None:
+                    gid = self.gm.getgroupbyname(fields['name'])[self.config.get('fields', 'gid', fallback='gid')]
+                self.gm.delgroup(gid)
+            elif operation.op == 'memberadd':
+                self.glm.addgroupuser(fields['username'], fields['gid'])
+            elif operation.op == 'memberdel':
+                self.glm.delgroupuser(fields['username'], fields['gid'])
+        except KeyError as e:
+            operation.error = e.args[0] if e.args else str(e)
+        except pymysql.err.MySQLError as e:
+            operation.error = e.args[-1] if e.args else str(e)
+
+    def flush(self):
+        """
+        Writes the collected operations
+
+        :return: The written operations
+        :rtype: list
+        """
+        pending, self.pending = self.pending, list()
+        if not pending:
+            return pending
+
+        rows = [operation.fields for operation in pending]
+        with instrument.cursor(self.dbs) as cur:
+            cur.execute("SAVEPOINT batch_flush")
+            try:
+                if pending[0].op == 'useradd':
+                    self.um.addusers(rows, batch_size=self.batch_size)
+                elif pending[0].op == 'groupadd':
+                    self.gm.addgroups(rows, batch_size=self.batch_size)
+                else:
+                    self.glm.addgroupusers(rows, batch_size=self.batch_size)
+                cur.execute("RELEASE SAVEPOINT batch_flush")
+            except pymysql.err.MySQLError:
+                # Undo the statements that did succeed and find the culprits one by one
+                cur.execute("ROLLBACK TO SAVEPOINT batch_flush")
+                for operation in pending:
+                    self.apply(operation)
+
+        self.count(len(pending))
+        return pending
@@ -0,0 +1,181 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import threading
+import time
+from collections import OrderedDict
+
+
+class LookupCache(object):
+    """
+    A thread safe LRU cache for looked up rows whose entries expire after ttl seconds.
+
+    Keys are tuples of (namespace, field, value), e.g. ``('user', 'uid', 1000)``. The managers use the table name as
+    the namespace, so managers for the same table can share one cache.
+
+    :param maxsize: Maximum number of entries
+    :type maxsize: int
+    :param ttl: Seconds an entry stays valid
+    :type ttl: float
+    """
+
+    def __init__(self, maxsize=1024, ttl=30, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        #: Counts the invalidations, see :class:`TransactionCache`
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Returns a copy of the cached row or None
+
+        :param key: The key
+        :type key: tuple
+        :rtype: dict
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] < self.clock():
+                self.misses += 1
+                return None
+            # Re-inserting moves the entry to the end, it's the most recently used now
+            self.entries[key] = entry
+            self.hits += 1
+            return dict(entry[1])
+
+    def set(self, key, row, generation=None):
+        """
+        Caches a row
+
+        :param key: The key
+        :type key: tuple
+        :param row: The row
+        :type row: dict
+        :param generation: The :attr:`generation` the row was read at, the row isn't cached if anything was
+                           invalidated since then
+        :type generation: int
+        """
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = (self.clock() + self.ttl, dict(row))
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, namespace, **match):
+        """
+        Drops all entries of a namespace whose row has the given column values. Without values the whole namespace is
+        dropped.
+
+        :param namespace: The namespace
+        :type namespace: unicode
+        """
+        with self.lock:
+            self.generation += 1
+            for key, (expires, row) in list(self.entries.items()):
+                if key[0] == namespace and all(str(row.get(k)) == str(v) for k, v in match.items()):
+                    del self.entries[key]
+
+    def clear(self):
+        """
+        Drops all entries
+        """
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+class TransactionCache(object):
+    """
+    The view of one database transaction on a shared :class:`LookupCache`, e.g. of a daemon session.
+
+    Rows the other transactions haven't committed must not get into the shared cache, and no row older than a commit
+    may stay in it:
+
+    - Once the transaction wrote (invalidated) anything, it neither reads from nor adds to the shared cache, its own
+      reads see its uncommitted changes and must not be shared.
+    - Invalidations are applied when the write happens and again after :meth:`commit`, which drops the old rows other
+      transactions cached in between.
+    - A row is only added if nothing was invalidated since the transaction started, so a row read from a snapshot
+      older than another commit isn't cached.
+
+    A transaction that ends without a commit has therefore nothing to undo in the shared cache.
+
+    :param cache: The shared cache
+    :type cache: LookupCache
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.generation = None
+        self.invalidations = list()
+
+    def get(self, key):
+        if self.invalidations:
+            return None
+        if self.generation is None:
+            self.generation = self.cache.generation
+        return self.cache.get(key)
+
+    def set(self, key, row):
+        if self.invalidations:
+            return
+        if self.generation is None:
+            self.generation = self.cache.generation
+        self.cache.set(key, row, generation=self.generation)
+
+    def invalidate(self, namespace, **match):
+        self.invalidations.append((namespace, match))
+        self.cache.invalidate(namespace, **match)
+
+    def commit(self):
+        """
+        Applies the invalidations of the committed transaction again and starts the next one
+        """
+        for namespace, match in self.invalidations:
+            self.cache.invalidate(namespace, **match)
+        self.end()
+
+    def end(self):
+        """
+        Starts the next transaction, e.g. after a rollback
+        """
+        self.generation = None
+        self.invalidations = list()
+
+
+_cache = None
+
+
+def get_cache(config):
+    """
+    Returns the process wide :class:`LookupCache` configured in the [cache] section or None if size is 0
+
+    :param config: The config
+    :type config: ConfigParser
+    :rtype: LookupCache
+    """
+    global _cache
+    size = config.getint('cache', 'size', fallback=1024)
+    if size <= 0:
+        return None
+    if _cache is None:
+        _cache = LookupCache(maxsize=size, ttl=config.getfloat('cache', 'ttl', fallback=30))
+    return _cache
@@ -0,0 +1,311 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import str
+import sys
+
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import errno
+import itertools
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+from pammysqltools import instrument
+from pammysqltools.cache import get_cache, TransactionCache
+from pammysqltools.helpers import get_pool, get_defs, find_new_uid, find_new_gid, IdAllocator, read_local_ids
+
+#: The manager methods that can be called over the socket, by class name in :mod:`pammysqltools.manager`. The client
+#: only needs the names, the managers (and pymysql) are loaded by the server.
+OPERATIONS = {
+    'UserManager': ('getuserbyuid', 'getuserbyusername', 'getalluids', 'getconflicts', 'adduser', 'addusers',
+                    'deluser', 'moduser', 'modallgid'),
+    'GroupManager': ('getgroupbyname', 'getgroupbygid', 'getallgids', 'getgidsbyname', 'getconflicts', 'addgroup',
+                     'addgroups', 'delgroup', 'modgroup'),
+    'GroupListManager': ('getgroupsforusername', 'getusersforgid', 'addgroupuser', 'addgroupusers', 'delgroupuser',
+                         'delallgroupuser', 'setusergroups', 'addgroupmembers', 'delgroupmembers', 'setgroupmembers',
+                         'modallgroupuser', 'modallgroupgid'),
+    'AccountManager': ('createaccount', 'moduser', 'modgroup'),
+}
+
+#: Exceptions that are raised again on the client side
+EXCEPTIONS = {
+    'KeyError': KeyError,
+    'ValueError': ValueError,
+    'TypeError': TypeError,
+}
+
+
+def _encode(obj):
+    # Generators (e.g. the rows for addusers) are sent as lists
+    if hasattr(obj, '__iter__'):
+        return list(obj)
+    return str(obj)
+
+
+class RemoteError(Exception):
+    """
+    Raised by the client for errors of the daemon that have no local equivalent
+    """
+    pass
+
+
+def _listening(path):
+    """
+    Returns whether a server accepts connections on the Unix domain socket at path
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class ManagementServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves the manager operations as JSON lines on a Unix domain socket.
+
+    Every client connection is one session with its own database transaction which the client ends with a commit or
+    rollback request. The config, /etc/login.defs, the connection pool, the lookup cache and the ID allocators stay
+    loaded between sessions.
+
+    :param config: The config for the managers
+    :type config: ConfigParser
+    :param path: Path of the socket, an existing one is only replaced when no daemon listens on it anymore
+    :type path: unicode
+    :raises OSError: EADDRINUSE if another daemon still accepts connections on path
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config, path):
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            if _listening(path):
+                raise OSError(errno.EADDRINUSE, 'Another daemon is listening on %s' % path)
+            # Left behind by a daemon that didn't shut down cleanly
+            os.unlink(path)
+        self.config = config
+        instrument.configure(config)
+        self.pool = get_pool(config)
+        self.cache = get_cache(config)
+        self.uids = None
+        self.gids = None
+        self.lock = threading.Lock()
+        # The socket is created with mode 0600, so no other user can connect before it is restricted
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, SessionHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(path, 0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+        self.pool.close()
+
+    def manager(self, name, dbs, cache=None):
+        """
+        Returns the manager with the class name for a connection, cache is the :class:`TransactionCache` of the session
+        """
+        from pammysqltools import manager
+        return getattr(manager, name)(self.config, dbs, cache=cache)
+
+    def find_new_uid(self, dbs, sysuser, preferred_uid=None, overrides=None):
+        """
+        Finds a new UID with the cached allocator. Other tools may have taken IDs in the meantime, so every candidate
+        is checked against the database once. overrides are layered over /etc/login.defs for this call only.
+
+        The returned UID stays marked as used in the allocator even if the session rolls back, such IDs are skipped
+        until the daemon is restarted.
+        """
+        defs = get_defs().override(overrides or ())
+        um = self.manager('UserManager', dbs)
+        with self.lock:
+            if self.uids is None:
+                self.uids = IdAllocator(itertools.chain(um.getalluids(), read_local_ids('/etc/passwd')))
+            while True:
+                uid = find_new_uid(sysuser, preferred_uid=preferred_uid, allocator=self.uids, defs=defs)
+                if uid is None:
+                    return None
+                try:
+                    um.getuserbyuid(uid)
+                except KeyError:
+                    return uid
+
+    def find_new_gid(self, dbs, sysuser, preferred_gid=None, overrides=None):
+        """
+        Finds a new GID with the cached allocator, see :meth:`find_new_uid`. Like there, GIDs of sessions that roll
+        back are skipped until the daemon is restarted.
+        """
+        defs = get_defs().override(overrides or ())
+        gm = self.manager('GroupManager', dbs)
+        with self.lock:
+            if self.gids is None:
+                self.gids = IdAllocator(itertools.chain(gm.getallgids(), read_local_ids('/etc/group')))
+            while True:
+                gid = find_new_gid(sysuser, preferred_gid=preferred_gid, allocator=self.gids, defs=defs)
+                if gid is None:
+                    return None
+                try:
+                    gm.getgroupbygid(gid)
+                except KeyError:
+                    return gid
+
+
+class SessionHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one client connection of the :class:`ManagementServer`
+    """
+
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.dbs = None
+        self.cache = TransactionCache(self.server.cache) if self.server.cache is not None else None
+
+    def finish(self):
+        if self.dbs is not None:
+            # The pool rolls back what wasn't committed, the session didn't share any of it through the cache
+            self.server.pool.release(self.dbs)
+        socketserver.StreamRequestHandler.finish(self)
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                response = {'result': self.dispatch(json.loads(line.decode('utf-8')))}
+            except Exception as e:
+                response = {'error': type(e).__name__, 'message': e.args[0] if len(e.args) == 1 else str(e)}
+            self.wfile.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+    def dispatch(self, request):
+        method = request.get('method')
+        args = request.get('args') or []
+        kwargs = request.get('kwargs') or {}
+
+        if self.dbs is None:
+            self.dbs = self.server.pool.acquire()
+
+        if method == 'commit':
+            self.dbs.commit()
+            if self.cache is not None:
+                self.cache.commit()
+            return None
+        if method == 'rollback':
+            if self.cache is not None:
+                self.cache.end()
+            return self.dbs.rollback()
+        if method == 'find_new_uid':
+            return self.server.find_new_uid(self.dbs, **kwargs)
+        if method == 'find_new_gid':
+            return self.server.find_new_gid(self.dbs, **kwargs)
+
+        if method not in OPERATIONS.get(request.get('manager'), ()):
+            raise ValueError('Unknown operation {manager}.{method}'.format(manager=request.get('manager'),
+                                                                         method=method))
+        return getattr(self.server.manager(request['manager'], self.dbs, self.cache), method)(*args, **kwargs)
+
+
+class ManagementClient(object):
+    """
+    Talks to a :class:`ManagementServer`. It can be used in place of a database connection: :meth:`commit`,
+    :meth:`rollback` and :meth:`close` end the session's transaction.
+
+    :param path: Path of the daemon socket
+    :type path: unicode
+    """
+
+    #: Marks the client as stand-in for a database connection
+    remote = True
+
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('rb')
+
+    def call(self, manager, method, *args, **kwargs):
+        """
+        Calls a method on the daemon
+
+        :param manager: Class name of the manager, None for session methods
+        :type manager: unicode
+        :param method: Name of the method
+        :type method: unicode
+        :return: The result of the method
+        """
+        request = json.dumps({'manager': manager, 'method': method, 'args': args, 'kwargs': kwargs}, default=_encode)
+        self.sock.sendall(request.encode('utf-8') + b'\n')
+        line = self.rfile.readline()
+        if not line:
+            raise RemoteError('Connection to the daemon closed')
+        response = json.loads(line.decode('utf-8'))
+        if 'error' in response:
+            raise EXCEPTIONS.get(response['error'], RemoteError)(response['message'])
+        return response['result']
+
+    def manager(self, name):
+        """
+        Returns a proxy for a manager on the daemon
+
+        :param name: Class name of the manager
+        :type name: unicode
+        :rtype: RemoteManager
+        """
+        return RemoteManager(self, name)
+
+    def find_new_uid(self, sysuser, preferred_uid=None, overrides=None):
+        return self.call(None, 'find_new_uid', sysuser=sysuser, preferred_uid=preferred_uid, overrides=overrides)
+
+    def find_new_gid(self, sysuser, preferred_gid=None, overrides=None):
+        return self.call(None, 'find_new_gid', sysuser=sysuser, preferred_gid=preferred_gid, overrides=overrides)
+
+    def commit(self):
+        self.call(None, 'commit')
+
+    def rollback(self):
+        self.call(None, 'rollback')
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+class RemoteManager(object):
+    """
+    Forwards method calls to a manager on the daemon
+
+    :param client: The client of the session
+    :type client: ManagementClient
+    :param name: Class name of the manager
+    :type name: unicode
+    """
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getattr__(self, method):
+        if method not in OPERATIONS[self.name]:
+            raise AttributeError(method)
+
+        def call(*args, **kwargs):
+            return self.client.call(self.name, method, *args, **kwargs)
+
+        return call
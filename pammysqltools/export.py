@@ -0,0 +1,265 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import open
+from builtins import str
+import sys
+
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import contextlib
+import os
+import subprocess
+
+from pammysqltools.helpers import format_passwd, format_shadow, format_group, format_gshadow
+from pammysqltools.manager import UserManager, GroupManager
+
+#: The exported files and the mode of new ones, existing files keep their mode and owner
+FILES = (
+    ('passwd', 0o644),
+    ('shadow', 0o600),
+    ('group', 0o644),
+    ('gshadow', 0o600),
+)
+
+
+class AtomicFile(object):
+    """
+    A file that replaces path in one step when it is closed without error. Until then the old file stays in place, on
+    an error the new one is removed. A deferred file is only written and synced when it is closed, it replaces path
+    when :meth:`replace` is called, so several files can be replaced together after all of them were written.
+
+    :param path: Path of the file
+    :type path: unicode
+    :param mode: Mode of the file if it doesn't exist yet
+    :type mode: int
+    :param deferred: Wait for :meth:`replace` instead of replacing path when the file is closed
+    :type deferred: bool
+    """
+
+    def __init__(self, path, mode=0o644, deferred=False):
+        self.path = path
+        self.deferred = deferred
+        self.tmp = '%s.%d.tmp' % (path, os.getpid())
+        if os.path.exists(path):
+            st = os.stat(path)
+            self.mode, self.owner = st.st_mode & 0o7777, (st.st_uid, st.st_gid)
+        else:
+            self.mode, self.owner = mode, None
+        self.file = None
+
+    def __enter__(self):
+        fd = os.open(self.tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, self.mode)
+        self.file = open(fd, 'w')
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
+
+        if exc_type is not None:
+            os.unlink(self.tmp)
+            return False
+        os.chmod(self.tmp, self.mode)
+        if self.owner is not None and os.geteuid() == 0:
+            os.chown(self.tmp, *self.owner)
+        if not self.deferred:
+            self.replace()
+        return False
+
+    def replace(self):
+        """
+        Replaces path with the written file
+        """
+        os.rename(self.tmp, self.path)
+
+    def discard(self):
+        """
+        Removes the written file and keeps the old one
+        """
+        if os.path.exists(self.tmp):
+            os.unlink(self.tmp)
+
+
+class MakeDB(object):
+    """
+    Feeds keyed lines to makedb(1) to build an indexed nss_db map, which replaces path when it is closed without error
+
+    :param path: Path of the map, e.g. /var/db/passwd.db
+    :type path: unicode
+    :param makedb: The makedb binary
+    :type makedb: unicode
+    :param mode: Mode of the map
+    :type mode: int
+    :param deferred: Wait for :meth:`replace` instead of replacing path when it is closed
+    :type deferred: bool
+    """
+
+    def __init__(self, path, makedb='makedb', mode=0o644, deferred=False):
+        self.path = path
+        self.deferred = deferred
+        self.tmp = '%s.%d.tmp' % (path, os.getpid())
+        self.makedb = makedb
+        self.mode = mode
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen([self.makedb, '-o', self.tmp, '-'], stdin=subprocess.PIPE)
+        return self
+
+    def add(self, key, line):
+        """
+        Adds a line under a key, the key starts with the kind of the index (. for names, = for IDs)
+        """
+        self.process.stdin.write(('%s %s\n' % (key, line)).encode('utf-8'))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.process.stdin.close()
+        except (IOError, OSError):
+            # makedb already exited, its exit code tells why
+            pass
+        code = self.process.wait()
+        if exc_type is not None or code != 0:
+            if os.path.exists(self.tmp):
+                os.unlink(self.tmp)
+            if exc_type is None:
+                raise OSError('makedb failed for %s with exit code %d' % (self.path, code))
+            return False
+        os.chmod(self.tmp, self.mode)
+        if not self.deferred:
+            self.replace()
+        return False
+
+    def replace(self):
+        """
+        Replaces path with the built map
+        """
+        os.rename(self.tmp, self.path)
+
+    def discard(self):
+        """
+        Removes the built map and keeps the old one
+        """
+        if os.path.exists(self.tmp):
+            os.unlink(self.tmp)
+
+
+def export(config, dbs, directory, dbdirectory=None, makedb='makedb', page_size=10000):
+    """
+    Writes the users and groups into passwd, shadow, group and gshadow files in directory.
+
+    Every table is read in a single pass: the users page by page, the groups with their members from one join. All
+    files (and maps) are written to temporary files first and replace the old ones one after the other only after all
+    of them were completely written, on an error all old ones stay in place. With dbdirectory the same entries are
+    also written into the nss_db maps passwd.db, shadow.db, group.db and gshadow.db (with the :user index for
+    initgroups) by makedb(1).
+
+    :param config: The config for the managers
+    :type config: ConfigParser
+    :param dbs: The :class:`pymysql.Connection` instance to use
+    :type dbs: pymysql.Connection
+    :param directory: The directory of the files
+    :type directory: unicode
+    :param dbdirectory: The directory of the nss_db maps, None skips them
+    :type dbdirectory: unicode
+    :param makedb: The makedb binary
+    :type makedb: unicode
+    :param page_size: Number of users fetched per query
+    :type page_size: int
+    :return: A tuple of the number of exported users and groups
+    :rtype: tuple
+    """
+    um = UserManager(config, dbs)
+    gm = GroupManager(config, dbs)
+    # Nothing replaces an old file before all new ones were written, the maps are appended by _maps
+    written = [AtomicFile(os.path.join(directory, name), mode, deferred=True) for name, mode in FILES]
+    files = dict(zip((name for name, _ in FILES), written))
+
+    users = 0
+    try:
+        with files['passwd'] as passwd, files['shadow'] as shadow, \
+                _maps(written, dbdirectory, makedb, 'passwd', 'shadow') as (passwd_db, shadow_db):
+            for row in um.iterusers(page_size=page_size):
+                user = um.logicalrow(row)
+                passwd_line, shadow_line = format_passwd(user), format_shadow(user)
+                passwd.write(passwd_line + '\n')
+                shadow.write(shadow_line + '\n')
+                if passwd_db is not None:
+                    passwd_db.add('.' + user['username'], passwd_line)
+                    passwd_db.add('=%s' % user['uid'], passwd_line)
+                    shadow_db.add('.' + user['username'], shadow_line)
+                users += 1
+
+        groups = 0
+        memberships = dict()
+        with files['group'] as group_file, files['gshadow'] as gshadow, \
+                _maps(written, dbdirectory, makedb, 'group', 'gshadow') as (group_db, gshadow_db):
+            for row, members in gm.itergroupmembers():
+                group = gm.logicalrow(row)
+                group_line, gshadow_line = format_group(group, members), format_gshadow(group, members)
+                group_file.write(group_line + '\n')
+                gshadow.write(gshadow_line + '\n')
+                if group_db is not None:
+                    group_db.add('.' + group['name'], group_line)
+                    group_db.add('=%s' % group['gid'], group_line)
+                    gshadow_db.add('.' + group['name'], gshadow_line)
+                    for member in members:
+                        memberships.setdefault(member, []).append(str(group['gid']))
+                groups += 1
+
+            if group_db is not None:
+                # The index initgroups uses to find the groups of a user
+                for member, gids in memberships.items():
+                    group_db.add(':' + member, '%s %s' % (member, ','.join(gids)))
+    except BaseException:
+        for f in written:
+            f.discard()
+        raise
+
+    for f in written:
+        f.replace()
+
+    return users, groups
+
+
+@contextlib.contextmanager
+def _maps(written, directory, makedb, *names):
+    """
+    Opens a deferred :class:`MakeDB` for every name and appends it to written, without directory it yields None for
+    each
+    """
+    if not directory:
+        yield tuple(None for _ in names)
+        return
+
+    modes = dict(FILES)
+    entered = list()
+    try:
+        for name in names:
+            db = MakeDB(os.path.join(directory, name + '.db'), makedb, modes[name], deferred=True)
+            written.append(db)
+            entered.append(db.__enter__())
+        yield tuple(entered)
+    except BaseException:
+        exc_info = sys.exc_info()
+        for db in entered:
+            db.__exit__(*exc_info)
+        raise
+
+    error = None
+    for db in entered:
+        try:
+            db.__exit__(None, None, None)
+        except OSError as e:
+            error = error or e
+    if error is not None:
+        raise error
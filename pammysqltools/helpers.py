@@ -6,26 +6,154 @@ from __future__ import unicode_literals
 from builtins import dict
 from builtins import int
 from builtins import open
-from builtins import range
-from future import standard_library
+from builtins import str
+import sys
 
-standard_library.install_aliases()
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import bisect
 import configparser
+import contextlib
+import errno
 import grp
 import os
 import pwd
 import shutil
 import syslog
+import threading
+from collections import OrderedDict
 # noinspection PyUnresolvedReferences
 import __main__
-import pymysql
+
+from pammysqltools import instrument
+from pammysqltools.settings import load_settings, parse_defs, parse_assignments
 
 progname = os.path.basename(__main__.__file__)
 
 
-def create_home(path, skel, uid, gid):
+# The single pass copier needs directory file descriptors for scandir, open and mkdir
+FD_COPY = hasattr(os, 'scandir') and os.scandir in getattr(os, 'supports_fd', ()) and \
+    os.open in getattr(os, 'supports_dir_fd', ()) and os.mkdir in getattr(os, 'supports_dir_fd', ())
+
+_DIR_FLAGS = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0) | getattr(os, 'O_NOFOLLOW', 0)
+
+
+def _copy_data(src_fd, dst_fd, size):
+    """
+    Copies size bytes between two file descriptors inside the kernel if possible
+
+    copy_file_range is tried first, then sendfile and finally read/write. A method is only dropped if it fails before
+    copying anything.
+    """
+    offset = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(src_fd, dst_fd, size - offset)
+                if not copied:
+                    break
+                offset += copied
+            return
+        except OSError as e:
+            if offset or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                raise
+
+    if hasattr(os, 'sendfile'):
+        try:
+            while offset < size:
+                copied = os.sendfile(dst_fd, src_fd, offset, size - offset)
+                if not copied:
+                    break
+                offset += copied
+            return
+        except OSError as e:
+            if offset or e.errno not in (errno.ENOSYS, errno.EINVAL):
+                raise
+
+    while True:
+        data = os.read(src_fd, 65536)
+        if not data:
+            break
+        while data:
+            data = data[os.write(dst_fd, data):]
+
+
+def _copy_dir(src_fd, dst_fd, uid, gid, mode):
+    for entry in os.scandir(src_fd):
+        name = entry.name
+        if entry.is_symlink():
+            os.symlink(os.readlink(name, dir_fd=src_fd), name, dir_fd=dst_fd)
+            os.chown(name, uid, gid, dir_fd=dst_fd, follow_symlinks=False)
+        elif entry.is_dir():
+            os.mkdir(name, mode, dir_fd=dst_fd)
+            child_src = os.open(name, _DIR_FLAGS, dir_fd=src_fd)
+            try:
+                child_dst = os.open(name, _DIR_FLAGS, dir_fd=dst_fd)
+                try:
+                    os.fchown(child_dst, uid, gid)
+                    os.fchmod(child_dst, mode)
+                    _copy_dir(child_src, child_dst, uid, gid, mode)
+                finally:
+                    os.close(child_dst)
+            finally:
+                os.close(child_src)
+        elif entry.is_file():
+            in_fd = os.open(name, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0), dir_fd=src_fd)
+            try:
+                out_fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_NOFOLLOW', 0), 0o600,
+                                 dir_fd=dst_fd)
+                try:
+                    os.fchown(out_fd, uid, gid)
+                    os.fchmod(out_fd, mode)
+                    _copy_data(in_fd, out_fd, os.fstat(in_fd).st_size)
+                finally:
+                    os.close(out_fd)
+            finally:
+                os.close(in_fd)
+        # Sockets, FIFOs and devices don't belong into a home directory and are skipped
+
+
+def copy_skel(skel, path, uid, gid, mode):
+    """
+    Copies a skeleton directory in a single pass. Every entry gets its owner and mode when it is created, using
+    descriptors relative to the parent directory. Symbolic links are copied as links.
+
+    :param skel: The skeleton directory
+    :type skel: unicode
+    :param path: The directory to create
+    :type path: unicode
+    :param uid: The owner
+    :type uid: int
+    :param gid: The group
+    :type gid: int
+    :param mode: The mode of the copied files and directories
+    :type mode: int
+    """
+    src_fd = os.open(skel, _DIR_FLAGS)
+    try:
+        os.mkdir(path, 0o700)
+        dst_fd = os.open(path, _DIR_FLAGS)
+        try:
+            _copy_dir(src_fd, dst_fd, uid, gid, mode)
+            os.fchown(dst_fd, uid, gid)
+            os.fchmod(dst_fd, mode)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+def create_home(path, skel, uid, gid, umask=None):
+    if umask is None:
+        umask = get_defs().getoctal("UMASK", 0o022)
+
+    if FD_COPY:
+        copy_skel(skel, path, uid, gid, 0o777 - umask)
+        return
+
     shutil.copytree(skel, path)
-    umask = int(get_defs().get("UMASK", "022"), 8)
     for root, dirs, files in os.walk(path):
         for ndir in dirs:
             os.chmod(os.path.join(root, ndir), 0o777 - umask)
@@ -65,129 +193,423 @@ def get_config(path=None):
 
 
 def get_defs(path='/etc/login.defs'):
-    global LOGIN_DEFS
-    try:
-        if LOGIN_DEFS:
-            return LOGIN_DEFS
-    except NameError:
-        pass
+    """
+    Returns the settings of /etc/login.defs, which are parsed again only if the file changed
 
-    LOGIN_DEFS = dict()
-    with open(path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line[0] == '#':
-                continue
-            k, v = line.split()
-            LOGIN_DEFS[k] = v
-    return LOGIN_DEFS
+    :rtype: pammysqltools.settings.Settings
+    """
+    return load_settings(path, parse_defs)
 
 
 def get_useradd_conf(path='/etc/default/useradd'):
-    global USERADD_CONF
+    """
+    Returns the settings of /etc/default/useradd, which are parsed again only if the file changed
+
+    :rtype: pammysqltools.settings.Settings
+    """
+    return load_settings(path, parse_assignments)
+
+
+class IdAllocator(object):
+    """
+    Finds free IDs in a sorted list of used IDs instead of probing NSS for every candidate
+
+    :param used: The IDs that are already taken
+    :type used: iterable
+    """
+
+    def __init__(self, used=()):
+        self.used = sorted(set(int(i) for i in used))
+
+    def __contains__(self, id_):
+        i = bisect.bisect_left(self.used, id_)
+        return i < len(self.used) and self.used[i] == id_
+
+    def __len__(self):
+        return len(self.used)
+
+    def add(self, id_):
+        """
+        Marks an ID as used
+
+        :param id_: The ID to reserve
+        :type id_: int
+        """
+        id_ = int(id_)
+        if id_ not in self:
+            bisect.insort(self.used, id_)
+
+    def find_free(self, id_min, id_max, reverse=False, preferred=None):
+        """
+        Returns the first free ID between id_min and id_max and reserves it.
+
+        Searching forward covers [id_min, id_max), searching in reverse covers (id_min, id_max], just like the
+        loops of the original shadow tools. A free preferred ID strictly inside the range wins.
+
+        :param id_min: Lower bound of the range
+        :type id_min: int
+        :param id_max: Upper bound of the range
+        :type id_max: int
+        :param reverse: Search from id_max downwards
+        :type reverse: bool
+        :param preferred: ID to return if it is free
+        :type preferred: int
+        :return: A free ID or None if the range is exhausted
+        :rtype: int
+        """
+        if preferred and id_min < preferred < id_max and preferred not in self:
+            self.add(preferred)
+            return preferred
+
+        if reverse:
+            lo = bisect.bisect_right(self.used, id_min)
+            hi = bisect.bisect_right(self.used, id_max)
+            # used[hi - 1 - k] == id_max - k holds for a prefix of k, the first k breaking it is the gap
+            left, right = 0, hi - lo
+            while left < right:
+                mid = (left + right) // 2
+                if self.used[hi - 1 - mid] == id_max - mid:
+                    left = mid + 1
+                else:
+                    right = mid
+            candidate = id_max - left
+            if candidate <= id_min:
+                return None
+        else:
+            lo = bisect.bisect_left(self.used, id_min)
+            hi = bisect.bisect_left(self.used, id_max)
+            # used[lo + k] == id_min + k holds for a prefix of k, the first k breaking it is the gap
+            left, right = 0, hi - lo
+            while left < right:
+                mid = (left + right) // 2
+                if self.used[lo + mid] == id_min + mid:
+                    left = mid + 1
+                else:
+                    right = mid
+            candidate = id_min + left
+            if candidate >= id_max:
+                return None
+
+        self.add(candidate)
+        return candidate
+
+
+def read_local_ids(path):
+    """
+    Reads the IDs (third field) from a passwd or group style file
+
+    :param path: Path to the file
+    :type path: unicode
+    :return: list
+    """
+    ids = list()
     try:
-        if USERADD_CONF:
-            return USERADD_CONF
-    except NameError:
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.split(':')
+                if len(fields) > 2 and fields[2].strip():
+                    try:
+                        ids.append(int(fields[2]))
+                    except ValueError:
+                        continue
+    except IOError:
         pass
+    return ids
+
 
-    USERADD_CONF = dict()
+def read_colon_file(path):
+    """
+    Streams the entries of a passwd, shadow, group or gshadow style file
+
+    Empty fields are returned as None.
+
+    :param path: Path to the file
+    :type path: unicode
+    :return: A generator of field lists
+    """
     with open(path, 'r') as f:
         for line in f:
-            line = line.strip()
-            if not line or line[0] == '#':
+            line = line.rstrip('\n')
+            if not line.strip():
                 continue
-            p = line.find('=')
-            if p != -1:
-                k = line[:p].strip()
-                v = line[p + 1:].strip()
-                USERADD_CONF[k] = v
-    return USERADD_CONF
-
-
-def find_new_uid(sysuser, preferred_uid=None):
-    defs = get_defs()
+            yield [field if field.strip() else None for field in line.split(':')]
+
+
+def _colon_value(value):
+    # Unset numbers are -1 in the database and empty in the files
+    return '' if value is None or value == -1 else str(value)
+
+
+def format_passwd(user):
+    """
+    Returns a user as passwd line, the password is in the shadow line
+
+    :param user: The user keyed by the logical field names
+    :type user: dict
+    :rtype: unicode
+    """
+    return ':'.join(_colon_value(user.get(f)) if f else 'x'
+                    for f in ('username', None, 'uid', 'gid', 'gecos', 'homedir', 'shell'))
+
+
+def format_shadow(user):
+    """
+    Returns a user as shadow line
+
+    :param user: The user keyed by the logical field names
+    :type user: dict
+    :rtype: unicode
+    """
+    return ':'.join(_colon_value(user.get(f))
+                    for f in ('username', 'password', 'lstchg', 'mini', 'maxi', 'warn', 'inact', 'expire', 'flag'))
+
+
+def format_group(group, members=()):
+    """
+    Returns a group as group line, the password is in the gshadow line
+
+    :param group: The group keyed by the logical field names
+    :type group: dict
+    :param members: The usernames of the members
+    :type members: iterable
+    :rtype: unicode
+    """
+    return '{name}:x:{gid}:{members}'.format(name=group['name'], gid=group['gid'], members=','.join(members))
+
+
+def format_gshadow(group, members=()):
+    """
+    Returns a group as gshadow line without administrators
+
+    :param group: The group keyed by the logical field names
+    :type group: dict
+    :param members: The usernames of the members
+    :type members: iterable
+    :rtype: unicode
+    """
+    return '{name}:{password}::{members}'.format(name=group['name'], password=_colon_value(group.get('password')),
+                                                 members=','.join(members))
+
+
+class GroupResolver(object):
+    """
+    Resolves group names and GIDs to GIDs in bulk and remembers the results.
+
+    Names that aren't known yet are looked up together with one call of lookup, the ones the database doesn't have
+    are searched in a local group file. Only found groups are remembered, so a group created later (e.g. by the same
+    batch) is found by the next call. Unlike :func:`get_gid` no NSS lookup is made.
+
+    :param lookup: A function that returns a dictionary of name to GID for a list of names, e.g.
+                   :meth:`pammysqltools.manager.GroupManager.getgidsbyname`
+    :type lookup: callable
+    :param localfile: The local group file
+    :type localfile: unicode
+    """
+
+    def __init__(self, lookup, localfile='/etc/group'):
+        self.lookup = lookup
+        self.localfile = localfile
+        self.memo = dict()
+
+    def resolve(self, groups):
+        """
+        Returns the GIDs of groups
+
+        :param groups: Group names or GIDs
+        :type groups: iterable
+        :return: An ordered dictionary of every found group to its GID
+        :rtype: OrderedDict
+        """
+        groups = list(groups)
+        missing = sorted(set(g for g in groups if g not in self.memo and not str(g).isdigit()))
+        if missing:
+            found = self.lookup(missing)
+            local = [name for name in missing if name not in found]
+            if local and os.path.exists(self.localfile):
+                wanted = set(local)
+                for entry in read_colon_file(self.localfile):
+                    if entry[0] in wanted and len(entry) > 2 and entry[2]:
+                        found.setdefault(entry[0], int(entry[2]))
+            for name in missing:
+                if name in found:
+                    self.memo[name] = found[name]
+
+        result = OrderedDict()
+        for group in groups:
+            gid = int(group) if str(group).isdigit() else self.memo.get(group)
+            if gid is not None:
+                result[group] = gid
+        return result
+
+    def gid(self, group):
+        """
+        Returns the GID of a single group
+
+        :raises KeyError: If the group can't be found
+        :rtype: int
+        """
+        result = self.resolve([group])
+        if group not in result:
+            raise KeyError(group)
+        return result[group]
+
+
+def find_local_conflicts(path, name=None, id=None):
+    """
+    Checks a passwd or group style file for an entry with the name or ID
+
+    :param path: Path to the file, a missing file has no entries
+    :type path: unicode
+    :param name: The user or group name
+    :type name: unicode
+    :param id: The UID or GID
+    :type id: int
+    :return: A tuple of (name taken, ID taken)
+    :rtype: tuple
+    """
+    name_taken = id_taken = False
+    if not os.path.exists(path):
+        return name_taken, id_taken
+    for entry in read_colon_file(path):
+        name_taken = name_taken or (name is not None and entry[0] == name)
+        id_taken = id_taken or (id is not None and len(entry) > 2 and entry[2] == str(id))
+    return name_taken, id_taken
+
+
+def merge_by_name(primary, secondary, window=1000):
+    """
+    Joins two streams of entries on their first field (the user or group name)
+
+    Entries of the secondary stream are read ahead until the matching name shows up, but at most window entries per
+    primary entry and at most window entries are kept for later primary entries. The streams have to be in roughly
+    the same order, like /etc/passwd and /etc/shadow are. Entries without a partner within the window are dropped,
+    e.g. NIS + lines or the users missing in a stale shadow file, and memory stays bounded by window either way.
+
+    :param primary: Entries from e.g. /etc/passwd
+    :type primary: iterable
+    :param secondary: Entries from e.g. /etc/shadow
+    :type secondary: iterable
+    :param window: Maximum number of secondary entries read ahead and kept
+    :type window: int
+    :return: A generator of (primary, secondary) tuples
+    """
+    pending = OrderedDict()
+    secondary = iter(secondary)
+    for row in primary:
+        match = pending.pop(row[0], None)
+        read = 0
+        while match is None and read < window:
+            try:
+                other = next(secondary)
+            except StopIteration:
+                break
+            read += 1
+            if other[0] == row[0]:
+                match = other
+            else:
+                pending[other[0]] = other
+                if len(pending) > window:
+                    # The oldest entry is too far behind for its partner to show up
+                    pending.popitem(last=False)
+        if match is not None:
+            yield row, match
+
+
+def batched(iterable, size):
+    """
+    Splits an iterable into lists of at most size items
+
+    :param iterable: The items
+    :type iterable: iterable
+    :param size: Maximum length of a batch
+    :type size: int
+    :return: A generator of lists
+    """
+    batch = list()
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
+
+
+def find_new_uid(sysuser, preferred_uid=None, allocator=None, defs=None):
+    if defs is None:
+        defs = get_defs()
     if not sysuser:
-        uid_min = int(defs.get("UID_MIN", 1000))
-        uid_max = int(defs.get("UID_MAX", 60000))
+        uid_min = defs.getint("UID_MIN", 1000)
+        uid_max = defs.getint("UID_MAX", 60000)
         if uid_max < uid_min:
             ValueError(_('{progname}: Invalid configuration: UID_MIN ({uid_min}), UID_MAX ({uid_max})').format(
                     progname=progname, uid_min=uid_min, uid_max=uid_max))
     else:
-        uid_min = int(defs.get("SYS_UID_MIN", 101))
-        uid_max = int(defs.get("UID_MIN", 1000))
-        uid_max = int(defs.get("SYS_UID_MAX", uid_max))
+        uid_min = defs.getint("SYS_UID_MIN", 101)
+        uid_max = defs.getint("UID_MIN", 1000)
+        uid_max = defs.getint("SYS_UID_MAX", uid_max)
 
         if uid_max < uid_min:
             raise ValueError(_(
                     '{progname}: Invalid configuration: SYS_UID_MIN ({sys_uid_min}), UID_MIN ({uid_min}), SYS_UID_MAX '
                     '({sys_uid_max})').format(progname=progname, sys_uid_min=uid_min,
-                                              uid_min=int(defs.get("UID_MIN", 1000)),
+                                              uid_min=defs.getint("UID_MIN", 1000),
                                               sys_uid_max=uid_max))
 
-    if preferred_uid and uid_min < preferred_uid < uid_max:
-        try:
-            pwd.getpwuid(preferred_uid)
-        except KeyError:
-            return preferred_uid
+    if allocator is None:
+        allocator = IdAllocator(p.pw_uid for p in pwd.getpwall())
 
-    if sysuser:
-        for uid in range(uid_max, uid_min, -1):
-            try:
-                pwd.getpwuid(uid)
-            except KeyError:
-                return uid
-    else:
-        for uid in range(uid_min, uid_max):
-            try:
-                pwd.getpwuid(uid)
-            except KeyError:
-                return uid
+    uid = allocator.find_free(uid_min, uid_max, reverse=sysuser, preferred=preferred_uid)
+    if uid is not None:
+        return uid
 
     syslog.syslog(syslog.LOG_WARNING, "no more available UID on the system")
     # TODO: Raise meaningful exception
 
 
-def find_new_gid(sysuser, preferred_gid=None):
-    defs = get_defs()
+def find_new_gid(sysuser, preferred_gid=None, allocator=None, defs=None):
+    if defs is None:
+        defs = get_defs()
     # TODO: Catch errors
     if not sysuser:
-        gid_min = int(defs.get("GID_MIN", 1000))
-        gid_max = int(defs.get("GID_MAX", 60000))
+        gid_min = defs.getint("GID_MIN", 1000)
+        gid_max = defs.getint("GID_MAX", 60000)
     else:
-        gid_min = int(defs.get("SYS_GID_MIN", 101))
-        gid_max = int(defs.get("GID_MIN", 1000))
-        gid_max = int(defs.get("SYS_GID_MAX", gid_max))
+        gid_min = defs.getint("SYS_GID_MIN", 101)
+        gid_max = defs.getint("GID_MIN", 1000)
+        gid_max = defs.getint("SYS_GID_MAX", gid_max)
 
-    if preferred_gid and gid_min < preferred_gid < gid_max:
-        try:
-            grp.getgrgid(preferred_gid)
-        except KeyError:
-            return preferred_gid
+    if allocator is None:
+        allocator = IdAllocator(g.gr_gid for g in grp.getgrall())
 
-    if sysuser:
-        for uid in range(gid_max, gid_min, -1):
-            try:
-                grp.getgrgid(uid)
-            except KeyError:
-                return uid
-    else:
-        for uid in range(gid_min, gid_max):
-            try:
-                grp.getgrgid(uid)
-            except KeyError:
-                return uid
+    gid = allocator.find_free(gid_min, gid_max, reverse=sysuser, preferred=preferred_gid)
+    if gid is not None:
+        return gid
 
     syslog.syslog(syslog.LOG_WARNING, "no more available GID on the system")
     # TODO: Raise meaningful exception
 
 
+def get_socket_path(config):
+    """
+    Returns the path of the daemon socket from the [daemon] section or None if no daemon is configured
+
+    :param config: The config
+    :type config: ConfigParser
+    :rtype: unicode
+    """
+    return config.get('daemon', 'socket', fallback=None)
+
+
+def _database_section(config):
+    if not config.has_section('database'):
+        return config[config.default_section]
+    return config['database']
+
+
 def connect_db(config, mysql_user=None, mysql_pass=None, mysql_host=None, mysql_port=None,
                mysql_db=None):
-    if not config.has_section('database'):
-        section = config[config.default_section]
-    else:
-        section = config['database']
+    section = _database_section(config)
 
     if mysql_user is None:
         mysql_user = section.get('user', 'root')
@@ -200,10 +622,127 @@ def connect_db(config, mysql_user=None, mysql_pass=None, mysql_host=None, mysql_
     if mysql_db is None:
         mysql_db = section.get('database', 'auth')
 
-    dbs = pymysql.connect(host=mysql_host,
-                          user=mysql_user,
-                          password=mysql_pass,
-                          db=mysql_db,
-                          port=mysql_port)
+    # pymysql is imported on first use, commands that talk to the daemon never need it
+    import pymysql
+    from pymysql.constants import CLIENT
+
+    target = '{user}@{host}:{port}/{db}'.format(user=mysql_user, host=mysql_host, port=mysql_port, db=mysql_db)
+    start = instrument.clock()
+    try:
+        dbs = pymysql.connect(host=mysql_host,
+                              user=mysql_user,
+                              password=mysql_pass,
+                              db=mysql_db,
+                              port=mysql_port,
+                              client_flag=CLIENT.FOUND_ROWS)
+    except Exception as e:
+        instrument.record(instrument.Event('connect', target, None, instrument.clock() - start, type(e).__name__))
+        raise
+    instrument.record(instrument.Event('connect', target, None, instrument.clock() - start, None))
 
     return dbs
+
+
+class ConnectionPool(object):
+    """
+    A small pool of database connections that are pinged (and reconnected) when they are checked out
+
+    :param config: The config with the [database] section
+    :type config: ConfigParser
+    :param size: Maximum number of idle connections, defaults to pool_size in [database] or 4
+    :type size: int
+    """
+
+    def __init__(self, config, size=None):
+        self.config = config
+        if size is None:
+            size = int(_database_section(config).get('pool_size', 4))
+        self.size = size
+        self.idle = list()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Checks out a connection
+
+        :return: A live connection
+        :rtype: pymysql.Connection
+        """
+        import pymysql
+        while True:
+            with self.lock:
+                dbs = self.idle.pop() if self.idle else None
+            if dbs is None:
+                return connect_db(self.config)
+            try:
+                dbs.ping(reconnect=True)
+                return dbs
+            except pymysql.err.Error:
+                try:
+                    dbs.close()
+                except pymysql.err.Error:
+                    pass
+
+    def release(self, dbs):
+        """
+        Returns a connection to the pool. Uncommitted changes are rolled back.
+
+        :param dbs: A connection from :meth:`acquire`
+        :type dbs: pymysql.Connection
+        """
+        import pymysql
+        if not dbs.open:
+            return
+        try:
+            dbs.rollback()
+        except pymysql.err.Error:
+            dbs.close()
+            return
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(dbs)
+                return
+        dbs.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Checks out a connection for one transaction. It is committed when the block ends and rolled back if it raises.
+        """
+        dbs = self.acquire()
+        try:
+            yield dbs
+            dbs.commit()
+        except BaseException:
+            dbs.rollback()
+            raise
+        finally:
+            self.release(dbs)
+
+    def close(self):
+        """
+        Closes all idle connections
+        """
+        with self.lock:
+            idle, self.idle = self.idle, list()
+        for dbs in idle:
+            dbs.close()
+
+
+_pools = dict()
+
+
+def get_pool(config):
+    """
+    Returns the shared :class:`ConnectionPool` for the database in the config
+
+    :param config: The config with the [database] section
+    :type config: ConfigParser
+    :rtype: ConnectionPool
+    """
+    section = _database_section(config)
+    key = tuple(section.get(k) for k in ('user', 'password', 'host', 'port', 'database'))
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _pools.setdefault(key, ConnectionPool(config))
+    return pool
@@ -0,0 +1,221 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import open
+import sys
+
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import json
+import os
+import syslog
+import threading
+import time
+from collections import namedtuple
+
+clock = getattr(time, 'perf_counter', time.time)
+
+#: One executed statement or opened connection. kind is "query" or "connect", statement the SQL template (or the
+#: connection target), rowcount None for connections, error the name of the raised exception or None.
+Event = namedtuple('Event', ('kind', 'statement', 'rowcount', 'seconds', 'error'))
+
+_hooks = list()
+_configured = list()
+
+
+def add_hook(hook):
+    """
+    Registers a callable that gets every :class:`Event`
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Unregisters a hook added with :func:`add_hook`
+    """
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def enabled():
+    """
+    Returns whether any hook is registered. Without hooks nothing is timed.
+    """
+    return bool(_hooks)
+
+
+def record(event):
+    """
+    Passes an event to all hooks
+    """
+    for hook in tuple(_hooks):
+        hook(event)
+
+
+class TimedCursor(object):
+    """
+    Wraps a cursor and records an :class:`Event` for every execute and executemany
+
+    :param cursor: The cursor
+    :type cursor: pymysql.cursors.Cursor
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __enter__(self):
+        self.cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.cursor.__exit__(*exc_info)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def execute(self, query, args=None):
+        return self._timed(self.cursor.execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(self.cursor.executemany, query, args)
+
+    def _timed(self, method, query, args):
+        statement = ' '.join(query.split())
+        start = clock()
+        try:
+            result = method(query, args)
+        except Exception as e:
+            record(Event('query', statement, None, clock() - start, type(e).__name__))
+            raise
+        record(Event('query', statement, self.cursor.rowcount, clock() - start, None))
+        return result
+
+
+def cursor(dbs, cursorclass=None):
+    """
+    Returns a cursor of the connection, a :class:`TimedCursor` if any hook is registered
+
+    :param dbs: The connection
+    :type dbs: pymysql.Connection
+    :param cursorclass: The cursor class, e.g. :class:`pymysql.cursors.DictCursor`
+    """
+    cur = dbs.cursor(cursorclass) if cursorclass is not None else dbs.cursor()
+    if not _hooks:
+        return cur
+    return TimedCursor(cur)
+
+
+def format_event(event):
+    """
+    Returns an event as one line of text
+    """
+    text = '{kind} {ms:.3f}ms'.format(kind=event.kind, ms=event.seconds * 1000.0)
+    if event.rowcount is not None:
+        text += ' rows=%d' % event.rowcount
+    if event.error:
+        text += ' error=%s' % event.error
+    return text + ' ' + event.statement
+
+
+class SyslogExporter(object):
+    """
+    Writes every event to syslog
+
+    :param priority: The syslog priority
+    :type priority: int
+    """
+
+    def __init__(self, priority=syslog.LOG_DEBUG):
+        self.priority = priority
+
+    def __call__(self, event):
+        syslog.syslog(self.priority, format_event(event))
+
+
+class JsonExporter(object):
+    """
+    Appends every event as a JSON object on its own line to a file
+
+    :param path: Path to the log file
+    :type path: unicode
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(dict(event._asdict(), time=time.time(), pid=os.getpid(), ms=event.seconds * 1000.0))
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+
+
+class Summary(object):
+    """
+    Collects the count, rows and time of every statement, e.g. for --profile
+    """
+
+    def __init__(self):
+        self.stats = dict()
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock:
+            stats = self.stats.setdefault((event.kind, event.statement), [0, 0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += event.rowcount or 0
+            stats[2] += event.seconds
+            stats[3] = max(stats[3], event.seconds)
+            stats[4] += 1 if event.error else 0
+
+    def report(self):
+        """
+        Returns the statements ordered by their total time as text
+
+        :rtype: unicode
+        """
+        with self.lock:
+            stats = sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True)
+        lines = ['{count:>7} {rows:>9} {total:>10} {max:>9} {errors:>6}  statement'.format(
+            count='calls', rows='rows', total='total ms', max='max ms', errors='errors')]
+        for (kind, statement), (count, rows, total, longest, errors) in stats:
+            lines.append('{count:>7} {rows:>9} {total:>10.3f} {max:>9.3f} {errors:>6}  {statement}'.format(
+                count=count, rows=rows, total=total * 1000.0, max=longest * 1000.0, errors=errors,
+                statement=statement if kind == 'query' else 'connect ' + statement))
+        lines.append('{count:>7} {rows:>9} {total:>10.3f}'.format(
+            count=sum(s[0] for k, s in stats), rows=sum(s[1] for k, s in stats),
+            total=sum(s[2] for k, s in stats) * 1000.0))
+        return '\n'.join(lines)
+
+
+def configure(config):
+    """
+    Registers the exporters from the [instrumentation] section and drops the ones of an earlier call
+
+    :param config: The config
+    :type config: ConfigParser
+    :return: The registered exporters
+    :rtype: list
+    """
+    for hook in _configured:
+        remove_hook(hook)
+    del _configured[:]
+
+    if config.getboolean('instrumentation', 'syslog', fallback=False):
+        _configured.append(SyslogExporter())
+    path = config.get('instrumentation', 'log', fallback=None)
+    if path:
+        _configured.append(JsonExporter(path))
+
+    for hook in _configured:
+        add_hook(hook)
+    return list(_configured)
@@ -0,0 +1,242 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import open
+import sys
+
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import contextlib
+import errno
+import fcntl
+import json
+import os
+import shutil
+
+from pammysqltools.helpers import create_home, get_defs
+
+#: The actions of the jobs and the errno values after which a job is dropped instead of retried
+ACTIONS = {
+    'create': (errno.EEXIST,),
+    'remove': (errno.ENOENT,),
+    'move': (errno.ENOENT, errno.EEXIST),
+}
+
+
+def get_journal(config):
+    """
+    Returns a :class:`HomeJournal` configured in the [homes] section
+
+    :param config: The config
+    :type config: ConfigParser
+    :rtype: HomeJournal
+    """
+    return HomeJournal(config.get('homes', 'journal', fallback='/var/lib/pammysqltools/homes.journal'),
+                       workers=config.getint('homes', 'workers', fallback=4))
+
+
+class HomeJournal(object):
+    """
+    Queues the creation, removal and moving of home directories until the database transaction is committed.
+
+    Jobs are collected with :meth:`create`, :meth:`remove` and :meth:`move`. After the commit :meth:`commit` appends
+    them to the journal file and :meth:`run` executes all jobs of the journal with a pool of threads. Jobs that fail
+    stay in the journal and are retried by the next :meth:`run`, unless retrying can't help (e.g. the home to create
+    already exists). Jobs on the same path run in the order they were queued.
+
+    :param path: Path of the journal file
+    :type path: unicode
+    :param workers: Number of threads
+    :type workers: int
+    """
+
+    def __init__(self, path, workers=4):
+        self.path = path
+        self.workers = workers
+        self.pending = list()
+        #: Number of jobs :meth:`commit` wrote to the journal file
+        self.committed = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def create(self, path, uid, gid, skel):
+        """
+        Queues the creation of a home directory from a skeleton directory
+        """
+        self.pending.append(dict(action='create', path=path, uid=uid, gid=gid, skel=skel))
+
+    def remove(self, path, force=False):
+        """
+        Queues the removal of a home directory, with force errors are ignored
+        """
+        self.pending.append(dict(action='remove', path=path, force=force))
+
+    def move(self, path, target):
+        """
+        Queues moving a home directory to target
+        """
+        self.pending.append(dict(action='move', path=path, target=target))
+
+    def discard(self):
+        """
+        Drops the queued jobs, e.g. after a rollback
+        """
+        self.pending = list()
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Yields the journal file opened for appending while holding the lock on path.lock.
+
+        The lock file is never replaced, unlike the journal that :meth:`run` renames over. A lock on the journal itself
+        would let a waiting :meth:`commit` append to the replaced file.
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            try:
+                with open(self.path, 'a+') as f:
+                    yield f
+            finally:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+    def commit(self):
+        """
+        Appends the queued jobs to the journal file
+        """
+        if not self.pending:
+            return
+        with self.locked() as f:
+            for job in self.pending:
+                f.write(json.dumps(job) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.committed += len(self.pending)
+        self.pending = list()
+
+    def jobs(self):
+        """
+        Returns the jobs in the journal file
+
+        :rtype: list
+        """
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def run(self, umask=None):
+        """
+        Runs all jobs of the journal and keeps the ones that should be retried
+
+        :param umask: The umask for created homes, defaults to UMASK from /etc/login.defs
+        :type umask: int
+        :return: A list of (job, error) tuples for the failed jobs, see :func:`retryable` for the ones that stay in the
+                 journal
+        :rtype: list
+        """
+        if not os.path.exists(self.path):
+            return []
+        if umask is None:
+            umask = get_defs().getoctal("UMASK", 0o022)
+
+        with self.locked() as f:
+            f.seek(0)
+            jobs = [json.loads(line) for line in f if line.strip()]
+            if not jobs:
+                return []
+
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(max(1, min(self.workers, len(jobs))))
+            try:
+                results = pool.map(lambda chain: [(job, self.execute(job, umask)) for job in chain], _chains(jobs))
+            finally:
+                pool.close()
+                pool.join()
+
+            failed = [(job, error) for chain in results for job, error in chain if error is not None]
+            retry = [job for job, error in failed if retryable(job, error)]
+
+            # Replace the journal in one step so a crash leaves either the old or the new one
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as out:
+                for job in retry:
+                    out.write(json.dumps(job) + '\n')
+                out.flush()
+                os.fsync(out.fileno())
+            os.rename(tmp, self.path)
+
+        return failed
+
+    @staticmethod
+    def execute(job, umask):
+        """
+        Executes a single job
+
+        :return: None or the raised exception
+        """
+        try:
+            if job['action'] == 'create':
+                create_home(job['path'], job['skel'], job['uid'], job['gid'], umask=umask)
+            elif job['action'] == 'remove':
+                if not os.path.lexists(job['path']):
+                    return None
+                shutil.rmtree(job['path'], ignore_errors=job.get('force', False))
+            elif job['action'] == 'move':
+                if os.path.lexists(job['target']):
+                    raise OSError(errno.EEXIST, os.strerror(errno.EEXIST), job['target'])
+                shutil.move(job['path'], job['target'])
+        except (IOError, OSError) as e:
+            return e
+        return None
+
+
+def retryable(job, error):
+    """
+    Returns whether a failed job is kept in the journal, which isn't the case if retrying can't help
+    """
+    return getattr(error, 'errno', None) not in ACTIONS[job['action']]
+
+
+def _paths(job):
+    return [job['path']] + ([job['target']] if job.get('target') else [])
+
+
+def _chains(jobs):
+    """
+    Splits the jobs into chains that can run in parallel, jobs that touch the same path end up in one chain
+    """
+    chains = list()
+    owners = dict()
+    for index, job in enumerate(jobs):
+        found = list()
+        for path in _paths(job):
+            chain = owners.get(path)
+            if chain is not None and all(chain is not c for c in found):
+                found.append(chain)
+
+        if not found:
+            chain = list()
+            chains.append(chain)
+        else:
+            # A move can join two chains
+            chain = found[0]
+            for other in found[1:]:
+                chain.extend(other)
+                chain.sort(key=lambda entry: entry[0])
+                chains = [c for c in chains if c is not other]
+                for entry_index, entry in other:
+                    for path in _paths(entry):
+                        owners[path] = chain
+
+        chain.append((index, job))
+        for path in _paths(job):
+            owners[path] = chain
+    return [[job for index, job in chain] for chain in chains]
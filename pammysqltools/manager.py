@@ -3,25 +3,336 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from future import standard_library
+from builtins import str
+import sys
 
-standard_library.install_aliases()
-from pymysql.cursors import DictCursor
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import hashlib
+import itertools
+from collections import OrderedDict
+
+from pymysql.constants import CLIENT
+from pymysql.cursors import DictCursor, SSCursor, SSDictCursor
+
+from pammysqltools import instrument
+from pammysqltools.helpers import find_local_conflicts, batched
 
 
 class AbstractManager(object):
     """
     The abstract manager superclass for all managers
 
+    The column names and the SQL statements are built once when the manager is created. Call :meth:`compile` after
+    changing the config to rebuild them.
+
     :param config: The config for the manager
     :type config: ConfigParser
     :param dbs: The :class:`pymysql.Connection` instance to use
     :type dbs: pymysql.Connection
+    :param cache: Optional cache for lookups, which the write methods invalidate
+    :type cache: pammysqltools.cache.LookupCache
     """
 
-    def __init__(self, config, dbs):
+    #: The logical name of the managed table in the [tables] section
+    tablename = None
+    #: The logical field names of the managed table
+    fields = ()
+    #: Statement templates, formatted with {table} and the column name of every field
+    statements = {}
+
+    def __init__(self, config, dbs, cache=None):
         self.config = config
         self.dbs = dbs
+        self.cache = cache
+        self.compile()
+
+    def compile(self):
+        """
+        Builds the column mapping and the statements from the config and drops the cached dynamic statements
+        """
+        self.mapping = dict((field, self.config.get('fields', field, fallback=field)) for field in self.fields)
+        if self.tablename:
+            self.table = self.config.get('tables', self.tablename, fallback=self.tablename)
+        names = dict(self.mapping, table=getattr(self, 'table', None))
+        self.sql = dict((name, statement.format(**names)) for name, statement in self.statements.items())
+        self._statements = dict()
+
+    def logicalrow(self, row):
+        """
+        Returns a row of the table keyed by the logical field names instead of the column names
+
+        :param row: The row as returned by the lookups
+        :type row: dict
+        :rtype: dict
+        """
+        return dict((field, row.get(column)) for field, column in self.mapping.items())
+
+    def _statement(self, kind, keys):
+        """
+        Returns the cached statement of a kind for a tuple of fields
+
+        :param kind: insert (INSERT ... SET), insertmany (INSERT ... VALUES), update (UPDATE ... SET with a WHERE on
+                     the column of the first key, which may also be id) or page (SELECT of the next rows after an id)
+        :type kind: unicode
+        :param keys: The fields, for update the first one is the field of the WHERE clause, for page (field, operator)
+                     pairs of the conditions
+        :type keys: tuple
+        :rtype: unicode
+        """
+        sql = self._statements.get((kind, keys))
+        if sql is None:
+            if kind == 'insert':
+                sql = "INSERT INTO `{table}` SET {fields};".format(
+                    table=self.table, fields=", ".join("`%s` = %%s" % self.mapping[k] for k in keys))
+            elif kind == 'insertmany':
+                sql = "INSERT INTO `{table}` ({fields}) VALUES ({values})".format(
+                    table=self.table,
+                    fields=", ".join("`%s`" % self.mapping[k] for k in keys),
+                    values=", ".join(["%s"] * len(keys)))
+            elif kind == 'page':
+                sql = "SELECT * FROM `{table}` WHERE `id` > %s{conditions} ORDER BY `id` LIMIT %s".format(
+                    table=self.table, conditions="".join(" AND `%s` %s %%s" % (self.mapping[k], op) for k, op in keys))
+            else:
+                sql = "UPDATE `{table}` SET {fields} WHERE `{where}` = %s;".format(
+                    table=self.table, fields=", ".join("`%s` = %%s" % self.mapping[k] for k in keys[1:]),
+                    where=self.mapping.get(keys[0], keys[0]))
+            self._statements[(kind, keys)] = sql
+        return sql
+
+    def _cursor(self, cursorclass=None):
+        """
+        Returns a cursor whose statements are recorded by the hooks of :mod:`pammysqltools.instrument`
+        """
+        return instrument.cursor(self.dbs, cursorclass)
+
+    def _lookup(self, name, field, value):
+        """
+        Runs the lookup statement name for a single row, going through the cache if there is one
+
+        :return: The row or None
+        :rtype: dict
+        """
+        if self.cache is not None:
+            row = self.cache.get((self.table, field, value))
+            if row is not None:
+                return row
+
+        with self._cursor(DictCursor) as cur:
+            cur.execute(self.sql[name], value)
+            row = cur.fetchone()
+
+        if row and self.cache is not None:
+            self.cache.set((self.table, field, value), row)
+        return row
+
+    def _matched(self, cur, name, value):
+        """
+        Returns whether the last UPDATE on cur matched a row. An UPDATE that matched rows but didn't change them is
+        not a miss.
+
+        With CLIENT.FOUND_ROWS (set by :func:`pammysqltools.helpers.connect_db`) the row count is the number of matched
+        rows. Otherwise it is the number of changed rows and only a count of 0 is checked with the lookup statement
+        name.
+
+        :rtype: bool
+        """
+        if cur.rowcount > 0:
+            return True
+        if getattr(self.dbs, 'client_flag', 0) & CLIENT.FOUND_ROWS:
+            return False
+        cur.execute(self.sql[name], value)
+        return cur.fetchone() is not None
+
+    def _conflicts(self, name_field, name, id_field, id, localfile=None):
+        """
+        Checks with the getconflicts statement and optionally a local file which of name and id are taken
+
+        :return: The taken fields out of name_field and id_field
+        :rtype: list
+        """
+        if name is None and id is None:
+            return []
+
+        # Comparing with NULL never matches, so the same statement checks only one of the values if the other is None
+        with self._cursor() as cur:
+            cur.execute(self.sql['getconflicts'], (name, id, name, id))
+            name_taken, id_taken = cur.fetchone()
+
+        if localfile and not (name_taken and id_taken):
+            local_name_taken, local_id_taken = find_local_conflicts(localfile, name=name, id=id)
+            name_taken = name_taken or local_name_taken
+            id_taken = id_taken or local_id_taken
+
+        return [field for field, taken in ((name_field, name_taken), (id_field, id_taken)) if taken]
+
+    def _iterate(self, conditions, page_size=1000):
+        """
+        Yields the rows matching all conditions in the order of their id, fetching page_size rows per query.
+
+        Every page continues after the id of the last row (keyset pagination), so no page scans the skipped rows and
+        the connection is free for other statements between pages. Conditions whose value is None are left out.
+
+        :param conditions: (field, operator, value) tuples, e.g. ``('uid', '>=', 1000)``
+        :type conditions: iterable
+        :param page_size: Number of rows per query
+        :type page_size: int
+        :rtype: generator
+        """
+        conditions = [(field, op, value) for field, op, value in conditions if value is not None]
+        sql = self._statement('page', tuple((field, op) for field, op, value in conditions))
+        values = [value for field, op, value in conditions]
+
+        last = 0
+        while True:
+            with self._cursor(DictCursor) as cur:
+                cur.execute(sql, [last] + values + [page_size])
+                rows = cur.fetchall()
+            for row in rows:
+                yield row
+            if len(rows) < page_size:
+                return
+            last = rows[-1]['id']
+
+    def _invalidate(self, **match):
+        """
+        Drops the cached rows whose fields have the given values
+        """
+        if self.cache is not None:
+            self.cache.invalidate(self.table, **dict((self.mapping[k], v) for k, v in match.items()))
+
+    def _insertmany(self, rows, batch_size=1000, commit=False):
+        """
+        Inserts rows in batches of multi-row INSERT statements
+
+        Rows are dictionaries keyed by the logical field names. Fields that are None are left out so the database
+        default applies, rows with the same set of fields share one statement.
+
+        :param rows: The rows to insert
+        :type rows: iterable
+        :param batch_size: Number of rows per batch
+        :type batch_size: int
+        :param commit: Commit after every batch
+        :type commit: bool
+        :return: The number of inserted rows
+        :rtype: int
+        """
+        count = 0
+        batch = list()
+        for row in rows:
+            unknown = set(row) - set(self.fields)
+            if unknown:
+                raise TypeError("Unknown fields: %s" % ", ".join(sorted(unknown)))
+            batch.append(row)
+            if len(batch) >= batch_size:
+                count += self._flushinsert(batch, commit)
+                batch = list()
+        if batch:
+            count += self._flushinsert(batch, commit)
+        return count
+
+    def _flushinsert(self, batch, commit):
+        statements = OrderedDict()
+        for row in batch:
+            keys = tuple(k for k in self.fields if row.get(k) is not None)
+            statements.setdefault(keys, list()).append([row[k] for k in keys])
+
+        with self._cursor() as cur:
+            for keys, values in statements.items():
+                cur.executemany(self._statement('insertmany', keys), values)
+
+        if commit:
+            self.dbs.commit()
+        return len(batch)
+
+    def getfingerprints(self, key, conditions=()):
+        """
+        Returns the fingerprint of every row, computed by the database so only the hashes are transferred
+
+        :param key: The field the result is keyed by, e.g. username
+        :type key: unicode
+        :param conditions: (field, operator, value) tuples to select the rows, values that are None are left out
+        :type conditions: iterable
+        :return: A dictionary of the key of every row to a tuple of (id, fingerprint), see :func:`fingerprint`
+        :rtype: dict
+        """
+        conditions = [(field, op, value) for field, op, value in conditions if value is not None]
+        sql = "SELECT `id`, `{key}`, MD5(CONCAT_WS(CHAR(31), {columns})) FROM `{table}` WHERE 1=1{conditions}".format(
+            key=self.mapping[key], table=self.table,
+            columns=", ".join("COALESCE(`%s`, '')" % self.mapping[f] for f in self.fields),
+            conditions="".join(" AND `%s` %s %%s" % (self.mapping[f], op) for f, op, value in conditions))
+
+        result = dict()
+        with self._cursor(SSCursor) as cur:
+            cur.execute(sql, [value for field, op, value in conditions])
+            for id, value, digest in cur:
+                result[value] = (id, digest.decode('ascii') if isinstance(digest, bytes) else digest)
+        return result
+
+    def updaterows(self, rows, batch_size=1000):
+        """
+        Updates rows by their id with batched UPDATEs, rows with the same set of fields share one statement
+
+        :param rows: Dictionaries keyed by id and the logical field names
+        :type rows: iterable
+        :param batch_size: Number of rows per batch
+        :type batch_size: int
+        :return: The number of rows
+        :rtype: int
+        """
+        count = 0
+        for batch in batched(rows, batch_size):
+            statements = OrderedDict()
+            for row in batch:
+                unknown = set(row) - set(self.fields) - {'id'}
+                if unknown:
+                    raise TypeError("Unknown fields: %s" % ", ".join(sorted(unknown)))
+                keys = tuple(k for k in self.fields if row.get(k) is not None)
+                statements.setdefault(keys, list()).append([row[k] for k in keys] + [row['id']])
+
+            with self._cursor() as cur:
+                for keys, values in statements.items():
+                    cur.executemany(self._statement('update', ('id',) + keys), values)
+            count += len(batch)
+        if self.cache is not None:
+            self.cache.invalidate(self.table)
+        return count
+
+    def delrows(self, ids, batch_size=1000):
+        """
+        Deletes rows by their id with one DELETE ... IN per batch
+
+        :param ids: The ids of the rows
+        :type ids: iterable
+        :param batch_size: Number of ids per batch
+        :type batch_size: int
+        :return: The number of deleted rows
+        :rtype: int
+        """
+        count = 0
+        with self._cursor() as cur:
+            for batch in batched(ids, batch_size):
+                count += cur.execute("DELETE FROM `{table}` WHERE `id` IN ({values})".format(
+                    table=self.table, values=", ".join(["%s"] * len(batch))), batch)
+        if self.cache is not None:
+            self.cache.invalidate(self.table)
+        return count
+
+
+def fingerprint(row, fields):
+    """
+    Returns the fingerprint of a row the way :meth:`AbstractManager.getfingerprints` computes it in the database
+
+    :param row: The row keyed by the logical field names
+    :type row: dict
+    :param fields: The fields of the table in their order
+    :type fields: tuple
+    :rtype: unicode
+    """
+    text = '\x1f'.join('' if row.get(f) is None else str(row[f]) for f in fields)
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
 
 
 class UserManager(AbstractManager):
@@ -34,95 +345,129 @@ class UserManager(AbstractManager):
     :type dbs: pymysql.Connection
     """
 
-    def __init__(self, config, dbs):
-        super(UserManager, self).__init__(config, dbs)
-        self.table = self.config.get('tables', 'user', fallback='user')
+    tablename = 'user'
+    fields = ('username', 'gid', 'uid', 'gecos', 'homedir', 'shell', 'password', 'lstchg', 'mini', 'maxi', 'warn',
+              'inact', 'expire', 'flag')
+    statements = {
+        'getuserbyuid': "SELECT * FROM `{table}` WHERE `{uid}`=%s LIMIT 1",
+        'getuserbyusername': "SELECT * FROM `{table}` WHERE `{username}`=%s LIMIT 1",
+        'getalluids': "SELECT DISTINCT `{uid}` FROM `{table}`",
+        'getconflicts': "SELECT MAX(`{username}`=%s), MAX(`{uid}`=%s) FROM `{table}` "
+                        "WHERE `{username}`=%s OR `{uid}`=%s",
+        'deluser': "DELETE FROM `{table}` WHERE `{username}`=%s",
+        'modallgid': "UPDATE `{table}` SET `{gid}` = %s WHERE `{gid}` = %s;",
+    }
 
     def getuserbyuid(self, uid):
-        sql = "SELECT * FROM %s WHERE `%s`=%%s LIMIT 1" % (
-            self.table, self.config.get('fields', 'uid', fallback='uid'))
-
-        with self.dbs.cursor(cursor=DictCursor) as cur:
-            cur.execute(sql, uid)
-            result = cur.fetchone()
-            if not result:
-                raise KeyError("No user with UID %s" % uid)
+        result = self._lookup('getuserbyuid', 'uid', uid)
+        if not result:
+            raise KeyError("No user with UID %s" % uid)
 
         return result
 
     def getuserbyusername(self, username):
-
-        sql = "SELECT * FROM `{user}` WHERE `{username}`=%s LIMIT 1".format(
-            user=self.table,
-            username=self.config.get('fields', 'username', fallback='username'))
-        with self.dbs.cursor(cursor=DictCursor) as cur:
-            cur.execute(sql, username)
-            result = cur.fetchone()
-            if not result:
-                raise KeyError("No user with username %s" % username)
+        result = self._lookup('getuserbyusername', 'username', username)
+        if not result:
+            raise KeyError("No user with username %s" % username)
 
         return result
 
+    def getalluids(self):
+        """
+        Gets all user ids in the database
+
+        :return: list
+        """
+        with self._cursor() as cur:
+            cur.execute(self.sql['getalluids'])
+            result = cur.fetchall()
+
+        return [int(row[0]) for row in result]
+
+    def iterusers(self, uid_min=None, uid_max=None, gid=None, shell=None, page_size=1000):
+        """
+        Yields all users or the ones matching the filters without loading the table into memory
+
+        :param uid_min: Only users with at least this UID
+        :type uid_min: int
+        :param uid_max: Only users with at most this UID
+        :type uid_max: int
+        :param gid: Only users with this primary group
+        :type gid: int
+        :param shell: Only users with this shell
+        :type shell: unicode
+        :param page_size: Number of rows per query
+        :type page_size: int
+        :return: A generator of dictionaries of the users
+        """
+        return self._iterate((('uid', '>=', uid_min), ('uid', '<=', uid_max), ('gid', '=', gid),
+                              ('shell', '=', shell)), page_size=page_size)
+
+    def getconflicts(self, username=None, uid=None, localfile=None):
+        """
+        Checks whether a username and UID are taken, with one query for both
+
+        :param username: The username to check, None to skip it
+        :type username: unicode
+        :param uid: The UID to check, None to skip it
+        :type uid: int
+        :param localfile: A passwd file whose entries are checked too, e.g. /etc/passwd
+        :type localfile: unicode
+        :return: The taken fields out of username and uid
+        :rtype: list
+        """
+        return self._conflicts('username', username, 'uid', uid, localfile)
+
     def adduser(self, username, gid=None, uid=None, gecos=None, homedir=None, shell=None, password=None,
                 lstchg=None, mini=None, maxi=None, warn=None, inact=None, expire=None, flag=None):
         l = locals()
 
-        fields = ""
-        values = list()
+        keys = tuple(k for k in self.fields if l[k] is not None)
 
-        for k in l:
-            if k == 'self':
-                continue
-            if l[k] is not None:
-                fields += ("`%s` = %%s, " % (self.config.get('fields', k, fallback=k)))
-                values.append(l[k])
-        fields = fields[:-2]
+        with self._cursor() as cur:
+            cur.execute(self._statement('insert', keys), [l[k] for k in keys])
 
-        sql = "INSERT INTO `%s` SET %s;" % (self.table, fields)
-
-        with self.dbs.cursor() as cur:
-            cur.execute(sql, values)
+    def addusers(self, users, batch_size=1000, commit=False):
+        """
+        Adds many users with batched multi-row INSERTs
+
+        :param users: Dictionaries with the same keys as the arguments of :meth:`adduser`
+        :type users: iterable
+        :param batch_size: Number of users per batch
+        :type batch_size: int
+        :param commit: Commit after every batch
+        :type commit: bool
+        :return: The number of added users
+        :rtype: int
+        """
+        return self._insertmany(users, batch_size=batch_size, commit=commit)
 
     def deluser(self, username):
-        args = (
-            self.table,
-            self.config.get('fields', 'username', fallback='username'))
-        sql_delete = "DELETE FROM `%s` WHERE `%s`=%%s" % args
-
-        with self.dbs.cursor() as cur:
-            self.getuserbyusername(username)
-            cur.execute(sql_delete, username)
+        with self._cursor() as cur:
+            deleted = cur.execute(self.sql['deluser'], username)
+        self._invalidate(username=username)
+        if not deleted:
+            raise KeyError("No user with username %s" % username)
 
     def moduser(self, username_old, username=None, gid=None, uid=None, gecos=None, homedir=None, shell=None,
                 password=None, lstchg=None, mini=None, maxi=None, warn=None, inact=None, expire=None, flag=None):
         l = locals()
 
-        fields = ""
-        values = list()
-
-        for k in l:
-            if l[k] is not None and k != 'self' and k != 'username_old':
-                fields += ("`%s` = %%s, " % (self.config.get('fields', k, fallback=k)))
-                values.append(l[k])
-
-        if not values:
+        keys = tuple(k for k in self.fields if l[k] is not None)
+        if not keys:
             return
-        fields = fields[:-2]
-        values.append(username_old)
-        sql = "UPDATE `{user}` SET {fields} WHERE `{username}` = %s;".format(
-            user=self.table, fields=fields, username=self.config.get('fields', 'username', fallback='username'))
 
-        with self.dbs.cursor() as cur:
-            self.getuserbyusername(username_old)
-            cur.execute(sql, values)
+        with self._cursor() as cur:
+            cur.execute(self._statement('update', ('username',) + keys), [l[k] for k in keys] + [username_old])
+            matched = self._matched(cur, 'getuserbyusername', username_old)
+        self._invalidate(username=username_old)
+        if not matched:
+            raise KeyError("No user with username %s" % username_old)
 
     def modallgid(self, gid, gid_new):
-
-        sql = "UPDATE `{user}` SET {gid} = %s WHERE `{gid}` = %s;".format(
-            user=self.table, gid=self.config.get('fields', 'gid', fallback='gid'))
-
-        with self.dbs.cursor() as cur:
-            cur.execute(sql, (gid_new, gid))
+        with self._cursor() as cur:
+            cur.execute(self.sql['modallgid'], (gid_new, gid))
+        self._invalidate(gid=gid)
 
 
 class GroupListManager(AbstractManager):
@@ -135,9 +480,16 @@ class GroupListManager(AbstractManager):
     :type dbs: pymysql.Connection
     """
 
-    def __init__(self, config, dbs):
-        super(GroupListManager, self).__init__(config, dbs)
-        self.table = self.config.get('tables', 'grouplist', fallback='grouplist')
+    tablename = 'grouplist'
+    fields = ('username', 'gid')
+    statements = {
+        'getgroupsforusername': "SELECT `{gid}` FROM `{table}` WHERE `{username}`=%s",
+        'addgroupuser': "INSERT INTO `{table}` SET `{username}`=%s,`{gid}`=%s;",
+        'delgroupuser': "DELETE FROM `{table}` WHERE `{username}`=%s and `{gid}`=%s;",
+        'delallgroupuser': "DELETE FROM `{table}` WHERE `{username}`=%s;",
+        'modallgroupuser': "UPDATE `{table}` SET `{username}`=%s WHERE `{username}`=%s",
+        'modallgroupgid': "UPDATE `{table}` SET `{gid}`=%s WHERE `{gid}`=%s",
+    }
 
     def getgroupsforusername(self, username):
         """
@@ -147,20 +499,65 @@ class GroupListManager(AbstractManager):
         :type username: unicode
         :return: list
         """
-
-        sql = "SELECT {gid} FROM {grouplist} WHERE `{username}`=%s".format(
-            gid=self.config.get('fields', 'gid', fallback='gid'),
-            grouplist=self.table,
-            username=self.config.get('fields', 'username', fallback='username'))
-
-        with self.dbs.cursor() as cur:
-            cur.execute(sql, username)
+        with self._cursor() as cur:
+            cur.execute(self.sql['getgroupsforusername'], username)
             result = cur.fetchall()
             if not result:
                 raise KeyError("No groups for user with username %s" % username)
 
         return [item for sublist in result for item in sublist]
 
+    def itermemberships(self, username=None, gid=None, gid_min=None, gid_max=None, page_size=1000):
+        """
+        Yields all group/user mappings or the ones of a user or group without loading the table into memory
+
+        :param username: Only the mappings of this user
+        :type username: unicode
+        :param gid: Only the mappings of this group
+        :type gid: int
+        :param gid_min: Only the mappings of groups with at least this GID
+        :type gid_min: int
+        :param gid_max: Only the mappings of groups with at most this GID
+        :type gid_max: int
+        :param page_size: Number of rows per query
+        :type page_size: int
+        :return: A generator of dictionaries with username and gid
+        """
+        return self._iterate((('username', '=', username), ('gid', '=', gid), ('gid', '>=', gid_min),
+                              ('gid', '<=', gid_max)), page_size=page_size)
+
+    def getusersforgids(self, gids):
+        """
+        Returns the members of many groups with one query
+
+        :param gids: The group ids
+        :type gids: iterable
+        :return: A dictionary of gid to the list of usernames, groups without members are left out
+        :rtype: dict
+        """
+        gids = list(gids)
+        members = dict()
+        if not gids:
+            return members
+        sql = "SELECT `{gid}`, `{username}` FROM `{table}` WHERE `{gid}` IN ({values}) ORDER BY `id`".format(
+            table=self.table, values=", ".join(["%s"] * len(gids)), **self.mapping)
+        with self._cursor() as cur:
+            cur.execute(sql, gids)
+            for gid, username in cur.fetchall():
+                members.setdefault(int(gid), []).append(username)
+        return members
+
+    def getusersforgid(self, gid):
+        """
+        Returns the members of a group
+
+        :param gid: The group id
+        :type gid: int
+        :return: The usernames in the order they were added
+        :rtype: list
+        """
+        return self.getusersforgids([gid]).get(int(gid), [])
+
     def addgroupuser(self, username, gid):
         """
         Add a group/user mapping
@@ -168,13 +565,23 @@ class GroupListManager(AbstractManager):
         :param username: A username to add to the mapping
         :param gid: A group id to add to the mapping
         """
-        sql = "INSERT INTO `%s` SET `%s`=%%s,`%s`=%%s;" % (
-            self.table,
-            self.config.get('fields', 'username', fallback='username'),
-            self.config.get('fields', 'gid', fallback='gid'))
+        with self._cursor() as cur:
+            cur.execute(self.sql['addgroupuser'], (username, gid))
 
-        with self.dbs.cursor() as cur:
-            cur.execute(sql, (username, gid))
+    def addgroupusers(self, mappings, batch_size=1000, commit=False):
+        """
+        Add many group/user mappings with batched multi-row INSERTs
+
+        :param mappings: Dictionaries with the keys username and gid
+        :type mappings: iterable
+        :param batch_size: Number of mappings per batch
+        :type batch_size: int
+        :param commit: Commit after every batch
+        :type commit: bool
+        :return: The number of added mappings
+        :rtype: int
+        """
+        return self._insertmany(mappings, batch_size=batch_size, commit=commit)
 
     def delgroupuser(self, username, gid):
         """
@@ -185,13 +592,8 @@ class GroupListManager(AbstractManager):
         :param gid: The group id (gid) for the to delete from
         :type gid: int
         """
-        sql = "DELETE FROM `{grouplist}` WHERE `{username}`=%s and `{gid}`=%s;".format(
-            grouplist=self.table,
-            username=self.config.get('fields', 'username', fallback='username'),
-            gid=self.config.get('fields', 'gid', fallback='gid'))
-
-        with self.dbs.cursor() as cur:
-            cur.execute(sql, (username, gid))
+        with self._cursor() as cur:
+            cur.execute(self.sql['delgroupuser'], (username, gid))
 
     def delallgroupuser(self, username):
         """
@@ -200,12 +602,108 @@ class GroupListManager(AbstractManager):
         :param username: The user to delete from all mappings
         :type username: unicode
         """
-        sql = "DELETE FROM `%s` WHERE `%s`=%%s;" % (
-            self.config.get('tables', 'grouplist', fallback='grouplist'),
-            self.config.get('fields', 'username', fallback='username'))
+        with self._cursor() as cur:
+            cur.execute(self.sql['delallgroupuser'], username)
+
+    def setusergroups(self, username, gids, append=False):
+        """
+        Makes gids the supplementary groups of a user, writing only the difference to the current memberships: one
+        DELETE ... IN for the removed groups and one multi-row INSERT for the new ones
+
+        :param username: The user
+        :type username: unicode
+        :param gids: The group ids
+        :type gids: iterable
+        :param append: Keep the memberships that are not in gids
+        :type append: bool
+        :return: A tuple of the number of added and removed memberships
+        :rtype: tuple
+        """
+        gids = [int(gid) for gid in gids]
+        with self._cursor() as cur:
+            cur.execute(self.sql['getgroupsforusername'], username)
+            current = set(int(row[0]) for row in cur.fetchall())
+
+        added = list()
+        for gid in gids:
+            if gid not in current and gid not in added:
+                added.append(gid)
+        removed = [] if append else sorted(current - set(gids))
+
+        if removed:
+            with self._cursor() as cur:
+                cur.execute("DELETE FROM `{table}` WHERE `{username}`=%s AND `{gid}` IN ({values})".format(
+                    table=self.table, values=", ".join(["%s"] * len(removed)), **self.mapping), [username] + removed)
+        if added:
+            self.addgroupusers((dict(username=username, gid=gid) for gid in added), batch_size=len(added))
+        return len(added), len(removed)
+
+    def addgroupmembers(self, gid, usernames, batch_size=1000):
+        """
+        Adds many users to a group with batched multi-row INSERTs, users that are members already are skipped
 
-        with self.dbs.cursor() as cur:
-            cur.execute(sql, username)
+        :param gid: The group id
+        :type gid: int
+        :param usernames: The users
+        :type usernames: iterable
+        :param batch_size: Number of users per batch
+        :type batch_size: int
+        :return: The number of added memberships
+        :rtype: int
+        """
+        current = set(self.getusersforgid(gid))
+        added = list()
+        for username in usernames:
+            if username not in current:
+                current.add(username)
+                added.append(username)
+        return self.addgroupusers((dict(username=username, gid=gid) for username in added), batch_size=batch_size)
+
+    def delgroupmembers(self, gid, usernames, batch_size=1000):
+        """
+        Removes many users from a group with one DELETE ... IN per batch
+
+        :param gid: The group id
+        :type gid: int
+        :param usernames: The users
+        :type usernames: iterable
+        :param batch_size: Number of users per batch
+        :type batch_size: int
+        :return: The number of removed memberships
+        :rtype: int
+        """
+        count = 0
+        with self._cursor() as cur:
+            for batch in batched(sorted(set(usernames)), batch_size):
+                count += cur.execute("DELETE FROM `{table}` WHERE `{gid}`=%s AND `{username}` IN ({values})".format(
+                    table=self.table, values=", ".join(["%s"] * len(batch)), **self.mapping), [gid] + batch)
+        return count
+
+    def setgroupmembers(self, gid, usernames, batch_size=1000):
+        """
+        Makes usernames the members of a group, writing only the difference to the current members: the removed
+        members with :meth:`delgroupmembers` and the new ones with :meth:`addgroupusers`
+
+        :param gid: The group id
+        :type gid: int
+        :param usernames: The users, an empty list removes all members
+        :type usernames: iterable
+        :param batch_size: Number of users per statement
+        :type batch_size: int
+        :return: A tuple of the number of added and removed memberships
+        :rtype: tuple
+        """
+        current = set(self.getusersforgid(gid))
+        wanted = list()
+        for username in usernames:
+            if username not in wanted:
+                wanted.append(username)
+
+        removed = sorted(current - set(wanted))
+        added = [username for username in wanted if username not in current]
+        count = self.delgroupmembers(gid, removed, batch_size=batch_size) if removed else 0
+        self.addgroupusers((dict(username=username, gid=gid) for username in added), batch_size=batch_size)
+        return len(added), count
 
     def modallgroupuser(self, username, new_username):
         """
@@ -216,11 +714,8 @@ class GroupListManager(AbstractManager):
         :param new_username: New username
         :type new_username: unicode
         """
-        sql = "UPDATE `{grouplist}` SET `{username}`=%s WHERE `{username}`=%s".format(
-            grouplist=self.config.get('tables', 'grouplist', fallback='grouplist'),
-            username=self.config.get('fields', 'username', fallback='username'))
-        with self.dbs.cursor() as cur:
-            cur.execute(sql, (new_username, username))
+        with self._cursor() as cur:
+            cur.execute(self.sql['modallgroupuser'], (new_username, username))
 
     def modallgroupgid(self, gid, new_gid):
         """
@@ -231,11 +726,8 @@ class GroupListManager(AbstractManager):
         :param new_gid: New group id
         :type new_gid: int
         """
-        sql = "UPDATE `{grouplist}` SET `{gid}`=%s WHERE `{gid}`=%s".format(
-            grouplist=self.config.get('tables', 'grouplist', fallback='grouplist'),
-            gid=self.config.get('fields', 'gid', fallback='gid'))
-        with self.dbs.cursor() as cur:
-            cur.execute(sql, (new_gid, gid))
+        with self._cursor() as cur:
+            cur.execute(self.sql['modallgroupgid'], (new_gid, gid))
 
 
 class GroupManager(AbstractManager):
@@ -248,6 +740,16 @@ class GroupManager(AbstractManager):
     :type dbs: pymysql.Connection
     """
 
+    tablename = 'group'
+    fields = ('name', 'gid', 'password')
+    statements = {
+        'getgroupbyname': "SELECT * FROM `{table}` WHERE `{name}`=%s",
+        'getgroupbygid': "SELECT * FROM `{table}` WHERE `{gid}`=%s",
+        'getallgids': "SELECT DISTINCT `{gid}` FROM `{table}`",
+        'getconflicts': "SELECT MAX(`{name}`=%s), MAX(`{gid}`=%s) FROM `{table}` WHERE `{name}`=%s OR `{gid}`=%s",
+        'delgroup': "DELETE FROM `{table}` WHERE `{gid}`=%s",
+    }
+
     def getgroupbyname(self, group):
         """
         Returns the group for the given name
@@ -257,15 +759,9 @@ class GroupManager(AbstractManager):
         :return: A dictionary of the user
         :rtype: dict
         """
-
-        sql = "SELECT * FROM `{group}` WHERE `{name}`=%s".format(
-            group=self.config.get('tables', 'group', fallback='group'),
-            name=self.config.get('fields', 'name', fallback='name'))
-        with self.dbs.cursor(cursor=DictCursor) as cur:
-            cur.execute(sql, group)
-            result = cur.fetchone()
-            if not result:
-                raise KeyError('Group "{name}" not in Database'.format(name=group))
+        result = self._lookup('getgroupbyname', 'name', group)
+        if not result:
+            raise KeyError('Group "{name}" not in Database'.format(name=group))
         return result
 
     def getgroupbygid(self, gid):
@@ -277,65 +773,446 @@ class GroupManager(AbstractManager):
         :return: A dictionary of the user
         :rtype: dict
         """
-
-        sql = "SELECT * FROM `{group}` WHERE `{gid}`=%s".format(
-            group=self.config.get('tables', 'group', fallback='group'),
-            gid=self.config.get('fields', 'gid', fallback='gid'))
-        with self.dbs.cursor(cursor=DictCursor) as cur:
-            cur.execute(sql, gid)
-            result = cur.fetchone()
-            if not result:
-                raise KeyError('Group "{gid}" not in Database'.format(gid=gid))
+        result = self._lookup('getgroupbygid', 'gid', gid)
+        if not result:
+            raise KeyError('Group "{gid}" not in Database'.format(gid=gid))
         return result
 
-    def addgroup(self, name, gid, password=None):
-        l = locals()
+    def getallgids(self):
+        """
+        Gets all group ids in the database
+
+        :return: list
+        """
+        with self._cursor() as cur:
+            cur.execute(self.sql['getallgids'])
+            result = cur.fetchall()
 
-        fields = ""
-        values = list()
+        return [int(row[0]) for row in result]
 
-        for k in l:
-            if k == 'self':
-                continue
-            if l[k] is not None:
-                fields += ("`%s` = %%s, " % (self.config.get('fields', k, fallback=k)))
-                values.append(l[k])
-        fields = fields[:-2]
+    def itergroups(self, gid_min=None, gid_max=None, page_size=1000):
+        """
+        Yields all groups or the ones in a GID range without loading the table into memory
+
+        :param gid_min: Only groups with at least this GID
+        :type gid_min: int
+        :param gid_max: Only groups with at most this GID
+        :type gid_max: int
+        :param page_size: Number of rows per query
+        :type page_size: int
+        :return: A generator of dictionaries of the groups
+        """
+        return self._iterate((('gid', '>=', gid_min), ('gid', '<=', gid_max)), page_size=page_size)
 
-        sql = "INSERT INTO `%s` SET %s;" % (self.config.get('tables', 'group', fallback='group'), fields)
+    def getgidsbyname(self, names):
+        """
+        Looks up the GIDs of many groups with one query
 
-        with self.dbs.cursor() as cur:
-            cur.execute(sql, values)
+        :param names: The group names
+        :type names: iterable
+        :return: A dictionary of name to GID, names that aren't in the database are left out
+        :rtype: dict
+        """
+        names = list(set(names))
+        if not names:
+            return dict()
+        sql = "SELECT `{name}`, `{gid}` FROM `{table}` WHERE `{name}` IN ({values})".format(
+            table=self.table, values=", ".join(["%s"] * len(names)), **self.mapping)
+        with self._cursor() as cur:
+            cur.execute(sql, names)
+            return dict((name, int(gid)) for name, gid in cur.fetchall())
+
+    def itergroupmembers(self):
+        """
+        Yields every group with its members from one query joining the grouplist table.
 
-    def delgroup(self, gid):
+        The rows are streamed from the server, so the connection can't be used for anything else until the generator
+        is exhausted or closed.
 
-        args = (self.config.get('tables', 'group', fallback='group'), self.config.get('fields', 'gid', fallback='gid'))
+        :return: A generator of (group, usernames) tuples
+        """
+        sql = ("SELECT g.*, l.`{username}` AS `member` FROM `{table}` g LEFT JOIN `{grouplist}` l "
+               "ON l.`{gid}` = g.`{gid}` ORDER BY g.`id`, l.`id`").format(
+            table=self.table, grouplist=self.config.get('tables', 'grouplist', fallback='grouplist'),
+            username=self.config.get('fields', 'username', fallback='username'), gid=self.mapping['gid'])
+
+        with self._cursor(SSDictCursor) as cur:
+            cur.execute(sql)
+            for _, rows in itertools.groupby(cur, key=lambda row: row['id']):
+                rows = list(rows)
+                group = rows[0]
+                members = [row.pop('member') for row in rows]
+                yield group, [member for member in members if member is not None]
+
+    def getconflicts(self, name=None, gid=None, localfile=None):
+        """
+        Checks whether a group name and GID are taken, with one query for both
 
-        sql_delete = "DELETE FROM `%s` WHERE `%s`=%%s" % args
+        :param name: The group name to check, None to skip it
+        :type name: unicode
+        :param gid: The GID to check, None to skip it
+        :type gid: int
+        :param localfile: A group file whose entries are checked too, e.g. /etc/group
+        :type localfile: unicode
+        :return: The taken fields out of name and gid
+        :rtype: list
+        """
+        return self._conflicts('name', name, 'gid', gid, localfile)
 
-        with self.dbs.cursor() as cur:
-            self.getgroupbygid(gid)
-            cur.execute(sql_delete, gid)
+    def addgroup(self, name, gid, password=None):
+        l = locals()
+
+        keys = tuple(k for k in self.fields if l[k] is not None)
+
+        with self._cursor() as cur:
+            cur.execute(self._statement('insert', keys), [l[k] for k in keys])
+
+    def addgroups(self, groups, batch_size=1000, commit=False):
+        """
+        Adds many groups with batched multi-row INSERTs
+
+        :param groups: Dictionaries with the same keys as the arguments of :meth:`addgroup`
+        :type groups: iterable
+        :param batch_size: Number of groups per batch
+        :type batch_size: int
+        :param commit: Commit after every batch
+        :type commit: bool
+        :return: The number of added groups
+        :rtype: int
+        """
+        return self._insertmany(groups, batch_size=batch_size, commit=commit)
+
+    def delgroup(self, gid):
+        with self._cursor() as cur:
+            deleted = cur.execute(self.sql['delgroup'], gid)
+        self._invalidate(gid=gid)
+        if not deleted:
+            raise KeyError('Group "{gid}" not in Database'.format(gid=gid))
 
     def modgroup(self, name_old, name, gid, password):
         l = locals()
-        fields = ""
-        values = list()
-
-        for k in l:
-            if l[k] is not None and k != 'self' and k != 'name_old':
-                fields += ("`%s` = %%s, " % (self.config.get('fields', k, fallback=k)))
-                values.append(l[k])
-        fields = fields[:-2]
-        if not values:
+
+        keys = tuple(k for k in self.fields if l[k] is not None)
+        if not keys:
             return
 
-        values.append(name_old)
-        sql = "UPDATE `{group}` SET {fields} WHERE `{name}` = %s;".format(
-            group=self.config.get('tables', 'group', fallback='group'),
-            fields=fields,
-            name=self.config.get('fields', 'name', fallback='name'))
+        with self._cursor() as cur:
+            cur.execute(self._statement('update', ('name',) + keys), [l[k] for k in keys] + [name_old])
+            matched = self._matched(cur, 'getgroupbyname', name_old)
+        self._invalidate(name=name_old)
+        if not matched:
+            raise KeyError('Group "{name}" not in Database'.format(name=name_old))
+
+
+class AccountManager(AbstractManager):
+    """
+    Manages accounts spanning the user, group and grouplist tables
+
+    The methods only execute statements, the caller commits or rolls back the transaction they belong to.
 
-        with self.dbs.cursor() as cur:
-            self.getgroupbyname(name_old)
-            cur.execute(sql, values)
+    :param config: The config for the manager
+    :type config: ConfigParser
+    :param dbs: The :class:`pymysql.Connection` instance to use
+    :type dbs: pymysql.Connection
+    :param cache: Optional cache for lookups, which the write methods invalidate
+    :type cache: pammysqltools.cache.LookupCache
+    """
+
+    def __init__(self, config, dbs, cache=None):
+        super(AccountManager, self).__init__(config, dbs, cache=cache)
+        self.um = UserManager(config, dbs, cache=cache)
+        self.gm = GroupManager(config, dbs, cache=cache)
+        self.glm = GroupListManager(config, dbs, cache=cache)
+
+    def compile(self):
+        """
+        Rebuilds the statements of the user, group and grouplist managers as well, whose columns the statements of
+        the account methods are built from
+        """
+        super(AccountManager, self).compile()
+        # The base class compiles before the sub managers exist
+        for manager in (getattr(self, 'um', None), getattr(self, 'gm', None), getattr(self, 'glm', None)):
+            if manager is not None:
+                manager.compile()
+
+    def createaccount(self, username, gid, uid, groups=(), usergroup=False, grouppassword=None, **fields):
+        """
+        Adds a user together with its user private group and its supplementary group memberships
+
+        These are at most three INSERTs, the memberships are written with one multi-row INSERT.
+
+        :param username: The username
+        :type username: unicode
+        :param gid: The GID of the primary group
+        :type gid: int
+        :param uid: The UID
+        :type uid: int
+        :param groups: GIDs of the supplementary groups
+        :type groups: iterable
+        :param usergroup: Add a group with the username and gid
+        :type usergroup: bool
+        :param grouppassword: Password of the user private group
+        :type grouppassword: unicode
+        :param fields: The other arguments of :meth:`UserManager.adduser`
+        """
+        self.um.adduser(username=username, gid=gid, uid=uid, **fields)
+
+        if usergroup:
+            self.gm.addgroup(username, gid, grouppassword)
+
+        memberships = list()
+        for g in groups:
+            if g not in memberships:
+                memberships.append(g)
+        if memberships:
+            self.glm.addgroupusers(dict(username=username, gid=g) for g in memberships)
+
+    def moduser(self, username_old, username=None, **fields):
+        """
+        Changes a user like :meth:`UserManager.moduser`. A new username is written to the group memberships of the
+        user by the same multi-table UPDATE, so a rename is one statement however many groups the user is in.
+
+        :param username_old: The current username
+        :type username_old: unicode
+        :param username: The new username
+        :type username: unicode
+        :param fields: The other arguments of :meth:`UserManager.moduser`
+        :raises KeyError: If the user doesn't exist, nothing is changed then
+        """
+        if username is None:
+            return self.um.moduser(username_old, **fields)
+        unknown = set(fields) - set(self.um.fields)
+        if unknown:
+            raise TypeError("Unknown fields: %s" % ", ".join(sorted(unknown)))
+
+        fields['username'] = username
+        keys = tuple(k for k in self.um.fields if fields.get(k) is not None)
+        sql = self._statements.get(('moduser', keys))
+        if sql is None:
+            # The join compares with the old name instead of u.username, which the statement changes
+            sql = ("UPDATE `{user}` u LEFT JOIN `{grouplist}` l ON l.`{member}` = %s "
+                   "SET {fields}, l.`{member}` = %s WHERE u.`{username}` = %s").format(
+                user=self.um.table, grouplist=self.glm.table, member=self.glm.mapping['username'],
+                username=self.um.mapping['username'],
+                fields=", ".join("u.`%s` = %%s" % self.um.mapping[k] for k in keys))
+            self._statements[('moduser', keys)] = sql
+
+        with self._cursor() as cur:
+            cur.execute(sql, [username_old] + [fields[k] for k in keys] + [username, username_old])
+            matched = self.um._matched(cur, 'getuserbyusername', username_old)
+        self.um._invalidate(username=username_old)
+        if not matched:
+            raise KeyError("No user with username %s" % username_old)
+
+    def modgroup(self, name_old, name=None, gid=None, password=None, gid_old=None):
+        """
+        Changes a group like :meth:`GroupManager.modgroup`. A new GID is written to the users with the old GID as
+        primary group and to the memberships by the same multi-table UPDATE, so renumbering a group is one statement
+        however many users it has.
+
+        The users and memberships are joined to a derived table of three rows (the group, its users and its members)
+        instead of to each other, which keeps the join linear in their number.
+
+        :param name_old: The current name of the group
+        :type name_old: unicode
+        :param name: The new name
+        :type name: unicode
+        :param gid: The new GID
+        :type gid: int
+        :param password: The new password
+        :type password: unicode
+        :param gid_old: The current GID, looked up by name_old if it isn't given
+        :type gid_old: int
+        :raises KeyError: If the group doesn't exist, nothing is changed then
+        """
+        if gid is None:
+            return self.gm.modgroup(name_old, name, gid, password)
+        if gid_old is None:
+            gid_old = int(self.gm.getgroupbyname(name_old)[self.gm.mapping['gid']])
+
+        values = dict(name=name, gid=gid, password=password)
+        keys = tuple(k for k in self.gm.fields if values[k] is not None)
+        sql = self._statements.get(('modgroup', keys))
+        if sql is None:
+            sql = ("UPDATE `{group}` g JOIN (SELECT 0 AS `part` UNION ALL SELECT 1 UNION ALL SELECT 2) p "
+                   "LEFT JOIN `{user}` u ON p.`part` = 1 AND u.`{user_gid}` = %s "
+                   "LEFT JOIN `{grouplist}` l ON p.`part` = 2 AND l.`{member_gid}` = %s "
+                   "SET {fields}, u.`{user_gid}` = %s, l.`{member_gid}` = %s WHERE g.`{name}` = %s").format(
+                group=self.gm.table, user=self.um.table, grouplist=self.glm.table, name=self.gm.mapping['name'],
+                user_gid=self.um.mapping['gid'], member_gid=self.glm.mapping['gid'],
+                fields=", ".join("g.`%s` = %%s" % self.gm.mapping[k] for k in keys))
+            self._statements[('modgroup', keys)] = sql
+
+        with self._cursor() as cur:
+            cur.execute(sql, [gid_old, gid_old] + [values[k] for k in keys] + [gid, gid, name_old])
+            matched = self.gm._matched(cur, 'getgroupbyname', name_old)
+        self.gm._invalidate(name=name_old)
+        self.um._invalidate(gid=gid_old)
+        if not matched:
+            raise KeyError('Group "{name}" not in Database'.format(name=name_old))
+
+
+class SchemaManager(AbstractManager):
+    """
+    Creates and upgrades the tables and their indexes
+
+    :param config: The config for the manager
+    :type config: configparser
+    :param dbs: The :class:`pymysql.Connection` instance to use
+    :type dbs: pymysql.Connection
+    """
+
+    #: The columns of every table as (field, definition)
+    columns = OrderedDict([
+        ('user', (
+            ('username', "VARCHAR(255) NOT NULL"),
+            ('gid', "INT(10) UNSIGNED NOT NULL"),
+            ('uid', "INT(10) UNSIGNED NOT NULL"),
+            ('gecos', "VARCHAR(255) NOT NULL DEFAULT ''"),
+            ('homedir', "VARCHAR(255) NOT NULL DEFAULT ''"),
+            ('shell', "VARCHAR(255) NOT NULL DEFAULT ''"),
+            ('password', "VARCHAR(255) NOT NULL DEFAULT '!'"),
+            ('lstchg', "BIGINT(20) UNSIGNED NOT NULL"),
+            ('mini', "BIGINT(20) NOT NULL DEFAULT '0'"),
+            ('maxi', "BIGINT(20) NOT NULL DEFAULT '99999'"),
+            ('warn', "BIGINT(20) NOT NULL DEFAULT '7'"),
+            ('inact', "BIGINT(20) NOT NULL DEFAULT '-1'"),
+            ('expire', "BIGINT(20) NOT NULL DEFAULT '-1'"),
+            ('flag', "INT(11) NOT NULL DEFAULT '-1'"),
+        )),
+        ('group', (
+            ('name', "VARCHAR(255) NOT NULL"),
+            ('gid', "INT(10) UNSIGNED NOT NULL"),
+            ('password', "VARCHAR(255) NOT NULL DEFAULT '!'"),
+        )),
+        ('grouplist', (
+            ('username', "VARCHAR(255) NOT NULL"),
+            ('gid', "INT(10) UNSIGNED NOT NULL"),
+        )),
+    ])
+
+    #: The indexes of every table as (name, fields, unique). UIDs and GIDs stay non-unique because of --non-unique.
+    indexes = OrderedDict([
+        ('user', (
+            ('username', ('username',), True),
+            ('uid', ('uid',), False),
+            ('gid', ('gid',), False),
+        )),
+        ('group', (
+            ('name', ('name',), True),
+            ('gid', ('gid',), False),
+        )),
+        ('grouplist', (
+            ('username_gid', ('username', 'gid'), True),
+            ('gid', ('gid',), False),
+        )),
+    ])
+
+    #: The lookups issued by the managers and libnss-mysql as (name, table, field)
+    lookups = (
+        ('getpwnam', 'user', 'username'),
+        ('getpwuid', 'user', 'uid'),
+        ('getgrnam', 'group', 'name'),
+        ('getgrgid', 'group', 'gid'),
+        ('memsbygid', 'grouplist', 'gid'),
+        ('gidsbymem', 'grouplist', 'username'),
+    )
+
+    def _table(self, table):
+        return self.config.get('tables', table, fallback=table)
+
+    def _field(self, field):
+        return self.config.get('fields', field, fallback=field)
+
+    def createtables(self):
+        """
+        Creates all missing tables including their indexes
+        """
+        with self._cursor() as cur:
+            for table, columns in self.columns.items():
+                definitions = ["`id` BIGINT(20) UNSIGNED NOT NULL AUTO_INCREMENT"]
+                definitions += ["`%s` %s" % (self._field(field), definition) for field, definition in columns]
+                definitions.append("PRIMARY KEY (`id`)")
+                for name, fields, unique in self.indexes[table]:
+                    definitions.append("%sKEY `%s` (%s)" % ("UNIQUE " if unique else "", name,
+                                                            ", ".join("`%s`" % self._field(f) for f in fields)))
+
+                sql = "CREATE TABLE IF NOT EXISTS `{table}` (\n  {definitions}\n) ENGINE=InnoDB DEFAULT CHARSET=utf8"
+                cur.execute(sql.format(table=self._table(table), definitions=",\n  ".join(definitions)))
+
+    def getindexes(self, table):
+        """
+        Returns the indexes of a table
+
+        :param table: The logical name of the table (user, group or grouplist)
+        :type table: unicode
+        :return: A dictionary of index name to a tuple of (columns, unique)
+        :rtype: dict
+        """
+        sql = "SHOW INDEX FROM `{table}`".format(table=self._table(table))
+
+        indexes = OrderedDict()
+        with self._cursor(DictCursor) as cur:
+            cur.execute(sql)
+            for row in sorted(cur.fetchall(), key=lambda r: (r['Key_name'], r['Seq_in_index'])):
+                columns, unique = indexes.get(row['Key_name'], ((), not row['Non_unique']))
+                indexes[row['Key_name']] = (columns + (row['Column_name'],), unique)
+        return indexes
+
+    def missingindexes(self):
+        """
+        Returns the indexes that don't exist yet. A plain index exists if any index starts with its columns, a unique
+        index needs a unique index on exactly its columns.
+
+        :return: A list of (table, name, fields, unique) tuples
+        :rtype: list
+        """
+        missing = list()
+        for table, indexes in self.indexes.items():
+            existing = self.getindexes(table).values()
+            for name, fields, unique in indexes:
+                columns = tuple(self._field(f) for f in fields)
+                if not any(cols == columns and is_unique if unique else cols[:len(columns)] == columns
+                           for cols, is_unique in existing):
+                    missing.append((table, name, fields, unique))
+        return missing
+
+    def migrate(self):
+        """
+        Adds all missing indexes. Adding a unique index fails if the table contains duplicates.
+
+        :return: A list of the added (table, name, fields, unique) tuples
+        :rtype: list
+        """
+        missing = self.missingindexes()
+        with self._cursor() as cur:
+            for table, name, fields, unique in missing:
+                sql = "ALTER TABLE `{table}` ADD {unique}INDEX `{name}` ({columns})".format(
+                    table=self._table(table), unique="UNIQUE " if unique else "", name=name,
+                    columns=", ".join("`%s`" % self._field(f) for f in fields))
+                cur.execute(sql)
+        return missing
+
+    def explain(self):
+        """
+        Runs EXPLAIN for the lookups in :attr:`lookups`
+
+        :return: A dictionary of lookup name to the used index or None for a full table scan
+        :rtype: dict
+        """
+        result = OrderedDict()
+        with self._cursor(DictCursor) as cur:
+            for name, table, field in self.lookups:
+                sql = "EXPLAIN SELECT * FROM `{table}` WHERE `{field}`=%s".format(
+                    table=self._table(table), field=self._field(field))
+                cur.execute(sql, 0 if field in ('uid', 'gid') else '')
+                row = cur.fetchone()
+                extra = row.get('Extra') or ''
+                if row.get('key'):
+                    result[name] = row['key']
+                elif 'const table' in extra or 'Impossible WHERE' in extra:
+                    # The optimizer answered the lookup without reading rows (empty table or unique index)
+                    result[name] = row.get('possible_keys') or 'const'
+                else:
+                    result[name] = None
+        return result
@@ -4,28 +4,35 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 from builtins import int
-from builtins import open
-from builtins import range
 from builtins import str
-from future import standard_library
+import sys
 
-standard_library.install_aliases()
+# The aliases are only needed on Python 2, importing future costs noticeable startup time
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import contextlib
 import datetime
 import gettext
 import grp
+import itertools
 import os.path
 import pwd
-import shutil
 import syslog
 
 import click
 # noinspection PyUnresolvedReferences
 import __main__
-from pammysqltools.helpers import get_config, find_new_uid, find_new_gid, connect_db, get_useradd_conf, get_defs, \
-    create_home, get_gid, get_uid
-from pammysqltools.manager import UserManager, GroupListManager, GroupManager
+from pammysqltools import instrument
+from pammysqltools.helpers import get_config, connect_db, find_new_uid, find_new_gid, get_pool, get_socket_path, \
+    get_useradd_conf, get_defs, create_home, get_gid, get_uid, IdAllocator, GroupResolver, read_local_ids, \
+    read_colon_file, merge_by_name, batched, format_passwd, format_shadow, format_group, format_gshadow
 from pammysqltools.validators import keyvalue, date, list
 
+# pymysql, the managers, the batch runner, the exporter, the journal and the daemon are imported by the commands that
+# use them, so that --help and commands talking to the daemon start fast.
+
 progname = os.path.basename(__main__.__file__)
 
 gettext.install('messages', os.path.join(os.path.dirname(os.path.realpath(__file__)), "locales"))
@@ -35,6 +42,175 @@ syslog.openlog(progname)
 REFDATE = datetime.date(1970, 1, 1)
 
 
+@contextlib.contextmanager
+def database(ctx, conf, remote=True):
+    """
+    Yields the connection of the current command chain.
+
+    The outermost command checks a connection out of the pool and commits when it finishes, commands invoked from it
+    with ``ctx.invoke`` run inside the same transaction. If remote is set and a daemon socket is configured, a
+    :class:`ManagementClient` for the daemon takes the place of the connection.
+    """
+    dbs = ctx.meta.get('pammysqltools.dbs')
+    if dbs is not None:
+        yield dbs
+        return
+
+    instrument.configure(conf)
+    path = get_socket_path(conf)
+    try:
+        if remote and path and os.path.exists(path):
+            from pammysqltools.daemon import ManagementClient
+            dbs = ManagementClient(path)
+            ctx.meta['pammysqltools.dbs'] = dbs
+            try:
+                yield dbs
+                dbs.commit()
+            except BaseException:
+                dbs.rollback()
+                raise
+            finally:
+                del ctx.meta['pammysqltools.dbs']
+                dbs.close()
+        else:
+            with get_pool(conf).connection() as dbs:
+                ctx.meta['pammysqltools.dbs'] = dbs
+                try:
+                    yield dbs
+                finally:
+                    del ctx.meta['pammysqltools.dbs']
+    except BaseException:
+        ctx.meta.pop('pammysqltools.homes', None)
+        raise
+
+    # Commands that commit in batches (myimportusers) have written their jobs to the journal already
+    journal = ctx.meta.pop('pammysqltools.homes', None)
+    if journal is not None and (len(journal) or journal.committed):
+        run_homes(journal)
+
+
+def homes(ctx, conf):
+    """
+    Returns the :class:`HomeJournal` of the current command chain. Its jobs run when :func:`database` has committed.
+    """
+    journal = ctx.meta.get('pammysqltools.homes')
+    if journal is None:
+        from pammysqltools.journal import get_journal
+        journal = ctx.meta['pammysqltools.homes'] = get_journal(conf)
+    return journal
+
+
+def run_homes(journal):
+    """
+    Writes the queued jobs to the journal and runs all jobs in it, including the failed ones of earlier runs. Exits
+    with 1 if a job failed.
+    """
+    from pammysqltools.journal import retryable
+    messages = {
+        'create': _('Error: Can\'t create home directory "{path}": {error}'),
+        'remove': _('Error: Can\'t remove home directory "{path}": {error}'),
+        'move': _('Error: Can\'t move home directory "{path}" to "{target}": {error}'),
+    }
+
+    try:
+        journal.commit()
+        failed = journal.run()
+    except (IOError, OSError) as e:
+        print(_('Error: Can\'t use the journal "{path}": {error}').format(path=journal.path, error=e))
+        exit(1)
+        return
+
+    for job, error in failed:
+        print(messages[job['action']].format(path=job['path'], target=job.get('target'), error=error))
+    if any(retryable(job, error) for job, error in failed):
+        print(_("Warning: The failed jobs stay in the journal, run myhomes to retry them"))
+    if failed:
+        exit(1)
+
+
+def manager(name, conf, dbs):
+    """
+    Returns the manager with the class name for the connection from :func:`database`, which is a proxy if the daemon
+    is used
+    """
+    if getattr(dbs, 'remote', False):
+        return dbs.manager(name)
+    from pammysqltools import manager as managers
+    from pammysqltools.cache import get_cache
+    return getattr(managers, name)(conf, dbs, cache=get_cache(conf))
+
+
+def new_uid(conf, dbs, sysuser, preferred_uid=None, defs=None):
+    if getattr(dbs, 'remote', False):
+        return dbs.find_new_uid(sysuser, preferred_uid=preferred_uid,
+                                overrides=defs.overrides() if defs is not None else None)
+    return find_new_uid(sysuser, preferred_uid=preferred_uid, allocator=uid_allocator(conf, dbs), defs=defs)
+
+
+def new_gid(conf, dbs, sysuser, preferred_gid=None, defs=None):
+    if getattr(dbs, 'remote', False):
+        return dbs.find_new_gid(sysuser, preferred_gid=preferred_gid,
+                                overrides=defs.overrides() if defs is not None else None)
+    return find_new_gid(sysuser, preferred_gid=preferred_gid, allocator=gid_allocator(conf, dbs), defs=defs)
+
+
+def group_resolver(ctx, conf, dbs):
+    """
+    Returns the :class:`GroupResolver` of the current command chain, which looks names up in the group table and then
+    in /etc/group
+    """
+    resolver = ctx.meta.get('pammysqltools.groups')
+    if resolver is None:
+        resolver = GroupResolver(manager('GroupManager', conf, dbs).getgidsbyname)
+        ctx.meta['pammysqltools.groups'] = resolver
+    return resolver
+
+
+def group_ids(ctx, conf, dbs, groups):
+    """
+    Returns the GIDs of a list of group names or GIDs. The names are looked up in the group table with one query,
+    the ones that aren't there in /etc/group. The results are kept for the whole command, groups that can't be found
+    are reported and left out.
+    """
+    found = group_resolver(ctx, conf, dbs).resolve(groups)
+    for group in groups:
+        if group not in found:
+            print(_("Warning: Can't find group {group}").format(group=group))
+    return [found[group] for group in groups if group in found]
+
+
+def uid_allocator(conf, dbs):
+    """
+    Loads the UIDs used in the database and in /etc/passwd into an :class:`IdAllocator`
+    """
+    return IdAllocator(itertools.chain(manager('UserManager', conf, dbs).getalluids(), read_local_ids('/etc/passwd')))
+
+
+def gid_allocator(conf, dbs):
+    """
+    Loads the GIDs used in the database and in /etc/group into an :class:`IdAllocator`
+    """
+    return IdAllocator(itertools.chain(manager('GroupManager', conf, dbs).getallgids(), read_local_ids('/etc/group')))
+
+
+def _profile(ctx, param, value):
+    if not value or ctx.resilient_parsing:
+        return
+    summary = instrument.Summary()
+    instrument.add_hook(summary)
+
+    def report():
+        instrument.remove_hook(summary)
+        click.echo(summary.report(), err=True)
+
+    ctx.call_on_close(report)
+
+
+#: Option that prints the time spent in every SQL statement when the command finishes
+profile_option = click.option('--profile', is_flag=True, expose_value=False, callback=_profile,
+                              help=_('print the time spent in every SQL statement'))
+
+
 @click.group()
 def cli():
     pass
@@ -63,102 +239,90 @@ def cli():
 @click.option('-r', '--system', is_flag=True, help=_('create a system account'))
 @click.option('-s', '--shell', help=_('login shell of the new account'), metavar=_('SHELL'))
 @click.option('-u', '--uid', type=int, help=_('user ID of the new account'), metavar=_('UID'))
+@profile_option
 @click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
 @click.argument('login')
 @click.pass_context
 def useradd(ctx, basedir, comment, home_dir, expiredate, inactive, gid, groups, skel, key, no_create_home,
             no_user_group, non_unique, password, system, shell, uid, config, login):
     conf = get_config(config)
-    defs = get_defs()
+    defs = get_defs().override(key)
     useradd_conf = get_useradd_conf()
 
-    for k, v in key:
-        defs[k] = v
+    with database(ctx, conf) as dbs:
+        pm = manager('UserManager', conf, dbs)
 
-    if not uid:
-        uid = find_new_uid(sysuser=system)
-    else:
-        try:
-            if not non_unique and pwd.getpwuid(uid):
+        if not non_unique:
+            conflicts = pm.getconflicts(username=login, uid=uid or None, localfile='/etc/passwd')
+            if 'uid' in conflicts:
                 print(_("Error: UID already taken"))
                 exit(1)
-        except KeyError:
-            pass
-
-    try:
-        if not non_unique and pwd.getpwnam(login):
-            print(_("Error: Login name already taken"))
-            exit(1)
-    except KeyError:
-        pass
+            if 'username' in conflicts:
+                print(_("Error: Login name already taken"))
+                exit(1)
 
-    if not shell:
-        shell = useradd_conf.get('SHELL', '')
+        if not uid:
+            uid = new_uid(conf, dbs, system, defs=defs)
 
-    if not basedir:
-        basedir = useradd_conf.get('HOME', '/home')
+        if not shell:
+            shell = useradd_conf.get('SHELL', '')
 
-    if not home_dir:
-        home_dir = os.path.join(basedir, login)
+        if not basedir:
+            basedir = useradd_conf.get('HOME', '/home')
 
-    if not gid:
-        try:
-            gr = grp.getgrnam(login)
-            if gr:
-                gid = int(gr.gr_gid)
-                no_user_group = True
+        if not home_dir:
+            home_dir = os.path.join(basedir, login)
 
-        except KeyError:
-            gid = find_new_gid(sysuser=system, preferred_gid=uid)
-    else:
-        gid = get_gid(gid)
+        if not gid:
+            try:
+                gr = grp.getgrnam(login)
+                if gr:
+                    gid = int(gr.gr_gid)
+                    no_user_group = True
 
-    if expiredate:
-        expiredate = (expiredate - REFDATE).days
+            except KeyError:
+                gid = new_gid(conf, dbs, system, preferred_gid=uid, defs=defs)
+        else:
+            # An existing group was chosen as primary group
+            gid = get_gid(gid)
+            no_user_group = True
 
-    if not no_create_home:
-        if not skel:
-            skel = useradd_conf.get('SKEL', '/etc/skel')
-        try:
-            create_home(home_dir, skel, uid, gid)
-        except PermissionError:
-            print(_("Error: Insufficient permissions to create home dir"))
-            exit(1)
-        except FileExistsError:
-            print(_('Error: Directory "%s" already exists') % home_dir)
-            exit(1)
+        if expiredate:
+            expiredate = (expiredate - REFDATE).days
 
-    lastchg = datetime.date.today() - REFDATE
+        gids = group_ids(ctx, conf, dbs, groups or ())
 
-    dbs = connect_db(conf)
+        lastchg = datetime.date.today() - REFDATE
 
-    pm = UserManager(conf, dbs)
-    pm.adduser(username=login, gid=gid, uid=uid, gecos=comment, homedir=home_dir, shell=shell, lstchg=lastchg.days,
-               mini=defs.get('PASS_MIN_DAYS', 0), maxi=defs.get('PASS_MAX_DAYS', 99999),
-               warn=defs.get('PASS_WARN_DAYS', 7), expire=expiredate, inact=inactive, password=password)
+        am = manager('AccountManager', conf, dbs)
+        am.createaccount(username=login, gid=gid, uid=uid, groups=gids, usergroup=not no_user_group, gecos=comment,
+                         homedir=home_dir, shell=shell, lstchg=lastchg.days, mini=defs.getint('PASS_MIN_DAYS', 0),
+                         maxi=defs.getint('PASS_MAX_DAYS', 99999), warn=defs.getint('PASS_WARN_DAYS', 7),
+                         expire=expiredate, inact=inactive, password=password)
 
-    if groups:
-        glm = GroupListManager(conf, dbs)
-        for g in groups:
+        # The home directory comes last, if it can't be created the transaction is rolled back on exit
+        if not no_create_home:
+            if not skel:
+                skel = useradd_conf.get('SKEL', '/etc/skel')
             try:
-                glm.addgroupuser(login, get_gid(g))
-            except KeyError:
-                print(_("Warning: Can't find group {group}").format(group=g))
-
-    dbs.commit()
-    dbs.close()
-
-    if not no_user_group:
-        ctx.invoke(groupadd, group=login, gid=gid, system=system, config=config, non_unique=non_unique)
+                create_home(home_dir, skel, uid, gid, umask=defs.getoctal('UMASK', 0o022))
+            except PermissionError:
+                print(_("Error: Insufficient permissions to create home dir"))
+                exit(1)
+            except FileExistsError:
+                print(_('Error: Directory "%s" already exists') % home_dir)
+                exit(1)
 
 
 @click.command()
 @click.option('-f', '--force', is_flag=True,
               help=_('force removal of files, even if not owned by user'))
 @click.option('-r', '--remove', is_flag=True, help=_('remove home directory and mail spool'))
+@profile_option
 @click.option('--config', help=_('path to the config file for this tool'))
 @click.argument('login')
-def userdel(force, remove, config, login):
+@click.pass_context
+def userdel(ctx, force, remove, config, login):
     user = None
     try:
         user = pwd.getpwnam(login)
@@ -167,44 +331,36 @@ def userdel(force, remove, config, login):
         exit(1)
 
     conf = get_config(config)
-    dbs = connect_db(conf)
-    pm = UserManager(config=conf, dbs=dbs)
-
-    try:
-        pm.deluser(username=login)
-    except KeyError:
-        print(_("Error: User not in database"))
-        exit(1)
+    with database(ctx, conf) as dbs:
+        pm = manager('UserManager', conf, dbs)
 
-    if remove:
-        shutil.rmtree(str(user.pw_dir), ignore_errors=force)
-
-    glm = GroupListManager(conf, dbs)
-    glm.delallgroupuser(login)
+        try:
+            pm.deluser(username=login)
+        except KeyError:
+            print(_("Error: User not in database"))
+            exit(1)
 
-    dbs.commit()
+        if remove:
+            homes(ctx, conf).remove(str(user.pw_dir), force=force)
 
-    gr = None
-    try:
-        gr = grp.getgrgid(user.pw_gid)
-        if gr.gr_mem:
-            exit(0)
-    except KeyError:
-        dbs.commit()
-        dbs.close()
-        exit(0)
+        glm = manager('GroupListManager', conf, dbs)
+        glm.delallgroupuser(login)
 
-    gm = GroupManager(config=conf, dbs=dbs)
+        try:
+            gr = grp.getgrgid(user.pw_gid)
+            if gr.gr_mem:
+                return
+        except KeyError:
+            return
 
-    try:
-        gm.delgroup(gid=str(gr.gr_gid))
-    except ValueError:
-        print(_('Warning: Primary group "{group}" of user is empty but not in Database. Try "groupdel {group}"').format(
-            group=gr.gr_gid))
-        exit(1)
+        gm = manager('GroupManager', conf, dbs)
 
-    dbs.commit()
-    dbs.close()
+        try:
+            gm.delgroup(gid=str(gr.gr_gid))
+        except ValueError:
+            print(_('Warning: Primary group "{group}" of user is empty but not in Database. '
+                    'Try "groupdel {group}"').format(group=gr.gr_gid))
+            exit(1)
 
 
 @click.command()
@@ -228,9 +384,11 @@ def userdel(force, remove, config, login):
 @click.option('-s', '--shell', help=_('new login shell for the user account'), metavar=_('SHELL'))
 @click.option('-u', '--uid', type=int, help=_('new UID for the user account'), metavar=_('UID'))
 @click.option('-U', '--unlock', is_flag=True, help=_('unlock the user account'))
+@profile_option
 @click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
 @click.argument('login')
-def usermod(comment, home_dir, expiredate, inactive, gid, groups, append, login_new, lock, move_home, non_unique,
+@click.pass_context
+def usermod(ctx, comment, home_dir, expiredate, inactive, gid, groups, append, login_new, lock, move_home, non_unique,
             password, shell, uid, unlock, config, login):
     conf = get_config(config)
     user = None
@@ -240,83 +398,62 @@ def usermod(comment, home_dir, expiredate, inactive, gid, groups, append, login_
         print("Error: User not found")
         exit(1)
 
-    if uid:
-        try:
-            if not non_unique and pwd.getpwuid(uid):
-                print("Error: UID already taken")
-                exit(1)
-        except KeyError:
-            pass
-
     if expiredate:
         expiredate = (expiredate - REFDATE).days
     if gid:
         gid = get_gid(gid)
 
-    dbs = connect_db(conf)
-    pm = UserManager(conf, dbs)
+    with database(ctx, conf) as dbs:
+        pm = manager('UserManager', conf, dbs)
 
-    if lock:
-        if not config.has_section('fields'):
-            section = config[config.default_section]
-        else:
-            section = config['fields']
+        conflicts = pm.getconflicts(username=login_new, uid=uid if uid and not non_unique else None,
+                                    localfile='/etc/passwd')
+        if 'uid' in conflicts:
+            print("Error: UID already taken")
+            exit(1)
+        if 'username' in conflicts:
+            print(_("Error: Login name already taken"))
+            exit(1)
 
-        pw = pm.getuserbyuid(get_uid(login))[section.get('password', 'password')]
+        if lock:
+            if not config.has_section('fields'):
+                section = config[config.default_section]
+            else:
+                section = config['fields']
 
-        if pw[0] != '!':
-            password = '!' + pw
+            pw = pm.getuserbyuid(get_uid(login))[section.get('password', 'password')]
 
-    if unlock:
-        if not config.has_section('fields'):
-            section = config[config.default_section]
-        else:
-            section = config['fields']
+            if pw[0] != '!':
+                password = '!' + pw
 
-        pw = pm.getuserbyuid(get_uid(login))[section.get('password', 'password')]
+        if unlock:
+            if not config.has_section('fields'):
+                section = config[config.default_section]
+            else:
+                section = config['fields']
 
-        if pw[0] == '!':
-            password = pw[1:]
+            pw = pm.getuserbyuid(get_uid(login))[section.get('password', 'password')]
 
-    lastchg = None
-    if password:
-        lastchg = (datetime.date.today() - REFDATE).days
+            if pw[0] == '!':
+                password = pw[1:]
 
-    pm.moduser(username_old=login, username=login_new, gid=gid, uid=uid, gecos=comment, homedir=home_dir, shell=shell,
-               lstchg=lastchg, expire=expiredate, inact=inactive, password=password)
+        lastchg = None
+        if password:
+            lastchg = (datetime.date.today() - REFDATE).days
 
-    if login_new:
-        glm = GroupListManager(conf, dbs)
-        glm.modallgroupuser(login, login_new)
+        # A new login name is written to the group memberships by the same UPDATE
+        am = manager('AccountManager', conf, dbs)
+        am.moduser(username_old=login, username=login_new, gid=gid, uid=uid, gecos=comment, homedir=home_dir,
+                   shell=shell, lstchg=lastchg, expire=expiredate, inact=inactive, password=password)
 
-    if groups:
-        if login_new:
-            login = login_new
-        glm = GroupListManager(conf, dbs)
-        if not append:
-            glm.delallgroupuser(login)
-            for group in groups:
-                try:
-                    glm.addgroupuser(login, get_gid(group))
-                except KeyError:
-                    print(_("Warning: Can't find group {group}").format(group=group))
-        else:
-            db_groups = glm.getgroupsforusername(login)
-            for group in groups:
-                gid = get_gid(group)
-                if gid not in db_groups:
-                    glm.addgroupuser(login, gid)
+        if groups:
+            if login_new:
+                login = login_new
+            glm = manager('GroupListManager', conf, dbs)
+            glm.setusergroups(login, group_ids(ctx, conf, dbs, groups), append=append)
 
-    if home_dir and move_home:
-        try:
-            shutil.move(str(user.pw_dir), home_dir)
-        except PermissionError:
-            print(_("Error: Insufficient permissions to move home dir."))
-            dbs.rollback()
-            dbs.close()
-            exit(1)
-    dbs.commit()
-    dbs.close()
+        if home_dir and move_home:
+            homes(ctx, conf).move(str(user.pw_dir), home_dir)
 
 
 @click.command()
@@ -328,40 +465,30 @@ def usermod(comment, home_dir, expiredate, inactive, gid, groups, append, login_
 @click.option('-o', '--non-unique', help=_('allow to create groups with duplicate (non-unique) GID'))
 @click.option('-p', '--password', help=_('encrypted password of the new group'), metavar=_('PASSWORD'))
 @click.option('-r', '--system', is_flag=True, help=_('create a system account'))
+@profile_option
 @click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
 @click.argument('group')
-def groupadd(force, gid, key, non_unique, password, system, config, group):
-    if not gid or force:
-        gid = find_new_gid(sysuser=system)
-    else:
-        try:
-            if not non_unique and grp.getgrgid(gid):
-                print("Error: GID already taken")
-                exit(1)
-        except KeyError:
-            pass
+@click.pass_context
+def groupadd(ctx, force, gid, key, non_unique, password, system, config, group):
+    conf = get_config(config)
+    with database(ctx, conf) as dbs:
+        gm = manager('GroupManager', conf, dbs)
 
-    try:
-        if grp.getgrnam(group):
+        conflicts = gm.getconflicts(name=group, gid=gid if gid and not force and not non_unique else None,
+                                    localfile='/etc/group')
+        if 'gid' in conflicts:
+            print("Error: GID already taken")
+            exit(1)
+        if 'name' in conflicts:
             if force:
-                exit(0)
+                return
             print("Error: Group name already taken")
             exit(1)
-    except KeyError:
-        pass
 
-    conf = get_config(config)
-    defs = get_defs()
+        if not gid or force:
+            gid = new_gid(conf, dbs, system, defs=get_defs().override(key))
 
-    for k, v in key:
-        defs[k] = v
-    dbs = connect_db(conf)
-
-    gm = GroupManager(conf, dbs)
-    gm.addgroup(group, gid, password)
-
-    dbs.commit()
-    dbs.close()
+        gm.addgroup(group, gid, password)
 
 
 @click.command()
@@ -369,9 +496,11 @@ def groupadd(force, gid, key, non_unique, password, system, config, group):
 @click.option('-n', '-new-name', help=_('change the name to NEW_GROUP'), metavar=_('NEW_GROUP'))
 @click.option('-o', '--non-unique', is_flag=True, help=_('allow to use a duplicate (non-unique) GID'))
 @click.option('-p', '--password', help=_('change the password to this (encrypted) PASSWORD'), metavar=_('PASSWORD'))
+@profile_option
 @click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
 @click.argument('group')
-def groupmod(gid, config, new_name, non_unique, password, group):
+@click.pass_context
+def groupmod(ctx, gid, config, new_name, non_unique, password, group):
     try:
         gr = grp.getgrnam(group)
     except KeyError:
@@ -380,34 +509,28 @@ def groupmod(gid, config, new_name, non_unique, password, group):
         return
 
     conf = get_config(config)
-    dbs = connect_db(conf)
+    with database(ctx, conf) as dbs:
+        gm = manager('GroupManager', conf, dbs)
 
-    if gid:
-        try:
-            if not non_unique and grp.getgrgid(gid):
-                print("Error: GID already taken")
-                exit(1)
-        except KeyError:
-            pass
-        old_gid = int(gr.gr_gid)
-
-        glm = GroupListManager(conf, dbs)
-        glm.modallgroupgid(old_gid, gid)
-
-        um = UserManager(conf, dbs)
-        um.modallgid(old_gid, gid)
-
-    gm = GroupManager(conf, dbs)
-    gm.modgroup(name_old=group, name=new_name, gid=gid, password=password)
+        conflicts = gm.getconflicts(name=new_name, gid=gid if gid and not non_unique else None, localfile='/etc/group')
+        if 'gid' in conflicts:
+            print("Error: GID already taken")
+            exit(1)
+        if 'name' in conflicts:
+            print("Error: Group name already taken")
+            exit(1)
 
-    dbs.commit()
-    dbs.close()
+        # A new GID is written to the users and memberships by the same UPDATE
+        am = manager('AccountManager', conf, dbs)
+        am.modgroup(name_old=group, name=new_name, gid=gid or None, password=password, gid_old=int(gr.gr_gid))
 
 
 @click.command()
+@profile_option
 @click.option('--config', help=_('path to the config file for this tool'))
 @click.argument('group')
-def groupdel(config, group):
+@click.pass_context
+def groupdel(ctx, config, group):
     try:
         gr = grp.getgrnam(group)
     except KeyError:
@@ -416,101 +539,444 @@ def groupdel(config, group):
         return
 
     conf = get_config(config)
-    dbs = connect_db(conf)
-    gm = GroupManager(config=conf, dbs=dbs)
+    with database(ctx, conf) as dbs:
+        gm = manager('GroupManager', conf, dbs)
 
-    try:
-        gm.delgroup(gid=str(gr.gr_gid))
-    except KeyError as e:
-        print("Error: %s" % e)
+        try:
+            gm.delgroup(gid=str(gr.gr_gid))
+        except KeyError as e:
+            print("Error: %s" % e)
+            exit(1)
+
+
+@click.command()
+@click.option('-g', '--group', required=True, help=_('change the members of GROUP'), metavar=_('GROUP'))
+@click.option('-a', '--add', type=list, help=_('add the users to the group'), metavar=_('USERS'))
+@click.option('-d', '--delete', type=list, help=_('remove the users from the group'), metavar=_('USERS'))
+@click.option('-M', '--members', type=list, help=_('replace the members of the group with the users'),
+              metavar=_('USERS'))
+@click.option('-p', '--purge', is_flag=True, help=_('remove all members from the group'))
+@click.option('-l', '--list', 'list_members', is_flag=True, help=_('list the members of the group'))
+@click.option('-b', '--batch-size', type=int, default=1000, help=_('number of users written per statement'),
+              metavar=_('BATCH_SIZE'))
+@profile_option
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+@click.pass_context
+def groupmems(ctx, group, add, delete, members, purge, list_members, batch_size, config):
+    if members is not None and purge:
+        print(_("Error: -M and -p can't be used together"))
         exit(1)
+        return
 
-    dbs.commit()
-    dbs.close()
+    conf = get_config(config)
+    with database(ctx, conf) as dbs:
+        try:
+            gid = group_resolver(ctx, conf, dbs).gid(group)
+        except KeyError:
+            print(_("Error: Group not found"))
+            exit(1)
+            return
+
+        glm = manager('GroupListManager', conf, dbs)
+        added = removed = 0
+        if members is not None or purge:
+            added, removed = glm.setgroupmembers(gid, [m for m in members or () if m], batch_size=batch_size)
+        if delete:
+            removed += glm.delgroupmembers(gid, delete, batch_size=batch_size)
+        if add:
+            added += glm.addgroupmembers(gid, add, batch_size=batch_size)
+
+        if added or removed:
+            print(_("Added {added} and removed {removed} members of group {group}").format(
+                added=added, removed=removed, group=group))
+        if list_members:
+            print(' '.join(glm.getusersforgid(gid)))
 
 
 @click.command()
 @click.option('-i', '--ignore-password', is_flag=True, help=_("Don't import passwords"))
+@click.option('-b', '--batch-size', type=int, default=1000, help=_('number of rows written per INSERT and commit'),
+              metavar=_('BATCH_SIZE'))
+@click.option('--passwd', 'passwd_path', default='/etc/passwd', help=_('passwd file to import from'),
+              metavar=_('PASSWD'))
+@click.option('--shadow', 'shadow_path', default='/etc/shadow', help=_('shadow file to import from'),
+              metavar=_('SHADOW'))
+@click.option('-m', '--create-home', 'create_homedirs', is_flag=True,
+              help=_('create the missing home directories of the imported users'))
+@click.option('-k', '--skel', help=_('use this alternative skeleton directory'), metavar=_('SKEL_DIR'))
+@click.option('-w', '--workers', type=int, help=_('number of home directories created in parallel'),
+              metavar=_('WORKERS'))
+@profile_option
 @click.option('--config', help=_('path to the config file for this tool'))
 @click.argument('lower', type=int)
 @click.argument('upper', type=int)
-def importusers(ignore_password, config, lower, upper):
+@click.pass_context
+def importusers(ctx, ignore_password, batch_size, passwd_path, shadow_path, create_homedirs, skel, workers, config,
+                lower, upper):
     conf = get_config(config)
-    users = {}
-
-    with open('/etc/passwd') as passwd:
-        for line in passwd:
-            line = line.strip()
-            u = line.split(':')
-            if lower <= int(u[2]) <= upper:
-                for i in range(len(u)):
-                    if not u[i].strip():
-                        u[i] = None
-                users[u[0]] = u
-
-    dbs = connect_db(conf)
-    um = UserManager(conf, dbs)
-
-    with open('/etc/shadow') as shadow:
-        for line in shadow:
-            line.strip()
-            s = line.split(':')
-
-            if s[0] in users.keys():
-                for i in range(len(s)):
-                    if not s[i].strip():
-                        s[i] = None
-                u = users[s[0]]
-                if ignore_password:
-                    s[1] = '!'
-
-                um.adduser(u[0], uid=u[2], gid=u[3], gecos=u[4], homedir=u[5], shell=u[6], password=s[1], lstchg=s[2],
-                           mini=s[3], maxi=s[4], warn=s[5], inact=s[6], expire=s[7], flag=s[8])
-    dbs.commit()
-    dbs.close()
+    journal = homes(ctx, conf)
+    if workers:
+        journal.workers = workers
+    if not skel:
+        skel = get_useradd_conf().get('SKEL', '/etc/skel')
+
+    def rows():
+        for u, s in merge_by_name(read_colon_file(passwd_path), read_colon_file(shadow_path)):
+            if not lower <= int(u[2]) <= upper:
+                continue
+            s += [None] * (9 - len(s))
+            if ignore_password:
+                s[1] = '!'
+
+            if create_homedirs and u[5] and not os.path.exists(u[5]):
+                journal.create(u[5], int(u[2]), int(u[3]), skel)
+
+            yield dict(username=u[0], uid=u[2], gid=u[3], gecos=u[4], homedir=u[5], shell=u[6], password=s[1],
+                       lstchg=s[2], mini=s[3], maxi=s[4], warn=s[5], inact=s[6], expire=s[7], flag=s[8])
+
+    with database(ctx, conf, remote=False) as dbs:
+        um = manager('UserManager', conf, dbs)
+        # The homes of every committed batch are journaled right away, so they are created by myhomes even if a later
+        # batch fails
+        for users in batched(rows(), batch_size):
+            um.addusers(users, batch_size=batch_size)
+            dbs.commit()
+            journal.commit()
 
 
 @click.command()
 @click.option('-i', '--ignore-password', is_flag=True, help=_("Don't import passwords"))
+@click.option('-b', '--batch-size', type=int, default=1000, help=_('number of rows written per INSERT and commit'),
+              metavar=_('BATCH_SIZE'))
+@click.option('--group', 'group_path', default='/etc/group', help=_('group file to import from'), metavar=_('GROUP'))
+@click.option('--gshadow', 'gshadow_path', default='/etc/gshadow', help=_('gshadow file to import from'),
+              metavar=_('GSHADOW'))
+@profile_option
 @click.option('--config', help=_('path to the config file for this tool'))
 @click.argument('lower', type=int)
 @click.argument('upper', type=int)
-def importgroups(ignore_password, config, lower, upper):
+@click.pass_context
+def importgroups(ctx, ignore_password, batch_size, group_path, gshadow_path, config, lower, upper):
     conf = get_config(config)
-    groups = {}
-
-    with open('/etc/group') as group:
-        for line in group:
-            line = line.strip()
-            g = line.split(':')
-            if lower <= int(g[2]) <= upper:
-                for i in range(len(g)):
-                    if not g[i].strip():
-                        g[i] = None
-                groups[g[0]] = g
-
-    dbs = connect_db(conf)
-    gm = GroupManager(conf, dbs)
-    glm = GroupListManager(conf, dbs)
-
-    with open('/etc/gshadow') as gshadow:
-        for line in gshadow:
-            line.strip()
-            gs = line.split(':')
-
-            if gs[0] in groups.keys():
-                for i in range(len(gs)):
-                    if not gs[i].strip():
-                        gs[i] = None
-                g = groups[gs[0]]
+
+    with database(ctx, conf, remote=False) as dbs:
+        gm = manager('GroupManager', conf, dbs)
+        glm = manager('GroupListManager', conf, dbs)
+
+        joined = merge_by_name(read_colon_file(group_path), read_colon_file(gshadow_path))
+        for batch in batched(joined, batch_size):
+            groups = []
+            members = []
+            for g, gs in batch:
+                if not lower <= int(g[2]) <= upper:
+                    continue
                 if ignore_password:
                     gs[1] = '!'
-                gm.addgroup(g[0], gid=g[2], password=gs[1])
-                if g[3]:
+                groups.append(dict(name=g[0], gid=g[2], password=gs[1]))
+                if len(g) > 3 and g[3]:
                     for user in g[3].split(','):
-                        glm.addgroupuser(username=user, gid=g[2])
-    dbs.commit()
-    dbs.close()
+                        members.append(dict(username=user, gid=g[2]))
+
+            gm.addgroups(groups, batch_size=batch_size)
+            glm.addgroupusers(members, batch_size=batch_size)
+            dbs.commit()
+
+
+@click.command()
+@click.option('--passwd', 'passwd_path', default='/etc/passwd', help=_('passwd file to synchronize from'),
+              metavar=_('PASSWD'))
+@click.option('--shadow', 'shadow_path', default='/etc/shadow', help=_('shadow file to synchronize from'),
+              metavar=_('SHADOW'))
+@click.option('--group', 'group_path', default='/etc/group', help=_('group file to synchronize from'),
+              metavar=_('GROUP'))
+@click.option('--gshadow', 'gshadow_path', default='/etc/gshadow', help=_('gshadow file to synchronize from'),
+              metavar=_('GSHADOW'))
+@click.option('-s', '--source-config', help=_('synchronize from the database in this config instead of the files'),
+              metavar=_('CONF_PATH'))
+@click.option('--users/--no-users', default=True, help=_('synchronize the users'))
+@click.option('--groups/--no-groups', default=True, help=_('synchronize the groups and their members'))
+@click.option('-n', '--dry-run', is_flag=True, help=_('only print the changes'))
+@click.option('--no-delete', is_flag=True, help=_('keep the rows that are missing in the source'))
+@click.option('-v', '--verbose', is_flag=True, help=_('print every change'))
+@click.option('-b', '--batch-size', type=int, default=1000, help=_('number of rows written per statement'),
+              metavar=_('BATCH_SIZE'))
+@profile_option
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+@click.argument('lower', type=int)
+@click.argument('upper', type=int)
+@click.pass_context
+def sync(ctx, passwd_path, shadow_path, group_path, gshadow_path, source_config, users, groups, dry_run, no_delete,
+         verbose, batch_size, config, lower, upper):
+    from pammysqltools.sync import Synchronizer, read_users, read_groups, read_database
+    conf = get_config(config)
+
+    source = None
+    if source_config:
+        source_conf = get_config(source_config)
+        source = connect_db(source_conf)
+        source_users, source_groups = read_database(source_conf, source)
+    else:
+        source_users = read_users(passwd_path, shadow_path)
+        source_groups = read_groups(group_path, gshadow_path)
+
+    try:
+        with database(ctx, conf, remote=False) as dbs:
+            synchronizer = Synchronizer(conf, dbs, batch_size=batch_size, delete=not no_delete, dry_run=dry_run)
+            changes = list()
+            if users:
+                changes.append(synchronizer.syncusers(source_users, lower, upper))
+            if groups:
+                changes.append(synchronizer.syncgroups(source_groups, lower, upper))
+            for change in itertools.chain.from_iterable(changes):
+                if verbose or dry_run:
+                    key = change.key if change.table != 'grouplist' else '%s:%s' % change.key
+                    print("{action} {table} {key}".format(action=change.action, table=change.table, key=key))
+    finally:
+        if source is not None:
+            source.close()
+
+    for table in ('user', 'group', 'grouplist'):
+        counts = [synchronizer.counts.get((table, action), 0) for action in ('insert', 'update', 'delete')]
+        print(_("{table}: {inserted} inserted, {updated} updated, {deleted} deleted").format(
+            table=table, inserted=counts[0], updated=counts[1], deleted=counts[2]))
+    if dry_run:
+        print(_("Dry run, nothing was changed"))
+
+
+@click.command()
+@click.option('-f', '--format', 'fmt', type=click.Choice(['csv', 'json', 'line']), default='line',
+              help=_('format of the operations'))
+@click.option('-c', '--commit-interval', type=int, default=0,
+              help=_('commit after this many operations, 0 commits once at the end'), metavar=_('COUNT'))
+@click.option('-b', '--batch-size', type=int, default=1000, help=_('maximum number of rows per grouped INSERT'),
+              metavar=_('BATCH_SIZE'))
+@click.option('-m', '--create-home', 'create_homedirs', is_flag=True,
+              help=_('create the home directories of added users'))
+@click.option('-k', '--skel', help=_('use this alternative skeleton directory'), metavar=_('SKEL_DIR'))
+@click.option('-w', '--workers', type=int, help=_('number of home directories created in parallel'),
+              metavar=_('WORKERS'))
+@profile_option
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+@click.argument('operations', type=click.File('r'), default='-')
+@click.pass_context
+def batch(ctx, fmt, commit_interval, batch_size, create_homedirs, skel, workers, config, operations):
+    conf = get_config(config)
+    failed = False
+    journal = homes(ctx, conf)
+    if workers:
+        journal.workers = workers
+    if not skel:
+        skel = get_useradd_conf().get('SKEL', '/etc/skel')
+
+    # The homes are created after the commit, see database()
+    with database(ctx, conf, remote=False) as dbs:
+        from pammysqltools.batch import BatchRunner, read_operations
+        runner = BatchRunner(conf, dbs, commit_interval=commit_interval, batch_size=batch_size)
+        for operation in runner.run(read_operations(operations, fmt)):
+            if operation.error is None:
+                print(_("{line}: {op}: ok").format(line=operation.line, op=operation.op))
+                if create_homedirs and operation.op == 'useradd':
+                    journal.create(operation.fields['homedir'], operation.fields['uid'], operation.fields['gid'],
+                                   skel)
+            else:
+                print(_("{line}: {op}: error: {error}").format(line=operation.line, op=operation.op,
+                                                              error=operation.error))
+                failed = True
+
+    if failed:
+        exit(1)
+
+
+@click.command()
+@click.option('--uid-min', type=int, help=_('only users with at least this UID'), metavar=_('UID'))
+@click.option('--uid-max', type=int, help=_('only users with at most this UID'), metavar=_('UID'))
+@click.option('-g', '--gid', type=int, help=_('only users with this primary group'), metavar=_('GID'))
+@click.option('-s', '--shell', help=_('only users with this login shell'), metavar=_('SHELL'))
+@click.option('-f', '--format', 'fmt', type=click.Choice(['passwd', 'shadow', 'json']), default='passwd',
+              help=_('format of the listed users'))
+@click.option('-b', '--batch-size', type=int, default=1000, help=_('number of rows fetched per query'),
+              metavar=_('BATCH_SIZE'))
+@profile_option
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+@click.pass_context
+def userlist(ctx, uid_min, uid_max, gid, shell, fmt, batch_size, config):
+    import json
+    conf = get_config(config)
+
+    with database(ctx, conf, remote=False) as dbs:
+        um = manager('UserManager', conf, dbs)
+        for row in um.iterusers(uid_min=uid_min, uid_max=uid_max, gid=gid, shell=shell, page_size=batch_size):
+            user = um.logicalrow(row)
+            if fmt == 'json':
+                click.echo(json.dumps(user, sort_keys=True))
+            elif fmt == 'shadow':
+                click.echo(format_shadow(user))
+            else:
+                click.echo(format_passwd(user))
+
+
+@click.command()
+@click.option('--gid-min', type=int, help=_('only groups with at least this GID'), metavar=_('GID'))
+@click.option('--gid-max', type=int, help=_('only groups with at most this GID'), metavar=_('GID'))
+@click.option('-f', '--format', 'fmt', type=click.Choice(['group', 'gshadow', 'json']), default='group',
+              help=_('format of the listed groups'))
+@click.option('-b', '--batch-size', type=int, default=1000, help=_('number of rows fetched per query'),
+              metavar=_('BATCH_SIZE'))
+@profile_option
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+@click.pass_context
+def grouplist(ctx, gid_min, gid_max, fmt, batch_size, config):
+    import json
+    conf = get_config(config)
+
+    with database(ctx, conf, remote=False) as dbs:
+        gm = manager('GroupManager', conf, dbs)
+        glm = manager('GroupListManager', conf, dbs)
+        # The members of every page of groups are fetched with one query
+        for rows in batched(gm.itergroups(gid_min=gid_min, gid_max=gid_max, page_size=batch_size), batch_size):
+            groups = [gm.logicalrow(row) for row in rows]
+            members = glm.getusersforgids(set(group['gid'] for group in groups))
+            for group in groups:
+                if fmt == 'json':
+                    click.echo(json.dumps(dict(group, members=members.get(group['gid'], [])), sort_keys=True))
+                elif fmt == 'gshadow':
+                    click.echo(format_gshadow(group, members.get(group['gid'], ())))
+                else:
+                    click.echo(format_group(group, members.get(group['gid'], ())))
+
+
+@click.command()
+@click.option('-d', '--directory', help=_('directory for the passwd, shadow, group and gshadow files'),
+              metavar=_('DIR'))
+@click.option('--db', 'dbdirectory', help=_('also build the nss_db maps with makedb in this directory'),
+              metavar=_('DIR'))
+@click.option('-b', '--batch-size', type=int, default=10000, help=_('number of users fetched per query'),
+              metavar=_('BATCH_SIZE'))
+@profile_option
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+@click.pass_context
+def export(ctx, directory, dbdirectory, batch_size, config):
+    conf = get_config(config)
+    directory = directory or conf.get('export', 'directory', fallback='/var/lib/pammysqltools/export')
+    dbdirectory = dbdirectory or conf.get('export', 'dbdirectory', fallback=None)
+    for path in (directory, dbdirectory):
+        if path and not os.path.isdir(path):
+            os.makedirs(path, 0o755)
+
+    with database(ctx, conf, remote=False) as dbs:
+        from pammysqltools.export import export as export_files
+        users, groups = export_files(conf, dbs, directory, dbdirectory,
+                                     makedb=conf.get('export', 'makedb', fallback='makedb'), page_size=batch_size)
+    print(_("Exported {users} users and {groups} groups to {directory}").format(users=users, groups=groups,
+                                                                                 directory=directory))
+
+
+@click.command()
+@click.option('-l', '--list', 'list_jobs', is_flag=True, help=_('only list the jobs in the journal'))
+@click.option('-w', '--workers', type=int, help=_('number of jobs run in parallel'), metavar=_('WORKERS'))
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+def homejobs(list_jobs, workers, config):
+    from pammysqltools.journal import get_journal
+    journal = get_journal(get_config(config))
+    if workers:
+        journal.workers = workers
+
+    if list_jobs:
+        for job in journal.jobs():
+            print(" ".join([job['action'], job['path']] + ([job['target']] if job.get('target') else [])))
+        return
+
+    run_homes(journal)
+
+
+def print_explain(sm):
+    failed = False
+    for lookup, key in sm.explain().items():
+        if key:
+            print(_("{lookup}: uses index {key}").format(lookup=lookup, key=key))
+        else:
+            print(_("Warning: {lookup} does a full table scan").format(lookup=lookup))
+            failed = True
+    return failed
+
+
+@click.command()
+@profile_option
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+@click.pass_context
+def dbinit(ctx, config):
+    conf = get_config(config)
+    with database(ctx, conf, remote=False) as dbs:
+        sm = manager('SchemaManager', conf, dbs)
+
+        sm.createtables()
+        for table, name, fields, unique in sm.migrate():
+            print(_("Added index {name} on {table}").format(name=name, table=table))
+
+        if print_explain(sm):
+            exit(1)
+
+
+@click.command()
+@click.option('-c', '--check', is_flag=True, help=_('only report missing indexes, do not change the database'))
+@profile_option
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+@click.pass_context
+def dbmigrate(ctx, check, config):
+    conf = get_config(config)
+    with database(ctx, conf, remote=False) as dbs:
+        sm = manager('SchemaManager', conf, dbs)
+
+        if check:
+            missing = sm.missingindexes()
+            for table, name, fields, unique in missing:
+                print(_("Missing index {name} on {table}").format(name=name, table=table))
+        else:
+            import pymysql
+            missing = []
+            try:
+                added = sm.migrate()
+            except pymysql.err.IntegrityError as e:
+                print(_("Error: Can't add unique index, the table contains duplicates: %s") % e.args[-1])
+                exit(1)
+                return
+            for table, name, fields, unique in added:
+                print(_("Added index {name} on {table}").format(name=name, table=table))
+
+        failed = print_explain(sm)
+        if failed or missing:
+            exit(1)
+
+
+@click.command()
+@click.option('-s', '--socket', 'path', help=_('path of the socket to listen on'), metavar=_('SOCKET'))
+@click.option('--config', help=_('path to the config file for this tool'), metavar=_('CONF_PATH'))
+def daemon(path, config):
+    conf = get_config(config)
+    if not path:
+        path = get_socket_path(conf)
+    if not path:
+        print(_("Error: No socket configured. Set socket in the [daemon] section or use --socket"))
+        exit(1)
+
+    # Load the defaults once, the sessions reuse them until the files change
+    get_defs()
+    get_useradd_conf()
+
+    from pammysqltools.daemon import ManagementServer
+    try:
+        server = ManagementServer(conf, path)
+    except OSError as e:
+        print(_("Error: %s") % e.strerror)
+        exit(1)
+        return
+    syslog.syslog(syslog.LOG_INFO, "listening on %s" % path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
 
 cli.add_command(useradd)
@@ -519,8 +985,18 @@ cli.add_command(userdel)
 cli.add_command(groupadd)
 cli.add_command(groupmod)
 cli.add_command(groupdel)
+cli.add_command(groupmems)
 cli.add_command(importusers)
 cli.add_command(importgroups)
+cli.add_command(dbinit)
+cli.add_command(dbmigrate)
+cli.add_command(daemon)
+cli.add_command(batch)
+cli.add_command(homejobs)
+cli.add_command(userlist)
+cli.add_command(grouplist)
+cli.add_command(export)
+cli.add_command(sync)
 
 if __name__ == "__main__":
     cli()
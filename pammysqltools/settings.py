@@ -0,0 +1,183 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import dict
+from builtins import int
+from builtins import open
+from builtins import str
+import sys
+
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+import os
+import threading
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+class Settings(Mapping):
+    """
+    Immutable key/value settings like the ones of /etc/login.defs with typed accessors
+
+    Overrides (e.g. from -K) are layered on top with :meth:`override`, which returns a new object and leaves this one
+    untouched.
+
+    :param values: The settings
+    :type values: dict
+    :param parent: The settings below this layer
+    :type parent: Settings
+    """
+
+    def __init__(self, values=None, parent=None):
+        self.entries = dict(values or ())
+        self.parent = parent
+
+    def __getitem__(self, key):
+        if key in self.entries:
+            return self.entries[key]
+        if self.parent is not None:
+            return self.parent[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        seen = set()
+        layer = self
+        while layer is not None:
+            for key in layer.entries:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+            layer = layer.parent
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return 'Settings(%r)' % dict(self.items())
+
+    def override(self, values):
+        """
+        Returns new settings with values layered over these
+
+        :param values: A dictionary or (key, value) pairs
+        :rtype: Settings
+        """
+        values = dict(values)
+        if not values:
+            return self
+        return Settings(values, parent=self)
+
+    def overrides(self):
+        """
+        Returns the values of all override layers
+
+        :rtype: dict
+        """
+        values = dict()
+        layer = self
+        while layer is not None and layer.parent is not None:
+            for key, value in layer.entries.items():
+                values.setdefault(key, value)
+            layer = layer.parent
+        return values
+
+    def getint(self, key, default=None, base=10):
+        """
+        Returns a setting as integer
+
+        :raises ValueError: If the value is no integer
+        """
+        value = self.get(key)
+        if value is None:
+            return default
+        if isinstance(value, int):
+            return value
+        try:
+            return int(str(value), base)
+        except ValueError:
+            raise ValueError('{key} is not an integer: "{value}"'.format(key=key, value=value))
+
+    def getoctal(self, key, default=None):
+        """
+        Returns an octal setting like UMASK as integer
+        """
+        return self.getint(key, default, base=8)
+
+    def getboolean(self, key, default=None):
+        """
+        Returns a yes/no setting as bool
+        """
+        value = self.get(key)
+        if value is None:
+            return default
+        return str(value).lower() in ('yes', 'true', '1')
+
+
+def parse_defs(f):
+    """
+    Parses lines of the form ``KEY VALUE`` as in /etc/login.defs
+    """
+    values = dict()
+    for line in f:
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        parts = line.split(None, 1)
+        if len(parts) == 2:
+            values[parts[0]] = parts[1].strip().strip('"')
+    return values
+
+
+def parse_assignments(f):
+    """
+    Parses lines of the form ``KEY=VALUE`` as in /etc/default/useradd
+    """
+    values = dict()
+    for line in f:
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        k, sep, v = line.partition('=')
+        if sep:
+            values[k.strip()] = v.strip().strip('"')
+    return values
+
+
+_loaded = dict()
+_lock = threading.Lock()
+
+
+def load_settings(path, parser):
+    """
+    Returns the settings of a file. The file is parsed again only if its modification time changed, a missing file
+    gives empty settings.
+
+    :param path: Path to the file
+    :type path: unicode
+    :param parser: Function that parses the opened file into a dictionary, e.g. :func:`parse_defs`
+    :rtype: Settings
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+
+    with _lock:
+        cached = _loaded.get((path, parser))
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        if mtime is None:
+            settings = Settings()
+        else:
+            with open(path, 'r') as f:
+                settings = Settings(parser(f))
+        _loaded[(path, parser)] = (mtime, settings)
+        return settings
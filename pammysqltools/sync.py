@@ -0,0 +1,235 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from builtins import int
+import sys
+
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
+from collections import namedtuple
+
+from pammysqltools.batch import INTEGER_FIELDS
+from pammysqltools.helpers import read_colon_file, merge_by_name
+from pammysqltools.manager import UserManager, GroupManager, GroupListManager, fingerprint
+
+#: The values the database stores for fields a source leaves empty, see :attr:`SchemaManager.columns`
+USER_DEFAULTS = dict(gecos='', homedir='', shell='', password='!', lstchg=0, mini=0, maxi=99999, warn=7, inact=-1,
+                     expire=-1, flag=-1)
+GROUP_DEFAULTS = dict(password='!')
+
+#: One difference between the source and the database. action is insert, update or delete, table user, group or
+#: grouplist and key the username, group name or (username, gid) of a membership.
+Change = namedtuple('Change', ('action', 'table', 'key'))
+
+
+def normalize(row, defaults):
+    """
+    Fills in the defaults for empty fields and converts the numeric fields, so equal rows get equal fingerprints
+    """
+    row = dict(row)
+    for field, value in defaults.items():
+        if row.get(field) is None:
+            row[field] = value
+    for field in INTEGER_FIELDS:
+        if row.get(field) is not None:
+            row[field] = int(row[field])
+    return row
+
+
+def read_users(passwd_path, shadow_path):
+    """
+    Reads the users of a passwd and shadow file
+
+    :return: A generator of users keyed by the logical field names
+    """
+    for u, s in merge_by_name(read_colon_file(passwd_path), read_colon_file(shadow_path)):
+        u += [None] * (7 - len(u))
+        s += [None] * (9 - len(s))
+        yield dict(username=u[0], uid=u[2], gid=u[3], gecos=u[4], homedir=u[5], shell=u[6], password=s[1],
+                   lstchg=s[2], mini=s[3], maxi=s[4], warn=s[5], inact=s[6], expire=s[7], flag=s[8])
+
+
+def read_groups(group_path, gshadow_path):
+    """
+    Reads the groups of a group and gshadow file
+
+    :return: A generator of (group, usernames) tuples
+    """
+    for g, gs in merge_by_name(read_colon_file(group_path), read_colon_file(gshadow_path)):
+        g += [None] * (4 - len(g))
+        gs += [None] * (4 - len(gs))
+        yield dict(name=g[0], gid=g[2], password=gs[1]), g[3].split(',') if g[3] else []
+
+
+def read_database(config, dbs):
+    """
+    Reads the users and groups of another database
+
+    :return: A tuple of a generator of users and a generator of (group, usernames) tuples
+    """
+    um = UserManager(config, dbs)
+    gm = GroupManager(config, dbs)
+    users = (um.logicalrow(row) for row in um.iterusers())
+    groups = ((gm.logicalrow(row), members) for row, members in gm.itergroupmembers())
+    return users, groups
+
+
+class Synchronizer(object):
+    """
+    Brings the tables in line with a source while touching only the rows that differ.
+
+    The database computes a fingerprint of every row (see :meth:`AbstractManager.getfingerprints`), only the rows whose
+    fingerprint doesn't match the one of the source row are written: changed rows with batched UPDATEs by their id,
+    new rows with batched multi-row INSERTs. As no row is matched by its unique key, this doesn't depend on the unique
+    indexes of :meth:`SchemaManager.migrate`. Rows in the synchronized ID range that the source doesn't have are
+    deleted by their ids afterwards.
+
+    :param config: The config for the managers
+    :type config: ConfigParser
+    :param dbs: The :class:`pymysql.Connection` instance to use
+    :type dbs: pymysql.Connection
+    :param batch_size: Number of rows per statement
+    :type batch_size: int
+    :param delete: Delete the rows missing in the source
+    :type delete: bool
+    :param dry_run: Only compute the changes
+    :type dry_run: bool
+    """
+
+    def __init__(self, config, dbs, batch_size=1000, delete=True, dry_run=False):
+        self.um = UserManager(config, dbs)
+        self.gm = GroupManager(config, dbs)
+        self.glm = GroupListManager(config, dbs)
+        self.batch_size = batch_size
+        self.delete = delete
+        self.dry_run = dry_run
+        self.counts = dict()
+
+    def _change(self, action, table, key):
+        self.counts[(table, action)] = self.counts.get((table, action), 0) + 1
+        return Change(action, table, key)
+
+    def _diff(self, manager, key, target, row):
+        """
+        Returns the action for a row and the id of the row it updates and drops it from the target fingerprints, None
+        as action if the row is unchanged
+        """
+        current = target.pop(row[key], None)
+        if current is None:
+            return 'insert', None
+        if current[1] != fingerprint(row, manager.fields):
+            return 'update', current[0]
+        return None, current[0]
+
+    def _flush(self, manager, insert, rows):
+        """
+        Writes the pending (id, row) tuples, the ones without id with insert
+        """
+        if rows and not self.dry_run:
+            inserts = [row for id, row in rows if id is None]
+            updates = [dict(row, id=id) for id, row in rows if id is not None]
+            if inserts:
+                insert(inserts, batch_size=self.batch_size)
+            if updates:
+                manager.updaterows(updates, batch_size=self.batch_size)
+        return list()
+
+    def _delete(self, manager, table, target):
+        if not self.delete:
+            return
+        for key in target:
+            yield self._change('delete', table, key)
+        if not self.dry_run:
+            manager.delrows([id for id, digest in target.values()], batch_size=self.batch_size)
+
+    def syncusers(self, users, uid_min=None, uid_max=None):
+        """
+        Synchronizes the users in a UID range
+
+        :param users: The users of the source keyed by the logical field names
+        :type users: iterable
+        :param uid_min: The lowest synchronized UID
+        :type uid_min: int
+        :param uid_max: The highest synchronized UID
+        :type uid_max: int
+        :return: A generator of the :class:`Change` objects, which are applied in batches while it is consumed
+        """
+        target = self.um.getfingerprints('username', (('uid', '>=', uid_min), ('uid', '<=', uid_max)))
+        pending = list()
+        for user in users:
+            user = normalize(user, USER_DEFAULTS)
+            if not _inrange(user['uid'], uid_min, uid_max):
+                continue
+            action, id = self._diff(self.um, 'username', target, user)
+            if action is None:
+                continue
+            pending.append((id, user))
+            yield self._change(action, 'user', user['username'])
+            if len(pending) >= self.batch_size:
+                pending = self._flush(self.um, self.um.addusers, pending)
+        self._flush(self.um, self.um.addusers, pending)
+
+        for change in self._delete(self.um, 'user', target):
+            yield change
+
+    def syncgroups(self, groups, gid_min=None, gid_max=None):
+        """
+        Synchronizes the groups and their members in a GID range
+
+        :param groups: (group, usernames) tuples of the source, the group keyed by the logical field names
+        :type groups: iterable
+        :param gid_min: The lowest synchronized GID
+        :type gid_min: int
+        :param gid_max: The highest synchronized GID
+        :type gid_max: int
+        :return: A generator of the :class:`Change` objects, which are applied in batches while it is consumed
+        """
+        target = self.gm.getfingerprints('name', (('gid', '>=', gid_min), ('gid', '<=', gid_max)))
+        memberships = dict()
+        for row in self.glm.itermemberships(gid_min=gid_min, gid_max=gid_max, page_size=self.batch_size * 10):
+            membership = self.glm.logicalrow(row)
+            memberships[(membership['username'], int(membership['gid']))] = (row['id'], None)
+
+        pending = list()
+        added = list()
+        seen = set()
+        for group, members in groups:
+            group = normalize(group, GROUP_DEFAULTS)
+            if not _inrange(group['gid'], gid_min, gid_max):
+                continue
+            action, id = self._diff(self.gm, 'name', target, group)
+            if action is not None:
+                pending.append((id, group))
+                yield self._change(action, 'group', group['name'])
+
+            for member in members:
+                key = (member, group['gid'])
+                if key in seen:
+                    continue
+                seen.add(key)
+                if memberships.pop(key, None) is None:
+                    added.append(dict(username=member, gid=group['gid']))
+                    yield self._change('insert', 'grouplist', key)
+
+            if len(pending) >= self.batch_size:
+                pending = self._flush(self.gm, self.gm.addgroups, pending)
+            if len(added) >= self.batch_size:
+                if not self.dry_run:
+                    self.glm.addgroupusers(added, batch_size=self.batch_size)
+                added = list()
+        self._flush(self.gm, self.gm.addgroups, pending)
+        if added and not self.dry_run:
+            self.glm.addgroupusers(added, batch_size=self.batch_size)
+
+        for change in self._delete(self.gm, 'group', target):
+            yield change
+        for change in self._delete(self.glm, 'grouplist', memberships):
+            yield change
+
+
+def _inrange(value, lower, upper):
+    return (lower is None or value >= lower) and (upper is None or value <= upper)
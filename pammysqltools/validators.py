@@ -3,9 +3,12 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from future import standard_library
+import sys
 
-standard_library.install_aliases()
+if sys.version_info[0] < 3:
+    from future import standard_library
+
+    standard_library.install_aliases()
 import datetime
 
 import click
@@ -28,8 +28,18 @@ setup(name='PAMMySQLTools',
               'mygroupadd=pammysqltools.scripts:groupadd',
               'mygroupdel=pammysqltools.scripts:groupdel',
               'mygroupmod=pammysqltools.scripts:groupmod',
+              'mygroupmems=pammysqltools.scripts:groupmems',
               'myimportusers=pammysqltools.scripts:importusers',
               'myimportgroups=pammysqltools.scripts:importgroups',
+              'mydbinit=pammysqltools.scripts:dbinit',
+              'mydbmigrate=pammysqltools.scripts:dbmigrate',
+              'mydaemon=pammysqltools.scripts:daemon',
+              'mybatch=pammysqltools.scripts:batch',
+              'myhomes=pammysqltools.scripts:homejobs',
+              'myuserlist=pammysqltools.scripts:userlist',
+              'mygrouplist=pammysqltools.scripts:grouplist',
+              'myexport=pammysqltools.scripts:export',
+              'mysync=pammysqltools.scripts:sync',
           ]
       },
       package_data={
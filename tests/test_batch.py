@@ -0,0 +1,61 @@
+import io
+import unittest
+
+from pammysqltools.batch import read_operations, BatchRunner, Operation
+from pammysqltools.manager import UserManager, GroupListManager
+from tests.test_manager import ManagerTests
+
+
+class ParserTestCase(unittest.TestCase):
+    def test_lines(self):
+        ops = list(read_operations(io.StringIO(u'# comment\nuseradd username=a gid=100 gecos="A B"\nuserdel a b\n')))
+
+        self.assertEqual(ops[0].line, 2)
+        self.assertEqual(ops[0].op, 'useradd')
+        self.assertDictEqual(ops[0].fields, {'username': 'a', 'gid': '100', 'gecos': 'A B'})
+        self.assertIsNotNone(ops[1].error)
+
+    def test_json(self):
+        ops = list(read_operations(io.StringIO(u'{"op": "memberadd", "username": "a", "gid": 1}\n[1]\n'), 'json'))
+
+        self.assertEqual(ops[0].op, 'memberadd')
+        self.assertDictEqual(ops[0].fields, {'username': 'a', 'gid': 1})
+        self.assertIsNotNone(ops[1].error)
+
+    def test_csv(self):
+        ops = list(read_operations(io.StringIO(u'op,name,gid\ngroupadd,staff,\ngroupdel,,100\n'), 'csv'))
+
+        self.assertDictEqual(ops[0].fields, {'name': 'staff'})
+        self.assertEqual(ops[1].op, 'groupdel')
+        self.assertDictEqual(ops[1].fields, {'gid': '100'})
+
+    def test_validate(self):
+        op = Operation(1, 'useradd', {'username': 'a', 'gid': '100'})
+        op.validate()
+        self.assertEqual(op.fields['gid'], 100)
+
+        for op in (Operation(1, 'drop', {}), Operation(1, 'useradd', {'username': 'a'}),
+                   Operation(1, 'userdel', {'username': 'a', 'uid': 1}), Operation(1, 'groupdel', {}),
+                   Operation(1, 'memberadd', {'username': 'a', 'gid': 'x'})):
+            with self.assertRaises(ValueError):
+                op.validate()
+
+
+class BatchRunnerTests(ManagerTests):
+    def test_run(self):
+        ops = read_operations(io.StringIO(u'useradd username=a uid=2000 gid=100 lstchg=0\n'
+                                          u'useradd username=b uid=2001 gid=100 lstchg=0\n'
+                                          u'useradd username=a uid=2002 gid=100 lstchg=0\n'
+                                          u'memberadd username=a gid=200\n'
+                                          u'usermod username=b new_username=c\n'
+                                          u'userdel username=x\n'))
+
+        results = [(op.line, op.error is None) for op in BatchRunner(self.config, self.dbs).run(ops)]
+
+        self.assertListEqual(results, [(1, True), (2, True), (3, False), (4, True), (5, True), (6, False)])
+        self.assertEqual(UserManager(self.config, self.dbs).getuserbyusername('c')['uid'], 2001)
+        self.assertListEqual(GroupListManager(self.config, self.dbs).getgroupsforusername('a'), [200])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+
+from pammysqltools.cache import LookupCache, TransactionCache
+
+
+class LookupCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = LookupCache(maxsize=2, ttl=10, clock=lambda: self.now)
+
+    def test_ttl(self):
+        self.cache.set(('user', 'uid', 1000), {'uid': 1000})
+        self.assertDictEqual(self.cache.get(('user', 'uid', 1000)), {'uid': 1000})
+
+        self.now = 11
+        self.assertIsNone(self.cache.get(('user', 'uid', 1000)))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru(self):
+        self.cache.set(('user', 'uid', 1), {'uid': 1})
+        self.cache.set(('user', 'uid', 2), {'uid': 2})
+        self.cache.get(('user', 'uid', 1))
+        self.cache.set(('user', 'uid', 3), {'uid': 3})
+
+        self.assertIsNotNone(self.cache.get(('user', 'uid', 1)))
+        self.assertIsNone(self.cache.get(('user', 'uid', 2)))
+        self.assertIsNotNone(self.cache.get(('user', 'uid', 3)))
+
+    def test_copy(self):
+        self.cache.set(('user', 'uid', 1), {'uid': 1})
+        del self.cache.get(('user', 'uid', 1))['uid']
+
+        self.assertDictEqual(self.cache.get(('user', 'uid', 1)), {'uid': 1})
+
+    def test_invalidate(self):
+        self.cache.set(('user', 'uid', 1), {'uid': 1, 'username': 'a'})
+        self.cache.set(('group', 'gid', 1), {'gid': 1, 'name': 'a'})
+
+        self.cache.invalidate('user', username='b')
+        self.assertEqual(len(self.cache), 2)
+
+        self.cache.invalidate('user', uid='1')
+        self.assertIsNone(self.cache.get(('user', 'uid', 1)))
+        self.assertIsNotNone(self.cache.get(('group', 'gid', 1)))
+
+
+class TransactionCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.shared = LookupCache()
+        self.writer = TransactionCache(self.shared)
+        self.reader = TransactionCache(self.shared)
+
+    def test_uncommitted(self):
+        self.shared.set(('user', 'uid', 1), {'uid': 1, 'shell': '/bin/sh'})
+        self.writer.invalidate('user', uid=1)
+
+        # The writer's own reads are neither served from nor added to the shared cache
+        self.writer.set(('user', 'uid', 1), {'uid': 1, 'shell': '/bin/bash'})
+        self.assertIsNone(self.writer.get(('user', 'uid', 1)))
+        self.assertIsNone(self.shared.get(('user', 'uid', 1)))
+
+        self.writer.end()
+        self.assertIsNone(self.shared.get(('user', 'uid', 1)))
+
+    def test_commit(self):
+        self.writer.invalidate('user', uid=1)
+        # Another session reads the old committed row before the commit
+        self.reader.set(('user', 'uid', 1), {'uid': 1, 'shell': '/bin/sh'})
+        self.shared.set(('user', 'uid', 1), {'uid': 1, 'shell': '/bin/sh'})
+
+        self.writer.commit()
+        self.assertIsNone(self.shared.get(('user', 'uid', 1)))
+        self.writer.set(('user', 'uid', 1), {'uid': 1, 'shell': '/bin/bash'})
+        self.assertEqual(self.shared.get(('user', 'uid', 1))['shell'], '/bin/bash')
+
+    def test_snapshot(self):
+        self.assertIsNone(self.reader.get(('user', 'uid', 1)))
+        self.writer.invalidate('user', uid=1)
+        self.writer.commit()
+
+        # The reader's transaction started before the commit, its row may be older
+        self.reader.set(('user', 'uid', 1), {'uid': 1, 'shell': '/bin/sh'})
+        self.assertIsNone(self.shared.get(('user', 'uid', 1)))
+
+        self.reader.end()
+        self.reader.set(('user', 'uid', 1), {'uid': 1, 'shell': '/bin/bash'})
+        self.assertIsNotNone(self.shared.get(('user', 'uid', 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import unittest
+
+from backports.configparser import ConfigParser
+
+from pammysqltools.daemon import ManagementServer, ManagementClient
+from tests.test_helpers import FakeConnection
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'daemon.sock')
+        self.server = ManagementServer(ConfigParser(), self.path)
+        self.dbs = FakeConnection()
+        self.server.pool.idle.append(self.dbs)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def test_socket_mode(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_running(self):
+        with self.assertRaises(OSError):
+            ManagementServer(ConfigParser(), self.path)
+        self.assertTrue(stat.S_ISSOCK(os.stat(self.path).st_mode))
+        ManagementClient(self.path).close()
+
+    def test_stale(self):
+        path = os.path.join(self.tmpdir, 'stale.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+
+        server = ManagementServer(ConfigParser(), path)
+        server.server_close()
+
+    def test_session(self):
+        client = ManagementClient(self.path)
+
+        client.commit()
+        with self.assertRaises(ValueError):
+            client.call('UserManager', 'drop')
+        with self.assertRaises(AttributeError):
+            client.manager('UserManager').drop
+
+        client.close()
+        self.assertEqual(self.dbs.pings, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
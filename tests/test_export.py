@@ -0,0 +1,102 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from pammysqltools.export import AtomicFile, export
+from pammysqltools.manager import UserManager, GroupManager, GroupListManager
+from tests.test_manager import ManagerTests
+
+
+class AtomicFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'passwd')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_replace(self):
+        with open(self.path, 'w') as f:
+            f.write('old\n')
+        os.chmod(self.path, 0o640)
+
+        with AtomicFile(self.path, 0o600) as f:
+            f.write('new\n')
+            with open(self.path) as old:
+                self.assertEqual(old.read(), 'old\n')
+
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'new\n')
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o640)
+        self.assertListEqual(os.listdir(self.tmpdir), ['passwd'])
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            with AtomicFile(self.path, 0o600) as f:
+                f.write('new\n')
+                raise ValueError()
+
+        self.assertListEqual(os.listdir(self.tmpdir), [])
+
+    def test_deferred(self):
+        with open(self.path, 'w') as f:
+            f.write('old\n')
+
+        atomic = AtomicFile(self.path, 0o600, deferred=True)
+        with atomic as f:
+            f.write('new\n')
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'old\n')
+
+        atomic.replace()
+        with open(self.path) as f:
+            self.assertEqual(f.read(), 'new\n')
+        self.assertListEqual(os.listdir(self.tmpdir), ['passwd'])
+
+
+class ExportTests(ManagerTests):
+    def test_export(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        UserManager(self.config, self.dbs).addusers([
+            {'username': 'a', 'uid': 2000, 'gid': 100, 'homedir': '/home/a', 'shell': '/bin/sh', 'lstchg': 0},
+            {'username': 'b', 'uid': 2001, 'gid': 100, 'homedir': '/home/b', 'shell': '/bin/sh', 'lstchg': 0}])
+        GroupManager(self.config, self.dbs).addgroups([{'name': 'staff', 'gid': 100}, {'name': 'empty', 'gid': 101}])
+        GroupListManager(self.config, self.dbs).addgroupusers([{'username': 'a', 'gid': 100},
+                                                               {'username': 'b', 'gid': 100}])
+
+        self.assertEqual(export(self.config, self.dbs, tmpdir, page_size=1), (2, 2))
+
+        with open(os.path.join(tmpdir, 'passwd')) as f:
+            self.assertListEqual(f.read().splitlines(),
+                                 ['a:x:2000:100::/home/a:/bin/sh', 'b:x:2001:100::/home/b:/bin/sh'])
+        with open(os.path.join(tmpdir, 'group')) as f:
+            self.assertListEqual(f.read().splitlines(), ['staff:x:100:a,b', 'empty:x:101:'])
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(tmpdir, 'shadow')).st_mode), 0o600)
+
+    def test_export_error(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        with open(os.path.join(tmpdir, 'passwd'), 'w') as f:
+            f.write('old\n')
+        UserManager(self.config, self.dbs).addusers([
+            {'username': 'a', 'uid': 2000, 'gid': 100, 'homedir': '/home/a', 'shell': '/bin/sh', 'lstchg': 0}])
+
+        def fail(manager):
+            raise ValueError()
+
+        # The groups fail after passwd and shadow were written completely
+        self.addCleanup(setattr, GroupManager, 'itergroupmembers', GroupManager.itergroupmembers)
+        GroupManager.itergroupmembers = fail
+        with self.assertRaises(ValueError):
+            export(self.config, self.dbs, tmpdir)
+
+        with open(os.path.join(tmpdir, 'passwd')) as f:
+            self.assertEqual(f.read(), 'old\n')
+        self.assertListEqual(os.listdir(tmpdir), ['passwd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
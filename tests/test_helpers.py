@@ -1,8 +1,211 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+from backports.configparser import ConfigParser
+
+from pammysqltools.helpers import IdAllocator, read_local_ids, read_colon_file, merge_by_name, batched, \
+    ConnectionPool, find_local_conflicts, create_home, format_passwd, format_shadow, format_group, \
+    format_gshadow, GroupResolver
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.open = True
+        self.pings = 0
+        self.rollbacks = 0
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.open = False
+
 
 class HelpersTestCase(unittest.TestCase):
-    pass
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_allocator_forward(self):
+        alloc = IdAllocator([1000, 1001, 1002, 1004, 500])
+
+        self.assertEqual(alloc.find_free(1000, 60000), 1003)
+        self.assertEqual(alloc.find_free(1000, 60000), 1005)
+        self.assertIn(1003, alloc)
+
+    def test_allocator_reverse(self):
+        alloc = IdAllocator([999, 998, 996])
+
+        self.assertEqual(alloc.find_free(101, 999, reverse=True), 997)
+        self.assertEqual(alloc.find_free(101, 999, reverse=True), 995)
+
+    def test_allocator_exhausted(self):
+        alloc = IdAllocator(range(100, 110))
+
+        self.assertIsNone(alloc.find_free(100, 110))
+        self.assertIsNone(alloc.find_free(100, 109, reverse=True))
+
+    def test_allocator_preferred(self):
+        alloc = IdAllocator([1000, 1001])
+
+        self.assertEqual(alloc.find_free(1000, 60000, preferred=1500), 1500)
+        self.assertEqual(alloc.find_free(1000, 60000, preferred=1500), 1002)
+        self.assertEqual(alloc.find_free(1000, 60000, preferred=1000), 1003)
+
+    def test_read_local_ids(self):
+        path = os.path.join(self.tmpdir, 'passwd')
+        with open(path, 'w') as f:
+            f.write('root:x:0:0:root:/root:/bin/bash\n')
+            f.write('\n')
+            f.write('user:x:1000:1000::/home/user:/bin/sh\n')
+
+        self.assertListEqual(read_local_ids(path), [0, 1000])
+        self.assertListEqual(read_local_ids(os.path.join(self.tmpdir, 'missing')), [])
+
+    def test_read_colon_file(self):
+        path = os.path.join(self.tmpdir, 'shadow')
+        with open(path, 'w') as f:
+            f.write('user:$6$abc:17000:0:99999:7:::\n')
+
+        self.assertListEqual(list(read_colon_file(path)),
+                             [['user', '$6$abc', '17000', '0', '99999', '7', None, None, None]])
+
+    def test_find_local_conflicts(self):
+        path = os.path.join(self.tmpdir, 'group')
+        with open(path, 'w') as f:
+            f.write('root:x:0:\n')
+            f.write('users:x:100:a,b\n')
+
+        self.assertEqual(find_local_conflicts(path, name='users', id=0), (True, True))
+        self.assertEqual(find_local_conflicts(path, name='staff', id=100), (False, True))
+        self.assertEqual(find_local_conflicts(path, name='root'), (True, False))
+        self.assertEqual(find_local_conflicts(os.path.join(self.tmpdir, 'missing'), name='root'), (False, False))
+
+    def test_group_resolver(self):
+        path = os.path.join(self.tmpdir, 'group')
+        with open(path, 'w') as f:
+            f.write('root:x:0:\n')
+            f.write('wheel:x:10:a\n')
+        lookups = list()
+
+        def lookup(names):
+            lookups.append(sorted(names))
+            return dict((name, 2000) for name in names if name == 'staff')
+
+        resolver = GroupResolver(lookup, localfile=path)
+
+        self.assertEqual(list(resolver.resolve(['staff', '100', 'wheel', 'missing', 'root']).items()),
+                         [('staff', 2000), ('100', 100), ('wheel', 10), ('root', 0)])
+        self.assertEqual(resolver.gid('wheel'), 10)
+        self.assertListEqual(lookups, [['missing', 'root', 'staff', 'wheel']])
+
+        # Misses aren't remembered, the group may be created later
+        with self.assertRaises(KeyError):
+            resolver.gid('missing')
+        with open(path, 'a') as f:
+            f.write('missing:x:20:\n')
+        self.assertEqual(resolver.gid('missing'), 20)
+        self.assertListEqual(lookups, [['missing', 'root', 'staff', 'wheel'], ['missing'], ['missing']])
+
+    def test_merge_by_name(self):
+        passwd = [['a', 'x', '1'], ['b', 'x', '2'], ['c', 'x', '3'], ['d', 'x', '4']]
+        shadow = [['b', 'pw_b'], ['a', 'pw_a'], ['c', 'pw_c']]
+
+        merged = list(merge_by_name(passwd, shadow))
+
+        self.assertListEqual([(p[0], s[1]) for p, s in merged], [('a', 'pw_a'), ('b', 'pw_b'), ('c', 'pw_c')])
+
+    def test_merge_by_name_window(self):
+        read = []
+
+        def shadow():
+            for name in ['a', 'b', 'c', 'd', 'e', 'f', 'g']:
+                read.append(name)
+                yield [name, 'pw_' + name]
+
+        # + has no partner: reading ahead for it stops after the window and the entries read are kept for later
+        passwd = [['a'], ['+'], ['b'], ['c'], ['missing'], ['d'], ['e'], ['f'], ['g']]
+        merged = []
+        for p, s in merge_by_name(passwd, shadow(), window=2):
+            merged.append(s[1])
+            # pending holds at most window entries beyond the ones already joined
+            self.assertLessEqual(len(read) - len(merged), 2)
+
+        self.assertListEqual(merged, ['pw_a', 'pw_b', 'pw_c', 'pw_d', 'pw_e', 'pw_f', 'pw_g'])
+
+    def test_batched(self):
+        self.assertListEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertListEqual(list(batched([], 2)), [])
+
+    def test_format(self):
+        user = {'username': 'a', 'password': 'ABCD', 'uid': 1000, 'gid': 100, 'gecos': None, 'homedir': '/home/a',
+                'shell': '/bin/sh', 'lstchg': 0, 'mini': 0, 'maxi': 99999, 'warn': 7, 'inact': -1, 'expire': -1,
+                'flag': -1}
+        self.assertEqual(format_passwd(user), 'a:x:1000:100::/home/a:/bin/sh')
+        self.assertEqual(format_shadow(user), 'a:ABCD:0:0:99999:7:::')
+
+        group = {'name': 'staff', 'gid': 100, 'password': '!'}
+        self.assertEqual(format_group(group, ['a', 'b']), 'staff:x:100:a,b')
+        self.assertEqual(format_gshadow(group), 'staff:!::')
+
+    def make_skel(self):
+        skel = os.path.join(self.tmpdir, 'skel')
+        os.makedirs(os.path.join(skel, '.config', 'app'))
+        with open(os.path.join(skel, '.profile'), 'w') as f:
+            f.write('export PATH\n' * 1000)
+        with open(os.path.join(skel, '.config', 'app', 'rc'), 'w') as f:
+            f.write('')
+        os.symlink('.profile', os.path.join(skel, '.bashrc'))
+        return skel
+
+    def test_create_home(self):
+        skel = self.make_skel()
+        home = os.path.join(self.tmpdir, 'home')
+
+        create_home(home, skel, os.getuid(), os.getgid(), umask=0o027)
+
+        self.assertEqual(os.stat(home).st_mode & 0o777, 0o750)
+        self.assertEqual(os.stat(os.path.join(home, '.config', 'app')).st_mode & 0o777, 0o750)
+        self.assertEqual(os.stat(os.path.join(home, '.config', 'app', 'rc')).st_size, 0)
+        with open(os.path.join(home, '.profile')) as f:
+            self.assertEqual(f.read(), 'export PATH\n' * 1000)
+        self.assertEqual(os.readlink(os.path.join(home, '.bashrc')), '.profile')
+
+        with self.assertRaises(OSError):
+            create_home(home, skel, os.getuid(), os.getgid(), umask=0o027)
+
+    def test_pool(self):
+        pool = ConnectionPool(ConfigParser(), size=1)
+        first, second = FakeConnection(), FakeConnection()
+        pool.idle.extend([first])
+
+        dbs = pool.acquire()
+        self.assertIs(dbs, first)
+        self.assertEqual(dbs.pings, 1)
+
+        pool.release(first)
+        pool.release(second)
+        self.assertListEqual(pool.idle, [first])
+        self.assertEqual(first.rollbacks, 1)
+        self.assertFalse(second.open)
+
+        with pool.connection() as dbs:
+            self.assertIs(dbs, first)
+        self.assertListEqual(pool.idle, [first])
+
+        pool.close()
+        self.assertFalse(first.open)
+        self.assertListEqual(pool.idle, [])
 
 
 if __name__ == '__main__':
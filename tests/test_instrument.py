@@ -0,0 +1,86 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# noinspection PyUnresolvedReferences
+from backports.configparser import ConfigParser
+
+from pammysqltools import instrument
+
+
+class FakeCursor(object):
+    rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, args=None):
+        if 'fail' in query:
+            raise ValueError(query)
+        self.rowcount = 2
+        return 2
+
+
+class FakeConnection(object):
+    def cursor(self, cursorclass=None):
+        return FakeCursor()
+
+
+class InstrumentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.events = list()
+        instrument.add_hook(self.events.append)
+
+    def tearDown(self):
+        instrument.remove_hook(self.events.append)
+
+    def test_cursor(self):
+        with instrument.cursor(FakeConnection()) as cur:
+            cur.execute("SELECT *\n  FROM `user` WHERE `uid`=%s", 1)
+            with self.assertRaises(ValueError):
+                cur.execute("SELECT fail")
+            self.assertEqual(cur.rowcount, 2)
+
+        self.assertEqual([(e.statement, e.rowcount, e.error) for e in self.events],
+                         [("SELECT * FROM `user` WHERE `uid`=%s", 2, None), ("SELECT fail", None, 'ValueError')])
+
+    def test_disabled(self):
+        instrument.remove_hook(self.events.append)
+        self.assertIsInstance(instrument.cursor(FakeConnection()), FakeCursor)
+
+    def test_summary(self):
+        summary = instrument.Summary()
+        for seconds in (0.001, 0.003):
+            summary(instrument.Event('query', 'SELECT 1', 1, seconds, None))
+        summary(instrument.Event('connect', 'root@localhost:3306/auth', None, 0.01, None))
+
+        lines = summary.report().splitlines()
+        self.assertIn('connect root@localhost:3306/auth', lines[1])
+        self.assertEqual(lines[2].split(), ['2', '2', '4.000', '3.000', '0', 'SELECT', '1'])
+        self.assertEqual(lines[3].split(), ['3', '2', '14.000'])
+
+    def test_configure(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'statements.log')
+        config = ConfigParser()
+        config.read_dict({'instrumentation': {'log': path}})
+
+        exporters = instrument.configure(config)
+        self.addCleanup(instrument.configure, ConfigParser())
+        self.assertEqual(len(exporters), 1)
+        self.assertEqual(len(instrument.configure(config)), 1)
+
+        instrument.record(instrument.Event('query', 'SELECT 1', 1, 0.5, None))
+        with open(path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([(e['statement'], e['ms']) for e in lines], [('SELECT 1', 500.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from click.testing import CliRunner
+
+from pammysqltools.helpers import get_pool, get_config
+from pammysqltools.journal import HomeJournal, _chains
+from pammysqltools.scripts import importusers
+from tests.test_helpers import FakeConnection
+
+
+class HomeJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.skel = os.path.join(self.tmpdir, 'skel')
+        os.makedirs(self.skel)
+        with open(os.path.join(self.skel, '.profile'), 'w') as f:
+            f.write('export PATH\n')
+        self.journal = HomeJournal(os.path.join(self.tmpdir, 'state', 'homes.journal'), workers=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def home(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_run(self):
+        self.journal.create(self.home('a'), os.getuid(), os.getgid(), self.skel)
+        self.journal.create(self.home('b'), os.getuid(), os.getgid(), self.skel)
+        self.journal.move(self.home('b'), self.home('c'))
+        self.journal.remove(self.home('a'))
+        self.assertFalse(os.path.exists(self.home('a')))
+
+        self.journal.commit()
+        self.assertEqual(len(self.journal), 0)
+        self.assertEqual(len(self.journal.jobs()), 4)
+
+        self.assertListEqual(self.journal.run(umask=0o022), [])
+        self.assertFalse(os.path.exists(self.home('a')))
+        self.assertFalse(os.path.exists(self.home('b')))
+        self.assertTrue(os.path.isfile(os.path.join(self.home('c'), '.profile')))
+        self.assertListEqual(self.journal.jobs(), [])
+
+    def test_retry(self):
+        self.journal.create(self.home('a'), os.getuid(), os.getgid(), os.path.join(self.tmpdir, 'missing'))
+        self.journal.create(self.home('skel'), os.getuid(), os.getgid(), self.skel)
+        self.journal.commit()
+
+        failed = self.journal.run(umask=0o022)
+
+        self.assertListEqual([job['path'] for job, error in failed], [self.home('a'), self.home('skel')])
+        # The existing home can't be created by a retry, the missing skeleton may appear later
+        self.assertListEqual([job['path'] for job in self.journal.jobs()], [self.home('a')])
+
+        os.rename(self.skel, os.path.join(self.tmpdir, 'missing'))
+        self.assertListEqual(self.journal.run(umask=0o022), [])
+        self.assertTrue(os.path.isdir(self.home('a')))
+
+    def test_concurrent_commit(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        class SlowJournal(HomeJournal):
+            @staticmethod
+            def execute(job, umask):
+                started.set()
+                release.wait(5)
+                return HomeJournal.execute(job, umask)
+
+        slow = SlowJournal(self.journal.path)
+        slow.create(self.home('a'), os.getuid(), os.getgid(), self.skel)
+        slow.commit()
+        runner = threading.Thread(target=slow.run, kwargs=dict(umask=0o022))
+        runner.start()
+        started.wait(5)
+
+        # Blocks on the lock until the run has replaced the journal
+        self.journal.create(self.home('b'), os.getuid(), os.getgid(), self.skel)
+        writer = threading.Thread(target=self.journal.commit)
+        writer.start()
+        writer.join(0.1)
+        release.set()
+        runner.join()
+        writer.join()
+
+        self.assertListEqual([job['path'] for job in self.journal.jobs()], [self.home('b')])
+
+    def test_discard(self):
+        self.journal.remove(self.home('skel'))
+        self.journal.discard()
+        self.journal.commit()
+
+        self.assertListEqual(self.journal.run(), [])
+        self.assertTrue(os.path.isdir(self.skel))
+
+    def test_chains(self):
+        jobs = [dict(action='create', path='/a'), dict(action='create', path='/b'), dict(action='remove', path='/c'),
+                dict(action='move', path='/a', target='/b'), dict(action='remove', path='/b')]
+
+        chains = _chains(jobs)
+
+        self.assertListEqual(chains, [[jobs[0], jobs[1], jobs[3], jobs[4]], [jobs[2]]])
+
+
+class FakeCursor(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def executemany(self, query, args):
+        return len(args)
+
+
+class CursorConnection(FakeConnection):
+    def cursor(self, cursorclass=None):
+        return FakeCursor()
+
+
+class ImportHomesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.skel = os.path.join(self.tmpdir, 'skel')
+        os.makedirs(self.skel)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_importusers(self):
+        config = self.write('tools.conf', '[database]\nhost = importhomes.invalid\n[cache]\nsize = 0\n'
+                                          '[homes]\njournal = %s\n' % os.path.join(self.tmpdir, 'homes.journal'))
+        homes = [os.path.join(self.tmpdir, name) for name in ('a', 'b', 'c')]
+        passwd = self.write('passwd', ''.join('%s:x:%d:%d::%s:/bin/sh\n' % (name, os.getuid(), os.getgid(), homes[i])
+                                              for i, name in enumerate(('a', 'b', 'c'))))
+        shadow = self.write('shadow', 'a:!:0::::::\nb:!:0::::::\nc:!:0::::::\n')
+        get_pool(get_config(config)).idle.append(CursorConnection())
+
+        result = CliRunner().invoke(importusers, ['-m', '-b', '2', '-k', self.skel, '--passwd', passwd,
+                                                  '--shadow', shadow, '--config', config, '0', str(os.getuid())])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertListEqual([os.path.isdir(home) for home in homes], [True, True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,11 +14,40 @@ from builtins import open
 import pymysql
 from future import standard_library
 
-from pammysqltools.manager import UserManager, GroupManager, GroupListManager
+from pammysqltools.cache import LookupCache
+from pammysqltools.manager import UserManager, GroupManager, GroupListManager, SchemaManager, AccountManager
 
 standard_library.install_aliases()
 
 
+class StatementTests(unittest.TestCase):
+    def test_compile(self):
+        config = ConfigParser()
+        config.read_dict({'tables': {'user': 'accounts'}, 'fields': {'uid': 'user_id'}})
+        um = UserManager(config, None)
+
+        self.assertEqual(um.sql['getuserbyuid'], "SELECT * FROM `accounts` WHERE `user_id`=%s LIMIT 1")
+        self.assertEqual(um._statement('update', ('username', 'uid', 'shell')),
+                         "UPDATE `accounts` SET `user_id` = %s, `shell` = %s WHERE `username` = %s;")
+        self.assertIs(um._statement('insert', ('username', 'uid')), um._statement('insert', ('username', 'uid')))
+
+        config.set('fields', 'uid', 'uidnumber')
+        um.compile()
+        self.assertEqual(um.sql['getuserbyuid'], "SELECT * FROM `accounts` WHERE `uidnumber`=%s LIMIT 1")
+        self.assertEqual(um._statement('insertmany', ('username', 'uid')),
+                         "INSERT INTO `accounts` (`username`, `uidnumber`) VALUES (%s, %s)")
+
+    def test_compile_account(self):
+        config = ConfigParser()
+        config.read_dict({'tables': {'user': 'accounts'}})
+        am = AccountManager(config, None)
+
+        config.read_dict({'tables': {'user': 'people'}, 'fields': {'uid': 'uidnumber'}})
+        am.compile()
+        self.assertEqual(am.um.table, 'people')
+        self.assertEqual(am.um.sql['getuserbyuid'], "SELECT * FROM `people` WHERE `uidnumber`=%s LIMIT 1")
+
+
 class ManagerTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -74,6 +103,23 @@ class UserManagerTests(ManagerTests):
     def test_adduser(self):
         self.um.adduser(**self.testuser)
 
+    def test_addusers(self):
+        count = self.um.addusers([self.testuser, self.testuser2, {u'username': u'minimal', u'uid': 1002,
+                                                                  u'gid': 1002, u'homedir': u'/home/minimal',
+                                                                  u'shell': u'/bin/sh', u'lstchg': 0,
+                                                                  u'gecos': None}], batch_size=2)
+        self.assertEqual(count, 3)
+
+        user = self.um.getuserbyusername(self.testuser2['username'])
+        del user['id']
+        self.assertDictEqual(user, self.testuser2)
+
+        user = self.um.getuserbyuid(1002)
+        self.assertEqual(user[u'maxi'], 99999)
+
+        with self.assertRaises(TypeError):
+            self.um.addusers([{u'username': u'x', u'unknown': 1}])
+
     def test_getuserbyuid(self):
         self.um.adduser(**self.testuser)
 
@@ -97,6 +143,40 @@ class UserManagerTests(ManagerTests):
         with self.assertRaises(KeyError):
             self.um.getuserbyusername(self.testuser2['username'])
 
+    def test_cache(self):
+        um = UserManager(self.config, self.dbs, cache=LookupCache())
+        um.adduser(**self.testuser)
+
+        um.getuserbyusername(self.testuser['username'])
+        um.getuserbyuid(self.testuser['uid'])
+        self.assertEqual(um.cache.hits, 0)
+        um.getuserbyuid(self.testuser['uid'])
+        self.assertEqual(um.cache.hits, 1)
+
+        um.moduser(self.testuser['username'], shell='/bin/false')
+        self.assertEqual(um.getuserbyuid(self.testuser['uid'])['shell'], '/bin/false')
+
+        um.deluser(self.testuser['username'])
+        with self.assertRaises(KeyError):
+            um.getuserbyuid(self.testuser['uid'])
+
+    def test_getalluids(self):
+        self.um.adduser(**self.testuser)
+        self.um.adduser(**self.testuser2)
+        self.um.adduser(**self.testuser3)
+
+        self.assertListEqual(sorted(self.um.getalluids()), [1000, 1001])
+
+    def test_iterusers(self):
+        self.um.addusers([self.testuser, self.testuser2, self.testuser3])
+
+        users = [self.um.logicalrow(row)['username'] for row in self.um.iterusers(page_size=2)]
+        self.assertListEqual(users, ['testuser', 'testuser2', 'testuser3'])
+
+        users = [row['username'] for row in self.um.iterusers(uid_min=1001, shell='/bin/zsh', page_size=1)]
+        self.assertListEqual(users, ['testuser3'])
+        self.assertListEqual(list(self.um.iterusers(uid_max=999)), [])
+
     def test_deluser(self):
         self.um.adduser(**self.testuser)
         self.um.adduser(**self.testuser2)
@@ -112,6 +192,28 @@ class UserManagerTests(ManagerTests):
         del user['id']
         self.assertEqual(user, self.testuser2)
 
+    def test_getconflicts_user(self):
+        self.um.adduser(**self.testuser)
+
+        self.assertListEqual(self.um.getconflicts(username=self.testuser['username'], uid=self.testuser['uid']),
+                             ['username', 'uid'])
+        self.assertListEqual(self.um.getconflicts(username=self.testuser2['username'], uid=self.testuser['uid']),
+                             ['uid'])
+        self.assertListEqual(self.um.getconflicts(username=self.testuser['username']), ['username'])
+        self.assertListEqual(self.um.getconflicts(username=self.testuser2['username'], uid=self.testuser2['uid']), [])
+
+    def test_moduser_missing(self):
+        self.um.adduser(**self.testuser)
+
+        # Setting the current values matches the row without changing it
+        self.um.moduser(username_old=self.testuser['username'], shell=self.testuser['shell'])
+
+        with self.assertRaises(KeyError):
+            self.um.moduser(username_old=self.testuser2['username'], shell='/bin/false')
+
+        with self.assertRaises(KeyError):
+            self.um.deluser(self.testuser2['username'])
+
     def test_moduser(self):
         self.um.adduser(**self.testuser)
 
@@ -154,6 +256,14 @@ class GroupManagerTests(ManagerTests):
     def test_groupadd(self):
         self.gm.addgroup(**self.testgroup)
 
+    def test_addgroups(self):
+        count = self.gm.addgroups([self.testgroup, self.testgroup2], batch_size=1)
+        self.assertEqual(count, 2)
+
+        group = self.gm.getgroupbygid(self.testgroup2['gid'])
+        del group['id']
+        self.assertDictEqual(group, self.testgroup2)
+
     def test_getgroupbygid(self):
         self.gm.addgroup(**self.testgroup)
         group = self.gm.getgroupbygid(self.testgroup['gid'])
@@ -176,6 +286,45 @@ class GroupManagerTests(ManagerTests):
         with self.assertRaises(KeyError):
             self.gm.getgroupbyname(self.testgroup2['name'])
 
+    def test_getallgids(self):
+        self.gm.addgroup(**self.testgroup)
+        self.gm.addgroup(**self.testgroup2)
+
+        self.assertListEqual(sorted(self.gm.getallgids()), [1000, 1001])
+
+    def test_getgidsbyname(self):
+        self.gm.addgroups([self.testgroup, self.testgroup2])
+
+        self.assertDictEqual(self.gm.getgidsbyname(['testgroup', 'testgroup2', 'missing']),
+                             {'testgroup': 1000, 'testgroup2': 1001})
+        self.assertDictEqual(self.gm.getgidsbyname([]), {})
+
+    def test_itergroups(self):
+        self.gm.addgroups([self.testgroup, self.testgroup2])
+
+        self.assertListEqual([row['name'] for row in self.gm.itergroups(page_size=1)], ['testgroup', 'testgroup2'])
+        self.assertListEqual([row['name'] for row in self.gm.itergroups(gid_min=1001)], ['testgroup2'])
+
+    def test_getconflicts_group(self):
+        self.gm.addgroup(**self.testgroup)
+
+        self.assertListEqual(self.gm.getconflicts(name=self.testgroup['name'], gid=self.testgroup['gid']),
+                             ['name', 'gid'])
+        self.assertListEqual(self.gm.getconflicts(gid=self.testgroup['gid']), ['gid'])
+        self.assertListEqual(self.gm.getconflicts(name=self.testgroup2['name'], gid=self.testgroup2['gid']), [])
+
+    def test_modgroup_missing(self):
+        self.gm.addgroup(**self.testgroup)
+
+        # Setting the current values matches the row without changing it
+        self.gm.modgroup(self.testgroup['name'], None, self.testgroup['gid'], None)
+
+        with self.assertRaises(KeyError):
+            self.gm.modgroup(self.testgroup2['name'], None, self.testgroup2['gid'], None)
+
+        with self.assertRaises(KeyError):
+            self.gm.delgroup(self.testgroup2['gid'])
+
     def test_delgroup(self):
         self.gm.addgroup(**self.testgroup)
         self.gm.addgroup(**self.testgroup2)
@@ -225,6 +374,47 @@ class GroupListManagerTests(ManagerTests):
     def test_addgroupuser(self):
         self.glm.addgroupuser(**self.testgrouplist)
 
+    def test_addgroupusers(self):
+        count = self.glm.addgroupusers([self.testgrouplist, self.testgrouplist2, self.testgrouplist3])
+        self.assertEqual(count, 3)
+
+        self.assertListEqual(sorted(self.glm.getgroupsforusername(self.testgrouplist['username'])), [1000, 1001])
+
+    def test_itermemberships(self):
+        self.glm.addgroupusers([self.testgrouplist, self.testgrouplist2, self.testgrouplist3])
+
+        self.assertEqual(len(list(self.glm.itermemberships(page_size=2))), 3)
+        self.assertListEqual([row['username'] for row in self.glm.itermemberships(gid=1000)], ['testuser', 'testuser2'])
+
+    def test_setusergroups(self):
+        self.glm.addgroupusers([self.testgrouplist, self.testgrouplist2, self.testgrouplist3])
+
+        self.assertEqual(self.glm.setusergroups('testuser', [1001, 1002, 1002]), (1, 1))
+        self.assertListEqual(sorted(self.glm.getgroupsforusername('testuser')), [1001, 1002])
+        self.assertEqual(self.glm.setusergroups('testuser', [1000], append=True), (1, 0))
+        self.assertListEqual(sorted(self.glm.getgroupsforusername('testuser')), [1000, 1001, 1002])
+        self.assertEqual(self.glm.setusergroups('testuser', []), (0, 3))
+        self.assertListEqual(self.glm.getgroupsforusername('testuser2'), [1000])
+
+    def test_groupmembers(self):
+        self.glm.addgroupusers([self.testgrouplist, self.testgrouplist2, self.testgrouplist3])
+
+        self.assertEqual(self.glm.addgroupmembers(1000, ['testuser', 'a', 'b', 'a']), 2)
+        self.assertListEqual(self.glm.getusersforgid(1000), ['testuser', 'testuser2', 'a', 'b'])
+        self.assertEqual(self.glm.delgroupmembers(1000, ['a', 'missing'], batch_size=1), 1)
+        self.assertEqual(self.glm.setgroupmembers(1000, ['b', 'c', 'testuser']), (1, 1))
+        self.assertListEqual(sorted(self.glm.getusersforgid(1000)), ['b', 'c', 'testuser'])
+        self.assertEqual(self.glm.setgroupmembers(1000, []), (0, 3))
+        self.assertListEqual(self.glm.getusersforgid(1000), [])
+        self.assertListEqual(self.glm.getusersforgid(1001), ['testuser'])
+
+    def test_getusersforgids(self):
+        self.glm.addgroupusers([self.testgrouplist, self.testgrouplist2, self.testgrouplist3])
+
+        self.assertDictEqual(self.glm.getusersforgids([1000, 1001, 1002]),
+                             {1000: ['testuser', 'testuser2'], 1001: ['testuser']})
+        self.assertDictEqual(self.glm.getusersforgids([]), {})
+
     def test_getgroupsforuser(self):
         self.glm.addgroupuser(**self.testgrouplist)
 
@@ -281,5 +471,89 @@ class GroupListManagerTests(ManagerTests):
                          self.glm.getgroupsforusername(self.testgrouplist3[u'username']))
 
 
+class AccountManagerTests(ManagerTests):
+    @classmethod
+    def setUpClass(cls):
+        ManagerTests.setUpClass()
+        cls.am = AccountManager(cls.config, cls.dbs)
+
+    def test_createaccount(self):
+        self.am.createaccount(username='testuser', gid=1000, uid=1000, groups=[2000, 2001, 2000], usergroup=True,
+                              homedir='/home/testuser', shell='/bin/sh', lstchg=0)
+
+        self.assertEqual(self.am.um.getuserbyusername('testuser')['uid'], 1000)
+        self.assertEqual(self.am.gm.getgroupbyname('testuser')['gid'], 1000)
+        self.assertListEqual(sorted(self.am.glm.getgroupsforusername('testuser')), [2000, 2001])
+
+    def test_moduser_rename(self):
+        self.am.createaccount(username='testuser', gid=1000, uid=1000, groups=[2000, 2001], homedir='/home/testuser',
+                              shell='/bin/sh', lstchg=0)
+        self.am.glm.addgroupuser('otheruser', 2000)
+
+        self.am.moduser(username_old='testuser', username='renamed', shell='/bin/false')
+
+        self.assertEqual(self.am.um.getuserbyusername('renamed')['shell'], '/bin/false')
+        self.assertListEqual(sorted(self.am.glm.getgroupsforusername('renamed')), [2000, 2001])
+        self.assertListEqual(self.am.glm.getusersforgid(2000), ['renamed', 'otheruser'])
+        with self.assertRaises(KeyError):
+            self.am.moduser(username_old='testuser', username='other')
+
+    def test_modgroup_renumber(self):
+        self.am.createaccount(username='testuser', gid=1000, uid=1000, groups=[2000], usergroup=True,
+                              homedir='/home/testuser', shell='/bin/sh', lstchg=0)
+        self.am.createaccount(username='testuser2', gid=2000, uid=1001, groups=[1000], homedir='/home/testuser2',
+                              shell='/bin/sh', lstchg=0)
+
+        self.am.modgroup(name_old='testuser', name='renumbered', gid=3000)
+
+        self.assertEqual(self.am.gm.getgroupbyname('renumbered')['gid'], 3000)
+        self.assertEqual(self.am.um.getuserbyusername('testuser')['gid'], 3000)
+        self.assertEqual(self.am.um.getuserbyusername('testuser2')['gid'], 2000)
+        self.assertListEqual(self.am.glm.getgroupsforusername('testuser2'), [3000])
+        self.assertListEqual(self.am.glm.getgroupsforusername('testuser'), [2000])
+        with self.assertRaises(KeyError):
+            self.am.modgroup(name_old='missing', gid=4000, gid_old=2000)
+        self.assertEqual(self.am.um.getuserbyusername('testuser2')['gid'], 2000)
+
+    def test_createaccount_without_group(self):
+        self.am.createaccount(username='testuser', gid=100, uid=1000, homedir='/home/testuser', shell='/bin/sh',
+                              lstchg=0)
+
+        with self.assertRaises(KeyError):
+            self.am.gm.getgroupbyname('testuser')
+        with self.assertRaises(KeyError):
+            self.am.glm.getgroupsforusername('testuser')
+
+
+class SchemaManagerTests(ManagerTests):
+    @classmethod
+    def setUpClass(cls):
+        ManagerTests.setUpClass()
+        cls.sm = SchemaManager(cls.config, cls.dbs)
+
+    def test_missingindexes(self):
+        self.assertListEqual(self.sm.missingindexes(), [])
+
+    def test_migrate(self):
+        with self.dbs.cursor() as cur:
+            cur.execute("ALTER TABLE `grouplist` DROP INDEX `username_gid`")
+            cur.execute("ALTER TABLE `user` DROP INDEX `uid`")
+
+        added = self.sm.migrate()
+        self.assertListEqual(sorted((table, name) for table, name, fields, unique in added),
+                             [('grouplist', 'username_gid'), ('user', 'uid')])
+        self.assertListEqual(self.sm.missingindexes(), [])
+
+    def test_createtables(self):
+        self.sm.createtables()
+        self.assertListEqual(self.sm.missingindexes(), [])
+
+    def test_explain(self):
+        um = UserManager(self.config, self.dbs)
+        um.addusers(dict(UserManagerTests.testuser, username='user%d' % i, uid=1000 + i) for i in range(100))
+
+        self.assertNotIn(None, self.sm.explain().values())
+
+
 if __name__ == '__main__':
     unittest.main()
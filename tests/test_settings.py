@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pammysqltools.settings import Settings, load_settings, parse_defs, parse_assignments
+
+
+class SettingsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_typed(self):
+        defs = Settings({'UID_MIN': '1000', 'UMASK': '027', 'USERGROUPS_ENAB': 'yes', 'ENCRYPT_METHOD': 'SHA512'})
+
+        self.assertEqual(defs.getint('UID_MIN'), 1000)
+        self.assertEqual(defs.getint('UID_MAX', 60000), 60000)
+        self.assertEqual(defs.getoctal('UMASK'), 0o027)
+        self.assertTrue(defs.getboolean('USERGROUPS_ENAB'))
+        with self.assertRaises(ValueError):
+            defs.getint('ENCRYPT_METHOD')
+
+    def test_override(self):
+        defs = Settings({'UID_MIN': '1000', 'UID_MAX': '60000'})
+
+        overridden = defs.override([('UID_MIN', '2000')])
+
+        self.assertEqual(overridden.getint('UID_MIN'), 2000)
+        self.assertEqual(overridden.getint('UID_MAX'), 60000)
+        self.assertEqual(defs.getint('UID_MIN'), 1000)
+        self.assertDictEqual(overridden.overrides(), {'UID_MIN': '2000'})
+        self.assertDictEqual(dict(overridden), {'UID_MIN': '2000', 'UID_MAX': '60000'})
+        self.assertIs(defs.override([]), defs)
+        with self.assertRaises(TypeError):
+            defs['UID_MIN'] = '0'
+
+    def test_parse(self):
+        defs = load_settings(self.write('login.defs', '# comment\nUID_MIN\t\t 1000\nMAIL_DIR /var/mail\n\n'),
+                             parse_defs)
+        useradd = load_settings(self.write('useradd', 'SHELL=/bin/sh\n# HOME=/home\nSKEL="/etc/skel"\n'),
+                                parse_assignments)
+
+        self.assertDictEqual(dict(defs), {'UID_MIN': '1000', 'MAIL_DIR': '/var/mail'})
+        self.assertDictEqual(dict(useradd), {'SHELL': '/bin/sh', 'SKEL': '/etc/skel'})
+        self.assertEqual(len(load_settings(os.path.join(self.tmpdir, 'missing'), parse_defs)), 0)
+
+    def test_reload(self):
+        path = self.write('login.defs', 'UID_MIN 1000\n', mtime=1000000)
+        defs = load_settings(path, parse_defs)
+        self.assertIs(load_settings(path, parse_defs), defs)
+
+        self.write('login.defs', 'UID_MIN 2000\n', mtime=2000000)
+        self.assertEqual(load_settings(path, parse_defs).getint('UID_MIN'), 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+#: Upper limit for importing pammysqltools.scripts in milliseconds, the wall clock check only runs when it is set
+BUDGET = os.getenv("PAMMYSQL_STARTUP_BUDGET_MS")
+
+#: Modules only the commands that need them may load
+LAZY = ('pymysql', 'pammysqltools.manager', 'pammysqltools.batch', 'pammysqltools.daemon', 'pammysqltools.journal',
+        'pammysqltools.export', 'pammysqltools.sync', 'multiprocessing.pool', 'future.standard_library')
+
+
+def importtime(module):
+    """
+    Imports a module in a fresh interpreter with -X importtime
+
+    :return: A dictionary of the imported modules to their cumulative import time in microseconds
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.py') as f:
+        # The entry points need __main__.__file__, so the import runs from a script file
+        f.write('import %s\n' % module)
+        f.flush()
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        process = subprocess.Popen([sys.executable, '-X', 'importtime', f.name], stderr=subprocess.PIPE, env=env)
+        stderr = process.communicate()[1].decode('utf-8')
+
+    times = dict()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime needs Python 3.7")
+class StartupTestCase(unittest.TestCase):
+    def test_lazy_imports(self):
+        times = importtime('pammysqltools.scripts')
+
+        self.assertIn('pammysqltools.scripts', times)
+        self.assertListEqual([module for module in LAZY if module in times], [])
+
+    @unittest.skipUnless(BUDGET, "set PAMMYSQL_STARTUP_BUDGET_MS to check the import time")
+    def test_budget(self):
+        # The best of three runs, the first one may still read the files from disk
+        best = min(importtime('pammysqltools.scripts')['pammysqltools.scripts'] for _ in range(3))
+
+        self.assertLess(best / 1000.0, float(BUDGET))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pammysqltools.manager import UserManager, GroupManager, GroupListManager, fingerprint
+from pammysqltools.sync import Synchronizer, normalize, read_users, read_groups, USER_DEFAULTS
+from tests.test_manager import ManagerTests
+
+
+class SourceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_read_users(self):
+        users = list(read_users(self.write('passwd', 'a:x:2000:100::/home/a:/bin/sh\nb:x:2001:100::/home/b:/bin/sh\n'),
+                                self.write('shadow', 'a:ABCD:17000:0:99999:7:::\n')))
+
+        self.assertEqual(len(users), 1)
+        user = normalize(users[0], USER_DEFAULTS)
+        self.assertEqual((user['uid'], user['gecos'], user['password'], user['inact']), (2000, '', 'ABCD', -1))
+
+    def test_read_groups(self):
+        groups = list(read_groups(self.write('group', 'staff:x:100:a,b\nempty:x:101:\n'),
+                                  self.write('gshadow', 'staff:!::a,b\nempty:!::\n')))
+
+        self.assertListEqual([(group['name'], members) for group, members in groups],
+                             [('staff', ['a', 'b']), ('empty', [])])
+
+    def test_fingerprint(self):
+        fields = UserManager.fields
+        user = {'username': 'a', 'uid': '2000', 'gid': '100', 'homedir': '/home/a', 'shell': '/bin/sh'}
+
+        self.assertEqual(fingerprint(normalize(user, USER_DEFAULTS), fields),
+                         fingerprint(normalize(dict(user, uid=2000, gecos=''), USER_DEFAULTS), fields))
+        self.assertNotEqual(fingerprint(normalize(user, USER_DEFAULTS), fields),
+                            fingerprint(normalize(dict(user, shell='/bin/bash'), USER_DEFAULTS), fields))
+
+
+class SynchronizerTests(ManagerTests):
+    users = [{'username': 'a', 'uid': 2000, 'gid': 100, 'homedir': '/home/a', 'shell': '/bin/sh'},
+             {'username': 'b', 'uid': 2001, 'gid': 100, 'homedir': '/home/b', 'shell': '/bin/sh'}]
+
+    def test_syncusers(self):
+        UserManager(self.config, self.dbs).addusers([
+            normalize(dict(self.users[0], shell='/bin/bash'), USER_DEFAULTS),
+            normalize(dict(self.users[1], username='c'), USER_DEFAULTS),
+            normalize(dict(self.users[1], username='d', uid=10), USER_DEFAULTS)])
+
+        changes = list(Synchronizer(self.config, self.dbs, batch_size=1).syncusers(self.users, 1000, 60000))
+        self.assertListEqual(sorted((c.action, c.key) for c in changes),
+                             [('delete', 'c'), ('insert', 'b'), ('update', 'a')])
+        self.assertEqual(UserManager(self.config, self.dbs).getuserbyusername('a')['shell'], '/bin/sh')
+        self.assertEqual(UserManager(self.config, self.dbs).getuserbyusername('d')['uid'], 10)
+
+        self.assertListEqual(list(Synchronizer(self.config, self.dbs).syncusers(self.users, 1000, 60000)), [])
+
+    def test_syncusers_without_unique_index(self):
+        with self.dbs.cursor() as cur:
+            cur.execute("ALTER TABLE `user` DROP INDEX `username`")
+        UserManager(self.config, self.dbs).addusers([normalize(dict(self.users[0], shell='/bin/bash'), USER_DEFAULTS)])
+
+        changes = list(Synchronizer(self.config, self.dbs).syncusers(self.users, 1000, 60000))
+
+        self.assertListEqual(sorted((c.action, c.key) for c in changes), [('insert', 'b'), ('update', 'a')])
+        with self.dbs.cursor() as cur:
+            cur.execute("SELECT `username`, `shell` FROM `user` ORDER BY `username`")
+            self.assertListEqual(list(cur.fetchall()), [('a', '/bin/sh'), ('b', '/bin/sh')])
+
+    def test_syncgroups(self):
+        GroupManager(self.config, self.dbs).addgroups([{'name': 'staff', 'gid': 100}, {'name': 'old', 'gid': 101}])
+        GroupListManager(self.config, self.dbs).addgroupusers([{'username': 'a', 'gid': 100},
+                                                               {'username': 'c', 'gid': 100}])
+
+        groups = [({'name': 'staff', 'gid': 100}, ['a', 'b'])]
+        dry = Synchronizer(self.config, self.dbs, dry_run=True)
+        self.assertEqual(len(list(dry.syncgroups(groups, 100, 200))), 3)
+        self.assertEqual(len(list(GroupManager(self.config, self.dbs).itergroups())), 2)
+
+        changes = list(Synchronizer(self.config, self.dbs).syncgroups(groups, 100, 200))
+        self.assertListEqual(sorted((c.action, c.table) for c in changes),
+                             [('delete', 'group'), ('delete', 'grouplist'), ('insert', 'grouplist')])
+        self.assertDictEqual(GroupListManager(self.config, self.dbs).getusersforgids([100]), {100: ['a', 'b']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,9 @@ CREATE TABLE `group` (
   `name` varchar(255) NOT NULL,
   `gid` int(10) unsigned NOT NULL,
   `password` varchar(255) NOT NULL DEFAULT '!',
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `name` (`name`),
+  KEY `gid` (`gid`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
@@ -15,7 +17,9 @@ CREATE TABLE `grouplist` (
   `id` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
   `username` varchar(255) NOT NULL,
   `gid` int(10) unsigned NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `username_gid` (`username`,`gid`),
+  KEY `gid` (`gid`)
 ) ENGINE=InnoDB AUTO_INCREMENT=6 DEFAULT CHARSET=utf8;
 
 
@@ -37,5 +41,8 @@ CREATE TABLE `user` (
   `inact` bigint(20) NOT NULL DEFAULT '-1',
   `expire` bigint(20) NOT NULL DEFAULT '-1',
   `flag` int(11) NOT NULL DEFAULT '-1',
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `username` (`username`),
+  KEY `uid` (`uid`),
+  KEY `gid` (`gid`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
\ No newline at end of file
@@ -7,7 +7,9 @@ CREATE TABLE IF NOT EXISTS `group` (
   `name`     VARCHAR(255)        NOT NULL,
   `gid`      INT(10) UNSIGNED    NOT NULL,
   `password` VARCHAR(255)        NOT NULL DEFAULT '!',
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `name` (`name`),
+  KEY `gid` (`gid`)
 )
   ENGINE = InnoDB
   DEFAULT CHARSET = utf8;
@@ -16,7 +18,9 @@ CREATE TABLE IF NOT EXISTS `grouplist` (
   `id`       BIGINT(20) UNSIGNED NOT NULL AUTO_INCREMENT,
   `username` VARCHAR(255)        NOT NULL,
   `gid`      INT(10) UNSIGNED    NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `username_gid` (`username`, `gid`),
+  KEY `gid` (`gid`)
 )
   ENGINE = InnoDB
   DEFAULT CHARSET = utf8;
@@ -38,7 +42,10 @@ CREATE TABLE IF NOT EXISTS `user` (
   `inact`    BIGINT(20)          NOT NULL DEFAULT '-1',
   `expire`   BIGINT(20)          NOT NULL DEFAULT '-1',
   `flag`     INT(11)             NOT NULL DEFAULT '-1',
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `username` (`username`),
+  KEY `uid` (`uid`),
+  KEY `gid` (`gid`)
 )
   ENGINE = InnoDB
   DEFAULT CHARSET = utf8;
\ No newline at end of file